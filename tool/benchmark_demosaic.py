@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""
+Timing for the verify_pipeline demosaic kernels.
+
+Runs the reference mask-convolution demosaic (demosaic_bilinear_masked), the
+strided-plane demosaic_bilinear and the half-resolution demosaic_superpixel
+on a DNG mosaic (from the RAW cache) or a synthetic one and reports the
+best-of-N wall time and how far the two bilinear implementations differ on
+that mosaic. The equivalence tests live in test_demosaic.py.
+
+Usage:
+  python benchmark_demosaic.py [--dng <path/to/dng>] [--size 8000 6000] [--repeat 3]
+"""
+
+from __future__ import annotations
+
+import argparse
+import time
+from pathlib import Path
+from typing import Callable, Tuple
+
+import numpy as np
+
+from raw_cache import open_raw
+from verify_pipeline import (
+    BAYER_PATTERNS,
+    cfa_pattern_string,
+    demosaic_bilinear,
+    demosaic_bilinear_masked,
+    demosaic_superpixel,
+)
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Benchmark verify_pipeline demosaic implementations.")
+    parser.add_argument("--dng", type=Path, default=None, help="Use this DNG's mosaic instead of synthetic data.")
+    parser.add_argument(
+        "--size",
+        type=int,
+        nargs=2,
+        default=(4000, 3000),
+        metavar=("WIDTH", "HEIGHT"),
+        help="Synthetic mosaic size (default: 4000 3000).",
+    )
+    parser.add_argument("--pattern", default="RGGB", choices=BAYER_PATTERNS, help="Synthetic CFA pattern.")
+    parser.add_argument("--repeat", type=int, default=3, help="Timed runs per implementation (best is reported).")
+    parser.add_argument("--atol", type=float, default=1e-6, help="Tolerance for the equivalence check.")
+    return parser.parse_args()
+
+
+def load_mosaic(args: argparse.Namespace) -> Tuple[np.ndarray, str]:
+    if args.dng is None:
+        width, height = args.size
+        rng = np.random.default_rng(0)
+        # Slightly out of [0, 1] so clipping paths are exercised too.
+        return rng.uniform(-0.05, 1.05, size=(height, width)).astype(np.float32), args.pattern
+    with open_raw(args.dng) as raw:
+        white = float(raw.white_level) or 1.0
+        mosaic = raw.raw_image_visible.astype(np.float32) / white
+        return mosaic, cfa_pattern_string(raw)
+
+
+def best_time(func: Callable[[], np.ndarray], repeat: int) -> Tuple[float, np.ndarray]:
+    best = float("inf")
+    result = None
+    for _ in range(max(repeat, 1)):
+        start = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main() -> None:
+    args = parse_args()
+    mosaic, pattern = load_mosaic(args)
+    height, width = mosaic.shape
+    print(f"Mosaic {width}x{height}, pattern {pattern}, best of {args.repeat}")
+
+    masked_time, reference = best_time(lambda: demosaic_bilinear_masked(mosaic, pattern), args.repeat)
+    strided_time, strided = best_time(lambda: demosaic_bilinear(mosaic, pattern), args.repeat)
+    superpixel_time, _ = best_time(lambda: demosaic_superpixel(mosaic, pattern), args.repeat)
+
+    max_diff = float(np.max(np.abs(reference - strided))) if reference.size else 0.0
+    mismatched = int(np.count_nonzero(reference != strided))
+    print(f"{'demosaic_bilinear_masked':<26} {masked_time * 1000:9.1f} ms")
+    print(f"{'demosaic_bilinear':<26} {strided_time * 1000:9.1f} ms  ({masked_time / strided_time:.2f}x)")
+    print(f"{'demosaic_superpixel':<26} {superpixel_time * 1000:9.1f} ms  ({masked_time / superpixel_time:.2f}x)")
+    print(f"Max |masked - strided|: {max_diff:.3g} ({mismatched} differing values)")
+    if not np.allclose(reference, strided, rtol=0.0, atol=args.atol):
+        raise SystemExit(f"demosaic_bilinear deviates from the reference by {max_diff:.3g} (> {args.atol}).")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,283 @@
+#!/usr/bin/env python3
+"""
+Persistent index of capture directories (metadata.json + DNG pairs).
+
+Phone dump trees hold thousands of snapshot folders, and re-globbing all of
+them for every run takes seconds. The index records, in SQLite, each
+directory's mtime, its subdirectories and the captures it contains together
+with their selection score. A refresh stats every directory but only lists
+the ones whose mtime changed, so "best capture" and "latest snapshot"
+queries are answered from the database.
+
+A directory's mtime changes when entries are added, removed or renamed in
+it, which is how the app publishes files. A metadata file rewritten in place
+keeps its indexed mtime until its directory changes.
+
+Index location: $COLOR_TOOL_CAPTURE_INDEX, or
+~/.cache/color_design_tool/capture_index.sqlite3.
+
+Usage:
+  python capture_index.py --root <dump_dir> [--root ...] [--list] [--rebuild]
+"""
+
+from __future__ import annotations
+
+import argparse
+import os
+import sqlite3
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+INDEX_ENV = "COLOR_TOOL_CAPTURE_INDEX"
+DEFAULT_INDEX_PATH = Path.home() / ".cache" / "color_design_tool" / "capture_index.sqlite3"
+INDEX_FORMAT = 1
+
+METADATA_NAME = "metadata.json"
+METADATA_SUFFIX = "_metadata.json"
+DNG_SUFFIXES = (".dng", ".DNG")
+SNAPSHOT_PREFIX = "snapshot_"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS dirs (
+    path TEXT PRIMARY KEY,
+    parent TEXT NOT NULL,
+    name TEXT NOT NULL,
+    mtime_ns INTEGER,
+    scanned_mtime_ns INTEGER
+);
+CREATE INDEX IF NOT EXISTS dirs_parent ON dirs(parent);
+CREATE TABLE IF NOT EXISTS captures (
+    metadata_path TEXT PRIMARY KEY,
+    dir TEXT NOT NULL,
+    score INTEGER NOT NULL,
+    mtime REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS captures_dir ON captures(dir);
+"""
+
+
+def index_path(path: Optional[Path] = None) -> Path:
+    if path is not None:
+        return Path(path)
+    env = os.environ.get(INDEX_ENV)
+    return Path(env) if env else DEFAULT_INDEX_PATH
+
+
+def is_metadata_name(name: str) -> bool:
+    return name == METADATA_NAME or name.endswith(METADATA_SUFFIX)
+
+
+def score_capture(directory: Path, metadata_name: str, dng_stems: Set[str]) -> int:
+    """
+    Preference score of one metadata file in a capture directory: per-shot
+    ``*_metadata.json`` files beat the generic name, a metadata file whose
+    stem matches a DNG wins, and pipeline/debug folders get a small bonus.
+    Ties are broken by the metadata file's mtime.
+    """
+    score = 0
+    if metadata_name.endswith(METADATA_SUFFIX):
+        score += 10
+    meta_stem = metadata_name
+    if meta_stem.lower().endswith(METADATA_SUFFIX):
+        meta_stem = meta_stem[: -len(METADATA_SUFFIX)]
+    if Path(meta_stem).stem.lower() in dng_stems:
+        score += 20
+    dir_str = str(directory).lower()
+    if "pipeline" in dir_str:
+        score += 5
+    if "debug" in dir_str:
+        score += 1
+    return score
+
+
+def _subtree_bounds(path: str) -> Tuple[str, str]:
+    # Every descendant path sorts in [path + sep, path + chr(ord(sep) + 1)).
+    return path + os.sep, path + chr(ord(os.sep) + 1)
+
+
+class CaptureIndex:
+    """SQLite-backed directory index; use as a context manager."""
+
+    def __init__(self, path: Optional[Path] = None) -> None:
+        self.path = index_path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(str(self.path), timeout=30.0)
+        version = self._conn.execute("PRAGMA user_version").fetchone()[0]
+        if version != INDEX_FORMAT:
+            self.clear()
+        self._conn.executescript(_SCHEMA)
+        self._conn.execute(f"PRAGMA user_version = {INDEX_FORMAT}")
+
+    def close(self) -> None:
+        self._conn.close()
+
+    def __enter__(self) -> "CaptureIndex":
+        return self
+
+    def __exit__(self, *exc: object) -> None:
+        self.close()
+
+    def clear(self) -> None:
+        with self._conn:
+            self._conn.execute("DROP TABLE IF EXISTS dirs")
+            self._conn.execute("DROP TABLE IF EXISTS captures")
+        self._conn.executescript(_SCHEMA)
+
+    def _forget(self, path: str) -> None:
+        low, high = _subtree_bounds(path)
+        self._conn.execute("DELETE FROM dirs WHERE path = ? OR (path >= ? AND path < ?)", (path, low, high))
+        self._conn.execute("DELETE FROM captures WHERE dir = ? OR (dir >= ? AND dir < ?)", (path, low, high))
+
+    def _scan(self, directory: Path, mtime_ns: int) -> List[str]:
+        """List ``directory`` and replace its subdirectory and capture rows."""
+        key = str(directory)
+        subdirs: List[str] = []
+        metadata: List[Tuple[str, float]] = []
+        dng_stems: Set[str] = set()
+        try:
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            subdirs.append(entry.name)
+                        elif not entry.is_file():
+                            continue
+                        elif is_metadata_name(entry.name):
+                            metadata.append((entry.name, entry.stat().st_mtime))
+                        elif entry.name.endswith(DNG_SUFFIXES):
+                            dng_stems.add(Path(entry.name).stem.lower())
+                    except OSError:
+                        continue
+        except OSError:
+            pass
+
+        known = {name for (name,) in self._conn.execute("SELECT name FROM dirs WHERE parent = ?", (key,))}
+        for name in known.difference(subdirs):
+            self._forget(str(directory / name))
+        self._conn.executemany(
+            "INSERT OR IGNORE INTO dirs (path, parent, name) VALUES (?, ?, ?)",
+            [(str(directory / name), key, name) for name in subdirs],
+        )
+        self._conn.execute("DELETE FROM captures WHERE dir = ?", (key,))
+        if dng_stems:
+            self._conn.executemany(
+                "INSERT INTO captures (metadata_path, dir, score, mtime) VALUES (?, ?, ?, ?)",
+                [
+                    (str(directory / name), key, score_capture(directory, name, dng_stems), mtime)
+                    for name, mtime in metadata
+                ],
+            )
+        self._conn.execute(
+            "UPDATE dirs SET scanned_mtime_ns = ? WHERE path = ?",
+            (mtime_ns, key),
+        )
+        return subdirs
+
+    def refresh(self, root: Path, max_depth: Optional[int] = None) -> int:
+        """
+        Bring the index for ``root`` up to date and return how many
+        directories had to be listed. Directories deeper than ``max_depth``
+        levels below ``root`` are not visited; those exactly at the limit
+        only have their mtime updated.
+        """
+        root = Path(root).resolve()
+        key = str(root)
+        low, high = _subtree_bounds(key)
+        known = {}
+        children: Dict[str, List[str]] = {}
+        for path, parent, name, mtime_ns, scanned in self._conn.execute(
+            "SELECT path, parent, name, mtime_ns, scanned_mtime_ns FROM dirs WHERE path = ? OR (path >= ? AND path < ?)",
+            (key, low, high),
+        ):
+            known[path] = (mtime_ns, scanned)
+            children.setdefault(parent, []).append(name)
+
+        # Plain strings in the walk: pathlib construction dominates warm refreshes.
+        stack = [(key, 0)]
+        rescanned = 0
+        with self._conn:
+            while stack:
+                key, depth = stack.pop()
+                try:
+                    mtime_ns = os.stat(key).st_mtime_ns
+                except OSError:
+                    self._forget(key)
+                    continue
+                indexed_mtime, scanned = known.get(key, (None, None))
+                if indexed_mtime != mtime_ns:
+                    self._conn.execute(
+                        "INSERT INTO dirs (path, parent, name, mtime_ns) VALUES (?, ?, ?, ?) "
+                        "ON CONFLICT(path) DO UPDATE SET mtime_ns = excluded.mtime_ns",
+                        (key, os.path.dirname(key), os.path.basename(key), mtime_ns),
+                    )
+                if max_depth is not None and depth >= max_depth:
+                    continue
+                if scanned == mtime_ns:
+                    subdirs = children.get(key, [])
+                else:
+                    subdirs = self._scan(Path(key), mtime_ns)
+                    rescanned += 1
+                stack.extend((os.path.join(key, name), depth + 1) for name in subdirs)
+        return rescanned
+
+    def _capture_rows(self, root: Path) -> List[Tuple[int, float, str]]:
+        key = str(Path(root).resolve())
+        low, high = _subtree_bounds(key)
+        return self._conn.execute(
+            "SELECT score, mtime, dir FROM captures WHERE dir = ? OR (dir >= ? AND dir < ?)",
+            (key, low, high),
+        ).fetchall()
+
+    def best_capture(self, roots: Iterable[Path]) -> Optional[Path]:
+        """Highest-scoring (then newest) capture directory under any of ``roots``."""
+        best: Optional[Tuple[int, float, str]] = None
+        refreshed: List[Path] = []
+        for root in roots:
+            root = Path(root).resolve()
+            if any(root == done or done in root.parents for done in refreshed):
+                continue
+            self.refresh(root)
+            refreshed.append(root)
+            for row in self._capture_rows(root):
+                if best is None or row[:2] > best[:2]:
+                    best = row
+        return Path(best[2]) if best is not None else None
+
+    def capture_dirs(self, root: Path) -> List[Path]:
+        """Every capture directory under ``root`` (inclusive), sorted by path."""
+        self.refresh(root)
+        return sorted({Path(row[2]) for row in self._capture_rows(root)})
+
+    def latest_snapshot(self, root: Path, prefix: str = SNAPSHOT_PREFIX) -> Optional[Path]:
+        """Most recently modified direct child of ``root`` whose name starts with ``prefix``."""
+        self.refresh(root, max_depth=1)
+        rows = self._conn.execute(
+            "SELECT path, name, mtime_ns FROM dirs WHERE parent = ?",
+            (str(Path(root).resolve()),),
+        ).fetchall()
+        candidates = [(mtime_ns, path) for path, name, mtime_ns in rows if name.startswith(prefix)]
+        return Path(max(candidates)[1]) if candidates else None
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Build or query the capture-directory index.")
+    parser.add_argument("--root", required=True, type=Path, action="append", help="Directory tree to index (repeatable).")
+    parser.add_argument("--index", type=Path, default=None, help="Override the index database path.")
+    parser.add_argument("--list", action="store_true", help="Print every indexed capture directory.")
+    parser.add_argument("--rebuild", action="store_true", help="Drop the index and rescan from scratch.")
+    args = parser.parse_args()
+    with CaptureIndex(args.index) as index:
+        if args.rebuild:
+            index.clear()
+        for root in args.root:
+            rescanned = index.refresh(root)
+            print(f"{root}: {rescanned} directories rescanned")
+            if args.list:
+                for capture in index.capture_dirs(root):
+                    print(f"  {capture}")
+        best = index.best_capture(args.root)
+        print(f"Best capture: {best}" if best is not None else "No captures found.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,442 @@
+#!/usr/bin/env python3
+"""
+Precomputed ColorMatrix interpolation for DNG-style dual-illuminant cameras.
+
+The DNG interpolation (RawRoiProcessor on the device, and
+verify_pipeline.interpolate_color_matrices here) finds the white of a
+capture by a fixed-point loop. Each pass estimates the CCT from the
+current xy, blends ColorMatrix/CameraCalibration between the bracketing
+calibration illuminants (linearly in inverse CCT), and maps AsShotNeutral
+back to XYZ through the pseudo-inverse of the blended XYZ->Camera matrix.
+Done per capture in scalar Python, that is up to ten pinv calls each.
+
+ColorMatrixInterpolator does the blending once per camera. It tabulates
+XYZ->Camera and its pseudo-inverse on a dense, uniform inverse-CCT (mired)
+grid over the calibration range. The fixed-point loop then runs on linear
+interpolation in that table, for a whole (N, C) batch of neutrals at once.
+A short exact refinement with the true blended matrices (one batched
+linear solve per pass) makes the result match the per-capture loop.
+Interpolators are cached per calibration set by color_matrix_interpolator();
+solve_white_points() runs a whole collection of captures that share one
+calibration set and reports per-capture convergence.
+
+Usage:
+  python ccm_interpolation.py --metadata <capture.json> [--batch 10000]   # resolve + benchmark
+  python ccm_interpolation.py --campaign <captures_root> [--csv out.csv]  # white-point statistics
+"""
+
+from __future__ import annotations
+
+import argparse
+import csv
+import hashlib
+import json
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+# Nodes of the mired table; the calibration range (~200 mired) gets < 0.1 mired spacing.
+TABLE_SIZE = 2049
+MAX_ITERATIONS = 10
+CONVERGENCE_TOL = 1e-6
+# Fallback white when no calibration maps the neutral to a positive xy.
+DEFAULT_XY = (0.3127, 0.3290)
+
+# (cct, neutrals) -> low, high, weight and the XYZ of each neutral.
+WhiteLookup = Callable[[np.ndarray, np.ndarray], Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]]
+
+
+def xy_to_cct(xy: np.ndarray) -> np.ndarray:
+    """McCamy's CCT for (..., 2) chromaticities; NaN where it is undefined or not positive."""
+    xy = np.asarray(xy, dtype=np.float64)
+    denom = 0.1858 - xy[..., 1]
+    valid = np.abs(denom) >= 1e-9
+    n = np.divide(xy[..., 0] - 0.3320, denom, out=np.zeros_like(denom), where=valid)
+    cct = 449.0 * n**3 + 3525.0 * n**2 + 6823.3 * n + 5520.33
+    return np.where(valid & (cct > 0), cct, np.nan)
+
+
+def _snap_weight(weight: np.ndarray) -> np.ndarray:
+    # The blend returns the endpoint matrix itself when the weight is within isclose() of 0 or 1.
+    return np.where(np.isclose(weight, 0.0), 0.0, np.where(np.isclose(weight, 1.0), 1.0, weight))
+
+
+@dataclass
+class InterpolationResult:
+    """Per-capture outcome of ColorMatrixInterpolator.resolve_batch; all arrays share the leading N."""
+
+    xy: np.ndarray
+    cct: np.ndarray
+    low: np.ndarray
+    high: np.ndarray
+    weight: np.ndarray
+    color_matrix: np.ndarray
+    # False where the exact passes stopped on the iteration limit or a degenerate XYZ.
+    converged: np.ndarray
+    # Exact refinement passes per capture (after the table loop).
+    iterations: np.ndarray
+
+    def __len__(self) -> int:
+        return len(self.cct)
+
+
+class ColorMatrixInterpolator:
+    """
+    Blended XYZ->Camera matrices for one calibration set, tabulated on a
+    mired grid. ``ccts`` must be ascending; ``color_matrices`` and
+    ``camera_calibrations`` are (K, C, 3) and (K, C, C).
+    """
+
+    def __init__(
+        self,
+        ccts: Sequence[float],
+        color_matrices: np.ndarray,
+        camera_calibrations: np.ndarray,
+        analog_balance: np.ndarray,
+        names: Optional[Sequence[str]] = None,
+        table_size: int = TABLE_SIZE,
+    ) -> None:
+        self.ccts = np.asarray(ccts, dtype=np.float64)
+        self.color_matrices = np.asarray(color_matrices, dtype=np.float64)
+        self.camera_calibrations = np.asarray(camera_calibrations, dtype=np.float64)
+        self.analog_balance = np.asarray(analog_balance, dtype=np.float64)
+        self.names = list(names) if names is not None else [f"cal{i + 1}" for i in range(len(self.ccts))]
+        if len(self.ccts) == 0 or np.any(np.diff(self.ccts) < 0):
+            raise ValueError("Calibration CCTs must be non-empty and ascending.")
+        self.color_planes = self.color_matrices.shape[1]
+
+        # Mired decreases with CCT: the grid runs from the warmest to the coolest calibration.
+        self.mired_max = 1e6 / self.ccts[0]
+        self.mired_min = 1e6 / self.ccts[-1]
+        size = table_size if self.mired_max > self.mired_min else 1
+        self.mired_grid = np.linspace(self.mired_max, self.mired_min, size)
+        self.table_xyz_to_camera = self.xyz_to_camera(1e6 / self.mired_grid)
+        self.table_camera_to_xyz = np.linalg.pinv(self.table_xyz_to_camera)
+
+        # Inverse ColorMatrix per calibration for the initial xy guess (square matrices only).
+        self._initial_inverses: List[Optional[np.ndarray]] = []
+        for matrix in self.color_matrices:
+            try:
+                self._initial_inverses.append(np.linalg.inv(matrix))
+            except np.linalg.LinAlgError:
+                self._initial_inverses.append(None)
+
+    @classmethod
+    def from_calibrations(cls, calibrations: Sequence[dict], analog_balance: np.ndarray) -> "ColorMatrixInterpolator":
+        """Build from verify_pipeline.gather_calibration_sets entries (sorted by CCT)."""
+        return cls(
+            ccts=[cal["cct"] for cal in calibrations],
+            color_matrices=np.stack([cal["color_matrix"] for cal in calibrations]),
+            camera_calibrations=np.stack([cal["camera_calibration"] for cal in calibrations]),
+            analog_balance=analog_balance,
+            names=[cal["name"] for cal in calibrations],
+        )
+
+    def pair_weights(self, cct: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Bracketing calibration indices and inverse-CCT blend weight per CCT.
+        CCTs outside the calibrated range use the nearest calibration alone,
+        NaN CCTs the warmest one.
+        """
+        cct = np.asarray(cct, dtype=np.float64)
+        count = len(self.ccts)
+        low = np.zeros(cct.shape, dtype=np.int64)
+        high = np.zeros(cct.shape, dtype=np.int64)
+        weight = np.zeros(cct.shape, dtype=np.float64)
+        if count == 1:
+            return low, high, weight
+        known = np.isfinite(cct)
+        above = known & (cct >= self.ccts[-1])
+        low[above] = high[above] = count - 1
+        inside = known & (cct > self.ccts[0]) & ~above
+        pair = np.clip(np.searchsorted(self.ccts, cct[inside], side="left") - 1, 0, count - 2)
+        low_cct, high_cct = self.ccts[pair], self.ccts[pair + 1]
+        denom = 1.0 / high_cct - 1.0 / low_cct
+        safe = np.abs(denom) >= 1e-9
+        w = np.divide(1.0 / cct[inside] - 1.0 / low_cct, denom, out=np.zeros_like(denom), where=safe)
+        low[inside], high[inside] = pair, pair + 1
+        weight[inside] = np.clip(w, 0.0, 1.0)
+        return low, high, weight
+
+    def _blend(self, matrices: np.ndarray, low: np.ndarray, high: np.ndarray, weight: np.ndarray) -> np.ndarray:
+        w = _snap_weight(weight)[..., None, None]
+        return (1.0 - w) * matrices[low] + w * matrices[high]
+
+    def blended_color_matrix(self, low: np.ndarray, high: np.ndarray, weight: np.ndarray) -> np.ndarray:
+        return self._blend(self.color_matrices, low, high, weight)
+
+    def xyz_to_camera(self, cct: np.ndarray) -> np.ndarray:
+        """Exact AnalogBalance @ CameraCalibration(w) @ ColorMatrix(w) for each CCT, (..., C, 3)."""
+        low, high, weight = self.pair_weights(cct)
+        return (
+            self.analog_balance
+            @ self._blend(self.camera_calibrations, low, high, weight)
+            @ self._blend(self.color_matrices, low, high, weight)
+        )
+
+    def _exact_lookup(self, cct: np.ndarray, neutrals: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        low, high, weight = self.pair_weights(cct)
+        xyz_to_camera = self.xyz_to_camera(cct)
+        if self.color_planes == 3:
+            # Square matrices: one batched LU solve equals pinv @ neutral for regular matrices.
+            try:
+                return low, high, weight, np.linalg.solve(xyz_to_camera, neutrals[..., None])[..., 0]
+            except np.linalg.LinAlgError:
+                pass
+        return low, high, weight, np.einsum("nij,nj->ni", np.linalg.pinv(xyz_to_camera), neutrals)
+
+    def _table_lookup(self, cct: np.ndarray, neutrals: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        low, high, weight = self.pair_weights(cct)
+        table = self.table_camera_to_xyz
+        if len(table) == 1:
+            return low, high, weight, neutrals @ table[0].T
+        with np.errstate(divide="ignore"):
+            mired = np.where(np.isfinite(cct), 1e6 / cct, self.mired_max)
+        step = (self.mired_max - self.mired_min) / (len(table) - 1)
+        pos = np.clip((self.mired_max - mired) / step, 0.0, len(table) - 1.0)
+        i0 = np.minimum(pos.astype(np.int64), len(table) - 2)
+        frac = (pos - i0)[:, None, None]
+        camera_to_xyz = (1.0 - frac) * table[i0] + frac * table[i0 + 1]
+        return low, high, weight, np.einsum("nij,nj->ni", camera_to_xyz, neutrals)
+
+    def initial_xy(self, neutrals: np.ndarray) -> np.ndarray:
+        """
+        Starting xy per neutral: the first calibration whose raw ColorMatrix
+        maps it to a positive xy, DEFAULT_XY if none does.
+        """
+        neutrals = np.asarray(neutrals, dtype=np.float64)
+        xy = np.tile(np.asarray(DEFAULT_XY, dtype=np.float64), (len(neutrals), 1))
+        pending = np.ones(len(neutrals), dtype=bool)
+        if neutrals.shape[1] < 3:
+            return xy
+        for inverse in self._initial_inverses:
+            if inverse is None or not pending.any():
+                continue
+            xyz = neutrals[:, :3] @ inverse.T
+            total = xyz.sum(axis=1)
+            ok = np.abs(total) >= 1e-9
+            guess = np.divide(xyz[:, :2], total[:, None], out=np.zeros((len(xyz), 2)), where=ok[:, None])
+            ok &= (guess[:, 0] > 0) & (guess[:, 1] > 0) & pending
+            xy[ok] = guess[ok]
+            pending &= ~ok
+        return xy
+
+    def _fixed_point(
+        self,
+        neutrals: np.ndarray,
+        xy: np.ndarray,
+        lookup: WhiteLookup,
+        max_iterations: int,
+    ) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """
+        The interpolate_color_matrices loop for all rows at once. Returns xy,
+        cct, low, high, weight, the converged mask and the passes per row.
+        """
+        count = len(neutrals)
+        xy = xy.copy()
+        cct = np.full(count, np.nan)
+        low = np.zeros(count, dtype=np.int64)
+        high = np.full(count, len(self.ccts) - 1, dtype=np.int64)
+        weight = np.zeros(count)
+        active = np.ones(count, dtype=bool)
+        converged = np.zeros(count, dtype=bool)
+        iterations = np.zeros(count, dtype=np.int64)
+        for _ in range(max_iterations):
+            rows = np.flatnonzero(active)
+            if rows.size == 0:
+                break
+            cct[rows] = xy_to_cct(xy[rows])
+            iterations[rows] += 1
+            pair_low, pair_high, pair_weight, xyz = lookup(cct[rows], neutrals[rows])
+            total = xyz.sum(axis=1)
+            ok = np.abs(total) >= 1e-9
+            active[rows[~ok]] = False
+            rows, xyz, total = rows[ok], xyz[ok], total[ok]
+            new_xy = xyz[:, :2] / total[:, None]
+            low[rows], high[rows], weight[rows] = pair_low[ok], pair_high[ok], pair_weight[ok]
+            done = np.linalg.norm(new_xy - xy[rows], axis=1) < CONVERGENCE_TOL
+            xy[rows] = new_xy
+            active[rows[done]] = False
+            converged[rows[done]] = True
+        return xy, cct, low, high, weight, converged, iterations
+
+    def resolve_batch(self, neutrals: np.ndarray, refine_iterations: int = MAX_ITERATIONS) -> InterpolationResult:
+        """
+        Interpolated ColorMatrix for each (C,) AsShotNeutral in ``neutrals``:
+        the fixed-point loop on the mired table, then up to
+        ``refine_iterations`` exact passes (usually one or two) from there.
+        """
+        neutrals = np.atleast_2d(np.asarray(neutrals, dtype=np.float64))
+        if neutrals.ndim != 2 or neutrals.shape[1] != self.color_planes:
+            raise ValueError(f"Expected (N, {self.color_planes}) neutrals, got shape {neutrals.shape}.")
+        xy = self.initial_xy(neutrals)
+        xy = self._fixed_point(neutrals, xy, self._table_lookup, MAX_ITERATIONS)[0]
+        xy, cct, low, high, weight, converged, iterations = self._fixed_point(
+            neutrals, xy, self._exact_lookup, refine_iterations
+        )
+        return InterpolationResult(
+            xy=xy,
+            cct=cct,
+            low=low,
+            high=high,
+            weight=weight,
+            color_matrix=self.blended_color_matrix(low, high, weight),
+            converged=converged,
+            iterations=iterations,
+        )
+
+    def resolve(self, neutral: np.ndarray) -> Tuple[np.ndarray, dict]:
+        """Blended ColorMatrix and the interpolate_color_matrices info dict for one capture."""
+        result = self.resolve_batch(np.asarray(neutral, dtype=np.float64)[None, :])
+        return result.color_matrix[0], self.info(result, 0)
+
+    def info(self, result: InterpolationResult, index: int) -> dict:
+        low, high = int(result.low[index]), int(result.high[index])
+        cct = float(result.cct[index])
+        return {
+            "white_cct": cct if np.isfinite(cct) else None,
+            "low_temp": float(self.ccts[low]),
+            "high_temp": float(self.ccts[high]),
+            "low_name": self.names[low],
+            "high_name": self.names[high],
+            "weight": float(result.weight[index]),
+        }
+
+
+_INTERPOLATORS: Dict[str, ColorMatrixInterpolator] = {}
+
+
+def color_matrix_interpolator(calibrations: Sequence[dict], analog_balance: np.ndarray) -> ColorMatrixInterpolator:
+    """Interpolator for a calibration set, built once per distinct set of matrices."""
+    digest = hashlib.sha256()
+    for cal in calibrations:
+        digest.update(repr((cal["cct"], cal["name"])).encode("utf-8"))
+        digest.update(np.ascontiguousarray(cal["color_matrix"], dtype=np.float64).tobytes())
+        digest.update(np.ascontiguousarray(cal["camera_calibration"], dtype=np.float64).tobytes())
+    digest.update(np.ascontiguousarray(analog_balance, dtype=np.float64).tobytes())
+    key = digest.hexdigest()
+    interpolator = _INTERPOLATORS.get(key)
+    if interpolator is None:
+        interpolator = ColorMatrixInterpolator.from_calibrations(calibrations, analog_balance)
+        _INTERPOLATORS[key] = interpolator
+    return interpolator
+
+
+def solve_white_points(
+    neutrals: np.ndarray,
+    calibrations: Sequence[dict],
+    analog_balance: np.ndarray,
+) -> InterpolationResult:
+    """
+    White xy, CCT, calibration pair, blend weight and convergence for an
+    (N, C) array of AsShotNeutral values that share one calibration set.
+    """
+    return color_matrix_interpolator(calibrations, analog_balance).resolve_batch(neutrals)
+
+
+def _campaign(root: Path, csv_path: Optional[Path]) -> None:
+    from verify_pipeline import (
+        find_capture_dirs,
+        find_metadata_file,
+        gather_calibration_sets,
+        get_analog_balance,
+        get_camera_neutral,
+        load_metadata,
+    )
+
+    # Captures grouped by calibration set; color_matrix_interpolator returns one object per set.
+    groups: Dict[int, Tuple[ColorMatrixInterpolator, List[Path], List[np.ndarray]]] = {}
+    skipped = 0
+    for capture_dir in find_capture_dirs(root):
+        try:
+            metadata = load_metadata(find_metadata_file(capture_dir))
+            color_planes, calibrations = gather_calibration_sets(metadata)
+            interpolator = color_matrix_interpolator(calibrations, get_analog_balance(metadata, color_planes))
+            neutral = get_camera_neutral(metadata, color_planes)
+        except (OSError, ValueError) as exc:
+            print(f"Skipping {capture_dir}: {exc}")
+            skipped += 1
+            continue
+        entry = groups.setdefault(id(interpolator), (interpolator, [], []))
+        entry[1].append(capture_dir)
+        entry[2].append(neutral)
+    if not groups:
+        raise SystemExit(f"No usable captures under {root}.")
+
+    rows = []
+    for number, (interpolator, dirs, neutrals) in enumerate(groups.values(), start=1):
+        start = time.perf_counter()
+        result = interpolator.resolve_batch(np.stack(neutrals))
+        elapsed = time.perf_counter() - start
+        cct = result.cct[np.isfinite(result.cct)]
+        print(f"Calibration set {number} ({', '.join(interpolator.names)}): {len(result)} captures in {elapsed * 1e3:.1f} ms")
+        print(f"  converged {int(result.converged.sum())}/{len(result)}, max passes {int(result.iterations.max())}")
+        if cct.size:
+            p5, p50, p95 = np.percentile(cct, [5, 50, 95])
+            print(f"  CCT min {cct.min():.0f} K, p5 {p5:.0f} K, median {p50:.0f} K, p95 {p95:.0f} K, max {cct.max():.0f} K")
+        print(f"  mean white xy ({result.xy[:, 0].mean():.4f}, {result.xy[:, 1].mean():.4f})")
+        pairs, counts = np.unique(np.stack([result.low, result.high], axis=1), axis=0, return_counts=True)
+        for (low, high), pair_count in zip(pairs, counts):
+            print(f"  {interpolator.names[low]} -> {interpolator.names[high]}: {pair_count} captures")
+        for i, capture_dir in enumerate(dirs):
+            info = interpolator.info(result, i)
+            rows.append(
+                {
+                    "capture": str(capture_dir),
+                    "x": float(result.xy[i, 0]),
+                    "y": float(result.xy[i, 1]),
+                    **info,
+                    "converged": bool(result.converged[i]),
+                    "iterations": int(result.iterations[i]),
+                }
+            )
+    if skipped:
+        print(f"Skipped {skipped} captures without usable calibration metadata.")
+    if csv_path is not None:
+        with csv_path.open("w", newline="", encoding="utf-8") as fh:
+            writer = csv.DictWriter(fh, fieldnames=list(rows[0]))
+            writer.writeheader()
+            writer.writerows(rows)
+        print(f"Wrote {len(rows)} rows to {csv_path}")
+
+
+def main() -> None:
+    from verify_pipeline import gather_calibration_sets, get_analog_balance, get_camera_neutral
+
+    parser = argparse.ArgumentParser(description="Resolve the interpolated ColorMatrix of capture metadata.")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--metadata", type=Path, help="Capture metadata JSON (as verify_pipeline reads).")
+    source.add_argument("--campaign", type=Path, help="Directory of captures: white-point statistics for all of them.")
+    parser.add_argument("--batch", type=int, default=0, help="With --metadata, also time a batch of this many jittered neutrals.")
+    parser.add_argument("--csv", type=Path, default=None, help="With --campaign, write per-capture results to this CSV.")
+    args = parser.parse_args()
+
+    if args.campaign is not None:
+        _campaign(args.campaign, args.csv)
+        return
+    metadata = json.loads(args.metadata.read_text(encoding="utf-8"))
+    color_planes, calibrations = gather_calibration_sets(metadata)
+    start = time.perf_counter()
+    interpolator = color_matrix_interpolator(calibrations, get_analog_balance(metadata, color_planes))
+    built = time.perf_counter() - start
+    matrix, info = interpolator.resolve(get_camera_neutral(metadata, color_planes))
+    print(f"Table: {len(interpolator.mired_grid)} nodes over {interpolator.mired_min:.1f}..{interpolator.mired_max:.1f} mired ({built * 1e3:.1f} ms)")
+    print(f"Interpolation: {info}")
+    with np.printoptions(precision=6, suppress=True):
+        print(matrix)
+    if args.batch > 0:
+        rng = np.random.default_rng(0)
+        neutrals = get_camera_neutral(metadata, color_planes) * rng.uniform(0.8, 1.25, (args.batch, color_planes))
+        start = time.perf_counter()
+        result = interpolator.resolve_batch(neutrals)
+        print(
+            f"Resolved {args.batch} neutrals in {(time.perf_counter() - start) * 1e3:.1f} ms"
+            f" ({int(result.converged.sum())} converged)"
+        )
+
+
+if __name__ == "__main__":
+    main()
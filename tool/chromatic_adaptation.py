@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+"""
+Von Kries chromatic adaptation with cached 3x3 matrices.
+
+A full (D = 1) adaptation from one white to another is a single linear map
+M^-1 diag(cone_dst / cone_src) M in XYZ, where M is the cone-response
+matrix of the chosen transform (Bradford, CAT02 or CAT16). The combined
+matrix is built once per (source white, destination white, method) and
+cached, so adapting a triplet, an (N, 3) colour library or an (H, W, 3)
+image is one matrix product (color_core.apply_matrix).
+
+Whites are given as XYZ triplets or as names from WHITE_POINTS and are used
+as given (Y is not renormalized).
+
+Usage:
+  python chromatic_adaptation.py [--src D50] [--dst D65] [--method bradford] [--xyz X Y Z]
+"""
+
+from __future__ import annotations
+
+import argparse
+from functools import lru_cache
+from typing import Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+from color_core import apply_matrix
+
+# Cone-response (sharpened RGB) matrices, XYZ -> LMS.
+CAT_MATRICES = {
+    "bradford": np.array(
+        [
+            [0.8951, 0.2664, -0.1614],
+            [-0.7502, 1.7135, 0.0367],
+            [0.0389, -0.0685, 1.0296],
+        ],
+        dtype=np.float64,
+    ),
+    "cat02": np.array(
+        [
+            [0.7328, 0.4296, -0.1624],
+            [-0.7036, 1.6975, 0.0061],
+            [0.0030, 0.0136, 0.9834],
+        ],
+        dtype=np.float64,
+    ),
+    "cat16": np.array(
+        [
+            [0.401288, 0.650173, -0.051461],
+            [-0.250268, 1.204414, 0.045854],
+            [-0.002079, 0.048952, 0.953127],
+        ],
+        dtype=np.float64,
+    ),
+}
+
+# CIE 1931 2° whites, Y = 1.
+D50 = np.array([0.9642, 1.0, 0.8251], dtype=np.float64)
+D65 = np.array([0.95047, 1.0, 1.08883], dtype=np.float64)
+WHITE_POINTS = {
+    "A": np.array([1.09850, 1.0, 0.35585], dtype=np.float64),
+    "D50": D50,
+    "D55": np.array([0.95682, 1.0, 0.92149], dtype=np.float64),
+    "D65": D65,
+    "D75": np.array([0.94972, 1.0, 1.22638], dtype=np.float64),
+}
+
+White = Union[str, Sequence[float], np.ndarray]
+
+
+def _white_key(white: White) -> Tuple[float, float, float]:
+    if isinstance(white, str):
+        try:
+            white = WHITE_POINTS[white.upper()]
+        except KeyError:
+            raise ValueError(f"Unknown white point {white!r} (known: {', '.join(WHITE_POINTS)})") from None
+    values = np.asarray(white, dtype=np.float64).reshape(-1)
+    if values.size != 3:
+        raise ValueError("White point must be an XYZ triplet")
+    return tuple(float(v) for v in values)
+
+
+@lru_cache(maxsize=None)
+def _cached_matrix(src: Tuple[float, float, float], dst: Tuple[float, float, float], method: str) -> np.ndarray:
+    cone = CAT_MATRICES[method]
+    src_cone = cone @ np.array(src)
+    dst_cone = cone @ np.array(dst)
+    scale = np.divide(dst_cone, src_cone, out=np.ones_like(dst_cone), where=src_cone != 0)
+    matrix = np.linalg.inv(cone) @ (scale[:, None] * cone)
+    matrix.setflags(write=False)
+    return matrix
+
+
+def adaptation_matrix(src_white: White, dst_white: White, method: str = "bradford") -> np.ndarray:
+    """Read-only 3x3 XYZ -> XYZ matrix adapting ``src_white`` to ``dst_white``."""
+    method = method.lower()
+    if method not in CAT_MATRICES:
+        raise ValueError(f"Unknown adaptation method {method!r} (known: {', '.join(CAT_MATRICES)})")
+    return _cached_matrix(_white_key(src_white), _white_key(dst_white), method)
+
+
+def adapt(
+    xyz: np.ndarray,
+    src_white: White,
+    dst_white: White,
+    method: str = "bradford",
+    dtype: Optional[np.dtype] = None,
+    out: Optional[np.ndarray] = None,
+) -> np.ndarray:
+    """Adapt XYZ values (..., 3) from ``src_white`` to ``dst_white``."""
+    return apply_matrix(adaptation_matrix(src_white, dst_white, method), xyz, dtype, out)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Print a chromatic adaptation matrix.")
+    parser.add_argument("--src", default="D50", help="Source white: name or 'X,Y,Z' (default D50).")
+    parser.add_argument("--dst", default="D65", help="Destination white: name or 'X,Y,Z' (default D65).")
+    parser.add_argument("--method", default="bradford", choices=sorted(CAT_MATRICES), help="Cone-response transform.")
+    parser.add_argument("--xyz", type=float, nargs=3, metavar=("X", "Y", "Z"), help="Optional XYZ value to adapt.")
+    args = parser.parse_args()
+
+    def parse_white(text: str) -> White:
+        return [float(v) for v in text.split(",")] if "," in text else text
+
+    src, dst = parse_white(args.src), parse_white(args.dst)
+    matrix = adaptation_matrix(src, dst, args.method)
+    print(f"{args.method}: {args.src} -> {args.dst}")
+    with np.printoptions(precision=7, suppress=True):
+        print(matrix)
+        if args.xyz is not None:
+            print(f"XYZ {np.array(args.xyz)} -> {adapt(np.array(args.xyz), src, dst, args.method)}")
+
+
+if __name__ == "__main__":
+    main()
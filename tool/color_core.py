@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+"""
+Shared color math and ROI CSV helpers for the tool scripts.
+
+Every transform works elementwise or on the last axis, so a single (3,)
+triplet and an (N, 3) or (H, W, 3) batch go through the same code. Each
+takes ``dtype`` (default: float64 for integer/Python input, otherwise the
+input's float type) and ``out`` (written in place and returned; its dtype
+wins over ``dtype``).
+
+Usage:
+  python color_core.py --xyz X Y Z   # print linear and gamma sRGB
+"""
+
+from __future__ import annotations
+
+import argparse
+import csv
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+
+# XYZ (D65) -> linear sRGB as used by the on-device pipeline (4-digit IEC table).
+XYZ_TO_SRGB = np.array(
+    [
+        [3.2406, -1.5372, -0.4986],
+        [-0.9689, 1.8758, 0.0415],
+        [0.0557, -0.2040, 1.0570],
+    ],
+    dtype=np.float64,
+)
+SRGB_TO_XYZ = np.linalg.inv(XYZ_TO_SRGB)
+
+SRGB_LINEAR_THRESHOLD = 0.0031308
+SRGB_ENCODED_THRESHOLD = 0.04045
+
+
+def _float_dtype(values: np.ndarray, dtype: Optional[np.dtype], out: Optional[np.ndarray]) -> np.dtype:
+    if out is not None:
+        return out.dtype
+    if dtype is not None:
+        return np.dtype(dtype)
+    return values.dtype if np.issubdtype(values.dtype, np.floating) else np.dtype(np.float64)
+
+
+def _working_copy(values: np.ndarray, dtype: Optional[np.dtype], out: Optional[np.ndarray]) -> np.ndarray:
+    """``values`` converted into ``out`` (or a fresh array) so the caller can transform it in place."""
+    values = np.asarray(values)
+    if out is None:
+        return np.array(values, dtype=_float_dtype(values, dtype, out), copy=True)
+    if out is not values:
+        np.copyto(out, values, casting="same_kind")
+    return out
+
+
+def linear_to_srgb(
+    linear: np.ndarray,
+    clip: bool = False,
+    dtype: Optional[np.dtype] = None,
+    out: Optional[np.ndarray] = None,
+) -> np.ndarray:
+    """
+    Apply the sRGB transfer curve. With ``clip`` negative input encodes to
+    0 and the result is clamped to [0, 1]; without it negative values stay
+    on the linear toe and values above 1 follow the power segment.
+    """
+    result = _working_copy(linear, dtype, out)
+    if clip:
+        np.clip(result, 0.0, None, out=result)
+    low = result <= SRGB_LINEAR_THRESHOLD
+    high = ~low
+    result[low] *= 12.92
+    result[high] = 1.055 * np.power(result[high], 1.0 / 2.4) - 0.055
+    if clip:
+        np.clip(result, 0.0, 1.0, out=result)
+    return result
+
+
+def srgb_to_linear(
+    srgb: np.ndarray,
+    dtype: Optional[np.dtype] = None,
+    out: Optional[np.ndarray] = None,
+) -> np.ndarray:
+    """Invert the sRGB transfer curve (no clamping)."""
+    result = _working_copy(srgb, dtype, out)
+    low = result <= SRGB_ENCODED_THRESHOLD
+    high = ~low
+    result[low] /= 12.92
+    result[high] = np.power((result[high] + 0.055) / 1.055, 2.4)
+    return result
+
+
+def apply_matrix(
+    matrix: np.ndarray,
+    values: np.ndarray,
+    dtype: Optional[np.dtype] = None,
+    out: Optional[np.ndarray] = None,
+) -> np.ndarray:
+    """
+    ``matrix @ v`` for every 3-vector on the last axis of ``values``. The
+    batch is flattened to (N, 3) so it is one matrix product, not one per
+    leading index.
+    """
+    values = np.asarray(values)
+    target = _float_dtype(values, dtype, out)
+    flat = values.reshape(-1, 3).astype(target, copy=False)
+    result = np.matmul(flat, np.asarray(matrix).T.astype(target, copy=False)).reshape(values.shape)
+    if out is None:
+        return result
+    out[...] = result
+    return out
+
+
+def xyz_to_linear_srgb(
+    xyz: np.ndarray,
+    dtype: Optional[np.dtype] = None,
+    out: Optional[np.ndarray] = None,
+) -> np.ndarray:
+    """XYZ (..., 3) -> linear sRGB (..., 3), unclamped."""
+    return apply_matrix(XYZ_TO_SRGB, xyz, dtype, out)
+
+
+def linear_srgb_to_xyz(
+    linear: np.ndarray,
+    dtype: Optional[np.dtype] = None,
+    out: Optional[np.ndarray] = None,
+) -> np.ndarray:
+    """Linear sRGB (..., 3) -> XYZ (..., 3)."""
+    return apply_matrix(SRGB_TO_XYZ, linear, dtype, out)
+
+
+def linear_to_srgb8(linear: np.ndarray, out: Optional[np.ndarray] = None) -> np.ndarray:
+    """
+    Clamped, gamma-encoded uint8 sRGB of linear values, rounded half to
+    even. NaN input raises ValueError, as int(round(nan)) did.
+    """
+    encoded = linear_to_srgb(linear, clip=True, dtype=np.float64)
+    if np.isnan(encoded).any():
+        raise ValueError("cannot convert float NaN to integer")
+    encoded *= 255.0
+    np.rint(encoded, out=encoded)
+    if out is None:
+        return encoded.astype(np.uint8)
+    out[...] = encoded
+    return out
+
+
+def channel_ratio(values: np.ndarray) -> np.ndarray:
+    """
+    Channels divided by their (non-negative) sum along the last axis; all
+    zero for black, NaN where the input has NaN.
+    """
+    values = np.clip(np.asarray(values, dtype=np.float64), 0.0, None)
+    total = values.sum(axis=-1, keepdims=True)
+    return np.divide(values, total, out=np.zeros_like(values), where=~(total <= 1e-6))
+
+
+def fmt_triplet(values: Iterable[float]) -> str:
+    return "[" + ", ".join(f"{v:.4f}" for v in values) + "]"
+
+
+def parse_float(value: Optional[str]) -> float:
+    """CSV cell as float; empty or malformed cells are NaN."""
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return float("nan")
+
+
+def getf(row: Dict[str, str], key: str, default: float = float("nan")) -> float:
+    value = row.get(key, "")
+    if value in ("", None):
+        return default
+    try:
+        return float(value)
+    except ValueError:
+        return default
+
+
+def load_roi_rows(csv_path: Path) -> List[Dict[str, str]]:
+    with Path(csv_path).open(newline="", encoding="utf-8") as fh:
+        rows = list(csv.DictReader(fh))
+    if not rows:
+        raise SystemExit("ROI CSV is empty.")
+    return rows
+
+
+def load_roi_row(csv_path: Path, index: int) -> Dict[str, str]:
+    rows = load_roi_rows(csv_path)
+    if index < 0 or index >= len(rows):
+        raise SystemExit(f"ROI index {index} out of range (0..{len(rows) - 1}).")
+    return rows[index]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Convert an XYZ triplet to sRGB.")
+    parser.add_argument("--xyz", required=True, type=float, nargs=3, metavar=("X", "Y", "Z"))
+    args = parser.parse_args()
+    linear = xyz_to_linear_srgb(np.array(args.xyz))
+    print(f"linear sRGB: {fmt_triplet(linear)}")
+    print(f"gamma sRGB : {fmt_triplet(linear_to_srgb(linear, clip=True))}")
+    print(f"sRGB8      : {linear_to_srgb8(linear).tolist()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -11,42 +11,73 @@ Top: JPEG preview with ROI rectangle (same normalized ROI as CSV).
 Each column shows 5 stages: raw RGB, WB RGB, XYZ, linear sRGB, gamma sRGB.
 At the final stage, channel ratios are compared to JPEG; if they differ
 significantly, a red 'FAIL' label is shown.
+
+The rawpy postprocess column is the ground truth, so by default it comes from
+the real full-frame rawpy.postprocess (cached by raw_cache). With
+--window-postprocess it is approximated on a padded window around raw_rect
+instead: LibRaw's scaling, color conversion and output curve with a bilinear
+demosaic in place of AHD. That column is then labelled as approximate.
+
+--all-rows renders every CSV row from one DNG open and one JPEG decode:
+the stage vectors are computed up front, the composites are drawn by a
+process pool, and the OK/FAIL verdicts go to a summary CSV.
+
+Both top previews are drawn on preview_pyramid levels rather than on the
+full-resolution images.
 """
 
 from __future__ import annotations
 
 import argparse
 import csv
-import sys
+import os
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
+from dataclasses import dataclass
+from functools import lru_cache
 from pathlib import Path
-from typing import Dict, Iterable, Tuple
+from typing import Any, Dict, List, Optional, Tuple
 
 import numpy as np
 from PIL import Image, ImageDraw, ImageFont
 
-THIS_DIR = Path(__file__).resolve().parent
-PROJECT_ROOT = THIS_DIR.parent.parent
-if str(PROJECT_ROOT) not in sys.path:
-    sys.path.insert(0, str(PROJECT_ROOT))
-
-from color_design_tool.tool.render_jpeg_roi import (  # type: ignore
-    get_orientation,
-    map_rect,
-    rotate_image,
-    rotate_rect,
+import preview_pyramid
+import raw_cache
+import raw_roi_pipeline
+import roi_result_cache
+from color_core import (
+    channel_ratio,
+    fmt_triplet,
+    getf,
+    linear_srgb_to_xyz,
+    linear_to_srgb,
+    linear_to_srgb8,
+    load_roi_row,
+    load_roi_rows,
+    srgb_to_linear,
+    xyz_to_linear_srgb,
 )
-from color_design_tool.tool import raw_roi_pipeline  # type: ignore
+from render_jpeg_roi import map_rect, rotate_image, rotate_rect
 
-
-XYZ_TO_SRGB = np.array(
+# LibRaw's sRGB primaries (dcraw xyz_rgb), used to derive rgb_cam from cam_xyz.
+LIBRAW_XYZ_RGB = np.array(
     [
-        [3.2406, -1.5372, -0.4986],
-        [-0.9689, 1.8758, 0.0415],
-        [0.0557, -0.2040, 1.0570],
+        [0.412453, 0.357580, 0.180423],
+        [0.212671, 0.715160, 0.072169],
+        [0.019334, 0.119193, 0.950227],
     ],
     dtype=np.float64,
 )
-SRGB_TO_XYZ = np.linalg.inv(XYZ_TO_SRGB)
+# rawpy defaults the windowed path has to reproduce.
+LIBRAW_ADJUST_MAXIMUM_THR = 0.75
+LIBRAW_SRGB_GAMMA = (1.0 / 2.222, 4.5)
+# CFA pixels of demosaic context kept around the ROI.
+ROI_WINDOW_PAD = 8
+PIPELINE_NAMES = ("rawpy_roi", "rawpy_post", "kotlin_raw", "kotlin_jpeg")
+# Box each of the two top previews is fitted into: half the canvas width
+# left by render_visualization's padding and column gap, 320 px high.
+PREVIEW_BOX = (420, 320)
+SUMMARY_NAME = "summary.csv"
 
 
 def parse_args() -> argparse.Namespace:
@@ -67,71 +98,66 @@ def parse_args() -> argparse.Namespace:
         default=0,
         help="ROI index (row) to visualize, default 0.",
     )
+    parser.add_argument(
+        "--all-rows",
+        action="store_true",
+        help="Render every CSV row plus a summary CSV of verdicts (--out is then a directory).",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=os.cpu_count() or 1,
+        help="Processes rendering composites in --all-rows mode (default: CPU count).",
+    )
     parser.add_argument(
         "--out",
         type=Path,
         default=None,
-        help="Optional output JPEG for visualization.",
+        help="Optional output JPEG for visualization (output directory with --all-rows).",
+    )
+    parser.add_argument(
+        "--no-result-cache",
+        action="store_true",
+        help="Recompute the rawpy ROI stages instead of using the shared ROI result cache.",
+    )
+    parser.add_argument(
+        "--window-postprocess",
+        action="store_true",
+        help="Approximate the postprocess column on the ROI window (bilinear demosaic instead of AHD) "
+        "instead of running the full-frame rawpy.postprocess.",
     )
     return parser.parse_args()
 
 
-def load_roi_row(csv_path: Path, index: int) -> Dict[str, str]:
-    with csv_path.open(newline="", encoding="utf-8") as fh:
-        rows = list(csv.DictReader(fh))
-    if not rows:
-        raise SystemExit("ROI CSV is empty.")
-    if index < 0 or index >= len(rows):
-        raise SystemExit(f"ROI index {index} out of range (0..{len(rows) - 1}).")
-    return rows[index]
-
+@dataclass
+class OverlayBase:
+    """Preview-pyramid level an overlay is drawn on, with the full-resolution geometry."""
 
-def getf(row: Dict[str, str], key: str, default: float = float("nan")) -> float:
-    value = row.get(key, "")
-    if value in ("", None):
-        return default
-    try:
-        return float(value)
-    except ValueError:
-        return default
+    image: Image.Image
+    factor: int
+    full_size: Tuple[int, int]
+    orientation_tag: int = 0
 
 
-def srgb_to_linear(value: np.ndarray) -> np.ndarray:
-    threshold = 0.04045
-    return np.where(
-        value <= threshold,
-        value / 12.92,
-        ((value + 0.055) / 1.055) ** 2.4,
-    )
-
-
-def linear_to_srgb(value: np.ndarray) -> np.ndarray:
-    return np.where(
-        value <= 0.0031308,
-        value * 12.92,
-        1.055 * (value ** (1.0 / 2.4)) - 0.055,
-    )
+def jpeg_overlay_base(jpeg_path: Path) -> OverlayBase:
+    pyramid, orientation_tag = preview_pyramid.jpeg_pyramid(jpeg_path)
+    image, factor = pyramid.fit(*PREVIEW_BOX)
+    return OverlayBase(image, factor, pyramid.size, orientation_tag)
 
 
-def clamp01(values: np.ndarray) -> np.ndarray:
-    return np.clip(values, 0.0, 1.0)
+def raw_overlay_base(raw: raw_cache.CachedRaw) -> OverlayBase:
+    pyramid = preview_pyramid.raw_pyramid(raw)
+    image, factor = pyramid.fit(*PREVIEW_BOX)
+    return OverlayBase(image, factor, pyramid.size)
 
 
-def linear_rgb_to_uint8(linear_rgb: np.ndarray) -> Tuple[int, int, int]:
-    srgb = clamp01(linear_to_srgb(clamp01(linear_rgb)))
-    return tuple(int(round(c * 255)) for c in srgb)
-
-
-def fmt_triplet(values: Iterable[float]) -> str:
-    arr = list(values)
-    return "[" + ", ".join(f"{v:.4f}" for v in arr) + "]"
+def create_roi_overlay(jpeg_path: Path, row: Dict[str, str]) -> Tuple[Image.Image, Tuple[int, int, int, int]]:
+    return draw_roi_overlay(jpeg_overlay_base(jpeg_path), row)
 
 
-def create_roi_overlay(jpeg_path: Path, row: Dict[str, str]) -> Tuple[Image.Image, Tuple[int, int, int, int]]:
-    orig_img = Image.open(jpeg_path)
-    orientation_tag = get_orientation(orig_img)
-    orig_img = orig_img.convert("RGB")
-    width, height = orig_img.size
+def draw_roi_overlay(base: OverlayBase, row: Dict[str, str]) -> Tuple[Image.Image, Tuple[int, int, int, int]]:
+    """JPEG preview with the row's ROI drawn, and the ROI bbox in full-resolution pixels."""
+    width, height = base.full_size
     normalized = {
         "left": float(row["roi_left"]),
         "top": float(row["roi_top"]),
@@ -144,47 +170,229 @@ def create_roi_overlay(jpeg_path: Path, row: Dict[str, str]) -> Tuple[Image.Imag
         3: 180,
         6: 270,
         8: 90,
-    }.get(orientation_tag, 0)
+    }.get(base.orientation_tag, 0)
     rotated = rotate_rect(normalized, orientation_deg)
     bbox = map_rect(rotated, width, height)
-    overlay = orig_img.copy()
+    overlay = base.image.copy()
     draw = ImageDraw.Draw(overlay)
-    outline_width = max(4, min(width, height) // 150)
-    draw.rectangle(bbox, outline=(255, 80, 0), width=outline_width)
+    outline_width = max(1, round(max(4, min(width, height) // 150) / base.factor))
+    preview_bbox = preview_pyramid.scale_rect(bbox, base.factor, overlay.size)
+    draw.rectangle(preview_bbox, outline=(255, 80, 0), width=outline_width)
     return overlay, bbox
 
 
-def create_raw_overlay(dng_path: Path, row: Dict[str, str]) -> Image.Image:
-    """
-    Render a simple grayscale RAW preview with ROI rectangle overlaid,
-    using raw.raw_image_visible (no demosaic).
-    """
-    import rawpy  # local import to keep dependency clear
-
-    rect = {
+def raw_rect_from_row(row: Dict[str, str]) -> Dict[str, int]:
+    return {
         "left": int(getf(row, "raw_left", 0.0)),
         "top": int(getf(row, "raw_top", 0.0)),
         "right": int(getf(row, "raw_right", 0.0)),
         "bottom": int(getf(row, "raw_bottom", 0.0)),
     }
-    with rawpy.imread(str(dng_path)) as raw:
-        raw_img = raw.raw_image_visible.astype(np.float32)
-        black = float(min(getattr(raw, "black_level_per_channel", [0])))  # simple global black
-        white = float(raw.white_level or raw_img.max() or 1.0)
-        denom = max(1.0, white - black)
-        norm = np.clip((raw_img - black) / denom, 0.0, 1.0)
-
-    gray8 = (norm * 255.0 + 0.5).astype(np.uint8)
-    raw_img_gray = Image.fromarray(gray8, mode="L").convert("RGB")
+
+
+def create_raw_overlay(raw: raw_cache.CachedRaw, row: Dict[str, str]) -> Image.Image:
+    """
+    Render a simple grayscale RAW preview with ROI rectangle overlaid,
+    from the binned raw_image_visible pyramid (no demosaic).
+    """
+    return draw_raw_overlay(raw_overlay_base(raw), row)
+
+
+def draw_raw_overlay(base: OverlayBase, row: Dict[str, str]) -> Image.Image:
+    rect = raw_rect_from_row(row)
+    raw_img_gray = base.image.copy()
     draw = ImageDraw.Draw(raw_img_gray)
-    outline_width = max(2, min(raw_img_gray.size) // 200)
+    outline_width = max(1, round(max(2, min(base.full_size) // 200) / base.factor))
     bbox = (rect["left"], rect["top"], rect["right"], rect["bottom"])
-    draw.rectangle(bbox, outline=(255, 80, 0), width=outline_width)
+    preview_bbox = preview_pyramid.scale_rect(bbox, base.factor, raw_img_gray.size)
+    draw.rectangle(preview_bbox, outline=(255, 80, 0), width=outline_width)
     return raw_img_gray
 
 
-def compute_pipelines(row: Dict[str, str], dng_path: Path) -> Dict[str, Dict[str, np.ndarray]]:
-    """Return stage vectors for four pipelines."""
+@lru_cache(maxsize=None)
+def libraw_gamma_curve(pwr: float, ts: float, imax: int = 0x10000) -> np.ndarray:
+    """LibRaw's 16-bit output curve (dcraw gamma_curve, mode 2) as a lookup table."""
+    g = [pwr, ts, 0.0, 0.0, 0.0]
+    bnd = [0.0, 0.0]
+    bnd[int(ts >= 1)] = 1.0
+    if ts and (ts - 1) * (pwr - 1) <= 0:
+        for _ in range(48):
+            g[2] = (bnd[0] + bnd[1]) / 2
+            if pwr:
+                bnd[int((pow(g[2] / ts, -pwr) - 1) / pwr - 1 / g[2] > -1)] = g[2]
+            else:
+                bnd[int(g[2] / np.exp(1 - 1 / g[2]) < ts)] = g[2]
+        g[3] = g[2] / ts
+        if pwr:
+            g[4] = g[2] * (1 / pwr - 1)
+    r = np.arange(0x10000, dtype=np.float64) / imax
+    with np.errstate(divide="ignore", invalid="ignore"):
+        if pwr:
+            tail = np.power(r, pwr) * (1 + g[4]) - g[4]
+        else:
+            tail = np.log(r) * g[2] + 1
+        curve = np.where(r < g[3], r * ts, tail)
+    curve = np.where(r < 1, np.floor(0x10000 * curve), 0xFFFF)
+    return np.clip(curve, 0, 0xFFFF).astype(np.uint16)
+
+
+def libraw_rgb_cam(raw: raw_cache.CachedRaw) -> np.ndarray:
+    """Camera RGB -> sRGB matrix LibRaw applies for output_color=sRGB."""
+    rgb_cam = np.asarray(raw.color_matrix, dtype=np.float64)[:, :3]
+    if np.any(rgb_cam):
+        return rgb_cam
+    cam_xyz = np.asarray(raw.rgb_xyz_matrix, dtype=np.float64)[:3, :3]
+    if not np.any(cam_xyz):
+        return np.eye(3)
+    cam_rgb = cam_xyz @ LIBRAW_XYZ_RGB
+    cam_rgb /= cam_rgb.sum(axis=1, keepdims=True)
+    return np.linalg.pinv(cam_rgb)
+
+
+def demosaic_window(values: np.ndarray, channels: np.ndarray) -> np.ndarray:
+    """
+    Bilinear demosaic of a small CFA window by normalized convolution: each
+    missing color is the [1 2 1] x [1 2 1] weighted mean of the same-color
+    neighbors, native samples are kept. ``channels`` holds 0/1/2 per pixel.
+    """
+    h, w = values.shape
+    kernel = ((0, 0, 1), (0, 1, 2), (0, 2, 1), (1, 0, 2), (1, 1, 4), (1, 2, 2), (2, 0, 1), (2, 1, 2), (2, 2, 1))
+    rgb = np.empty((h, w, 3), dtype=np.float64)
+    for channel in range(3):
+        mask = channels == channel
+        plane = np.pad(np.where(mask, values, 0.0), 1)
+        weight = np.pad(mask.astype(np.float64), 1)
+        num = np.zeros((h, w), dtype=np.float64)
+        den = np.zeros((h, w), dtype=np.float64)
+        for dy, dx, k in kernel:
+            num += k * plane[dy : dy + h, dx : dx + w]
+            den += k * weight[dy : dy + h, dx : dx + w]
+        with np.errstate(invalid="ignore", divide="ignore"):
+            rgb[..., channel] = np.where(mask, values, num / den)
+    return np.nan_to_num(rgb, copy=False)
+
+
+_DATA_MAXIMUM: Dict[str, float] = {}
+
+
+def libraw_data_maximum(raw: raw_cache.CachedRaw) -> float:
+    """Largest visible CFA value, which LibRaw's adjust_maximum compares against; cached per DNG."""
+    if raw.content_hash not in _DATA_MAXIMUM:
+        _DATA_MAXIMUM[raw.content_hash] = float(raw.raw_image_visible.max())
+    return _DATA_MAXIMUM[raw.content_hash]
+
+
+def postprocess_roi_window(
+    raw: raw_cache.CachedRaw,
+    rect: Dict[str, int],
+    pad: int = ROI_WINDOW_PAD,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Approximate ROI pixels of the two rawpy.postprocess calls in
+    compute_pipelines, computed on ``rect`` plus ``pad`` pixels only: (8-bit
+    sRGB with camera WB, 16-bit camera RGB without scaling). Follows LibRaw's
+    black subtraction, WB scaling with adjust_maximum, rgb_cam conversion and
+    gamma curve, but demosaics bilinearly where LibRaw uses AHD, so values
+    near edges differ. Only used with --window-postprocess.
+    """
+    mosaic = raw.raw_image_visible
+    height, width = mosaic.shape
+    top, bottom = max(rect["top"], 0), min(rect["bottom"], height)
+    left, right = max(rect["left"], 0), min(rect["right"], width)
+    if bottom <= top or right <= left:
+        raise ValueError(f"Empty ROI for rawpy postprocess path: {rect}")
+    y0, y1 = max(top - pad, 0), min(bottom + pad, height)
+    x0, x1 = max(left - pad, 0), min(right + pad, width)
+    roi = (slice(top - y0, bottom - y0), slice(left - x0, right - x0))
+
+    window = mosaic[y0:y1, x0:x1].astype(np.float64)
+    colors = np.asarray(raw.raw_colors_visible[y0:y1, x0:x1])
+    color_desc = raw.color_desc.decode("ascii") if isinstance(raw.color_desc, bytes) else str(raw.color_desc)
+    channel_of = np.array(["RGB".index(ch) for ch in color_desc.upper()[:4]])
+    channels = channel_of[colors]
+
+    black_levels = np.asarray(raw.black_level_per_channel, dtype=np.float64)
+    black = black_levels.min()
+    counts = np.clip(window - black_levels[colors], 0.0, 65535.0)
+
+    # 16-bit raw color space, user_wb=1, no_auto_scale: black-subtracted counts.
+    raw16 = demosaic_window(counts, channels)[roi]
+
+    # 8-bit sRGB with camera WB: LibRaw scale_colors -> demosaic -> rgb_cam -> curve.
+    white = float(raw.white_level)
+    data_max = libraw_data_maximum(raw) - black
+    maximum = white - black
+    if LIBRAW_ADJUST_MAXIMUM_THR * maximum < data_max < maximum:
+        maximum = data_max
+    pre_mul = np.asarray(raw.camera_whitebalance, dtype=np.float64)[:4].copy()
+    if not np.any(pre_mul):
+        pre_mul[:] = 1.0
+    if pre_mul[3] == 0:
+        pre_mul[3] = pre_mul[1]
+    scale_mul = pre_mul / pre_mul[pre_mul > 0].min() * 65535.0 / maximum
+    scaled = np.clip(np.trunc(counts * scale_mul[colors]), 0.0, 65535.0)
+    rgb = demosaic_window(scaled, channels)[roi]
+    out = np.clip(np.trunc(rgb @ libraw_rgb_cam(raw).T), 0, 65535).astype(np.intp)
+    srgb8 = (libraw_gamma_curve(*LIBRAW_SRGB_GAMMA)[out] >> 8).astype(np.uint8)
+    return srgb8, raw16
+
+
+@lru_cache(maxsize=4)
+def load_full_postprocess(dng_path: Path) -> Tuple[np.ndarray, np.ndarray]:
+    """Memory-mapped outputs of the two full-frame rawpy.postprocess calls."""
+    import rawpy  # local import to keep dependency clear
+
+    rgb_srgb = raw_cache.load_postprocessed(
+        dng_path,
+        use_camera_wb=True,
+        use_auto_wb=False,
+        output_bps=8,
+        output_color=rawpy.ColorSpace.sRGB,
+        no_auto_bright=True,
+    )
+    rgb_raw = raw_cache.load_postprocessed(
+        dng_path,
+        use_camera_wb=False,
+        use_auto_wb=False,
+        user_wb=[1.0, 1.0, 1.0, 1.0],
+        output_bps=16,
+        output_color=rawpy.ColorSpace.raw,
+        no_auto_bright=True,
+        no_auto_scale=True,
+        gamma=(1.0, 1.0),
+    )
+    return rgb_srgb, rgb_raw
+
+
+def full_postprocess_roi(dng_path: Path, rect: Dict[str, int]) -> Tuple[np.ndarray, np.ndarray]:
+    """ROI pixels of the two full-frame rawpy.postprocess calls (see postprocess_roi_window)."""
+    rgb_srgb, rgb_raw = load_full_postprocess(Path(dng_path))
+    y0, y1 = rect["top"], rect["bottom"]
+    x0, x1 = rect["left"], rect["right"]
+    roi_srgb = rgb_srgb[y0:y1, x0:x1, :]
+    if roi_srgb.size == 0:
+        raise ValueError(f"Empty ROI for rawpy sRGB path: {rect}")
+    roi_raw = rgb_raw[y0:y1, x0:x1, :]
+    if roi_raw.size == 0:
+        raise ValueError(f"Empty ROI for rawpy postprocess path: {rect}")
+    return roi_srgb, roi_raw
+
+
+def compute_pipelines(
+    row: Dict[str, str],
+    dng_path: Path,
+    raw: raw_cache.CachedRaw,
+    cache: Optional[roi_result_cache.RoiResultCache] = None,
+    window_postprocess: bool = False,
+    roi_means: Optional[np.ndarray] = None,
+) -> Dict[str, Dict[str, np.ndarray]]:
+    """
+    Return stage vectors for four pipelines from the already opened ``raw``;
+    rawpy ROI values come from ``cache`` when present. ``roi_means`` is the
+    row's CFA mean if the caller batched them (see roi_means_for_rows). The
+    postprocess column uses full_postprocess_roi, or the
+    postprocess_roi_window approximation if ``window_postprocess`` is set.
+    """
     # Common camera raw RGB and WB as recorded by app
     raw_rgb_csv = np.array(
         [getf(row, "raw_r"), getf(row, "raw_g"), getf(row, "raw_b")],
@@ -200,68 +408,45 @@ def compute_pipelines(row: Dict[str, str], dng_path: Path) -> Dict[str, Dict[str
     # rawpy.postprocess(sRGB) inside the same ROI as ground-truth sRGB.
     # XYZ is derived from that sRGB via the standard sRGB->XYZ matrix so
     # that this column exactly matches rawpy's visible output.
-    rect = {
-        "left": int(getf(row, "raw_left", 0.0)),
-        "top": int(getf(row, "raw_top", 0.0)),
-        "right": int(getf(row, "raw_right", 0.0)),
-        "bottom": int(getf(row, "raw_bottom", 0.0)),
-    }
-    import rawpy  # local import to keep dependency clear
-
-    with rawpy.imread(str(dng_path)) as raw:
-        # RAW ROI averages in camera space.
-        roi_means = raw_roi_pipeline.compute_roi_means(raw, rect)
-        rawpy_stage_raw = np.array(
-            [roi_means["r"], roi_means["g"], roi_means["b"]],
-            dtype=np.float64,
-        )
-        rawpy_stage_wb = rawpy_stage_raw * wb
-
+    rect = raw_rect_from_row(row)
+
+    # RAW ROI averages in camera space.
+    if roi_means is None:
+        roi_means = raw_roi_pipeline.cached_roi_means(raw, raw_roi_pipeline.rect_array([rect]), cache)[0]
+    rawpy_stage_raw = roi_means
+    rawpy_stage_wb = rawpy_stage_raw * wb
+
+    if window_postprocess:
+        key = roi_result_cache.result_key(raw.content_hash, rect, "rawpy_window_means", pad=ROI_WINDOW_PAD)
+    else:
+        key = roi_result_cache.result_key(raw.content_hash, rect, "rawpy_postprocess_means")
+    cached = cache.get(key) if cache is not None else None
+    if cached is not None:
+        rawpy_srgb_gamma = cached["srgb_gamma"]
+        rawpy_post_stage_raw = cached["raw"]
+    else:
+        if window_postprocess:
+            roi_srgb, roi_raw = postprocess_roi_window(raw, rect)
+        else:
+            roi_srgb, roi_raw = full_postprocess_roi(dng_path, rect)
         # Ground-truth sRGB from rawpy.postprocess inside the same ROI.
-        rgb_srgb = raw.postprocess(
-            use_camera_wb=True,
-            use_auto_wb=False,
-            output_bps=8,
-            output_color=rawpy.ColorSpace.sRGB,
-            no_auto_bright=True,
-        )
-        y0, y1 = rect["top"], rect["bottom"]
-        x0, x1 = rect["left"], rect["right"]
-        roi_srgb = rgb_srgb[y0:y1, x0:x1, :]
-        if roi_srgb.size == 0:
-            raise SystemExit(f"Empty ROI for rawpy sRGB path: {rect}")
         rawpy_srgb_gamma = roi_srgb.mean(axis=(0, 1)).astype(np.float64) / 255.0
-        rawpy_linear = srgb_to_linear(rawpy_srgb_gamma)
-        rawpy_xyz = SRGB_TO_XYZ @ rawpy_linear
-
-        # New: rawpy postprocess to RAW RGB (camera space), no white balance.
-        # We demosaic in rawpy, keep linear, and then apply the same WB + cam->XYZ
-        # pipeline ourselves so we can inspect how this path compares.
-        rgb_raw = raw.postprocess(
-            use_camera_wb=False,
-            use_auto_wb=False,
-            user_wb=[1.0, 1.0, 1.0, 1.0],
-            output_bps=16,
-            output_color=rawpy.ColorSpace.raw,
-            no_auto_bright=True,
-            no_auto_scale=True,
-            gamma=(1.0, 1.0),
-        )
-        y0, y1 = rect["top"], rect["bottom"]
-        x0, x1 = rect["left"], rect["right"]
-        roi_raw = rgb_raw[y0:y1, x0:x1, :]
-        if roi_raw.size == 0:
-            raise SystemExit(f"Empty ROI for rawpy postprocess path: {rect}")
-        # Normalize to 0..1 range from uint16.
+        # rawpy postprocess to RAW RGB (camera space), no white balance,
+        # normalized from uint16; WB + cam->XYZ are applied below.
         rawpy_post_stage_raw = roi_raw.mean(axis=(0, 1)).astype(np.float64) / 65535.0
-        rawpy_post_stage_wb = rawpy_post_stage_raw * wb
-        # For the postprocess-RAW view we keep the same effective XYZ and
-        # sRGB as the main rawpy reference column, so that differences
-        # isolate the impact of demosaicing vs CFA averaging rather than
-        # color space math.
-        rawpy_post_xyz = rawpy_xyz.copy()
-        rawpy_post_linear = rawpy_linear.copy()
-        rawpy_post_srgb_gamma = rawpy_srgb_gamma.copy()
+        if cache is not None:
+            cache.put(key, {"srgb_gamma": rawpy_srgb_gamma, "raw": rawpy_post_stage_raw})
+    rawpy_linear = srgb_to_linear(rawpy_srgb_gamma)
+    rawpy_xyz = linear_srgb_to_xyz(rawpy_linear)
+
+    rawpy_post_stage_wb = rawpy_post_stage_raw * wb
+    # For the postprocess-RAW view we keep the same effective XYZ and
+    # sRGB as the main rawpy reference column, so that differences
+    # isolate the impact of demosaicing vs CFA averaging rather than
+    # color space math.
+    rawpy_post_xyz = rawpy_xyz.copy()
+    rawpy_post_linear = rawpy_linear.copy()
+    rawpy_post_srgb_gamma = rawpy_srgb_gamma.copy()
 
     # Middle: Kotlin RAW pipeline (from xyz_x/y/z)
     kotlin_raw_stage_raw = raw_rgb_csv.copy()
@@ -273,7 +458,7 @@ def compute_pipelines(row: Dict[str, str], dng_path: Path) -> Dict[str, Dict[str
         [getf(row, "xyz_x"), getf(row, "xyz_y"), getf(row, "xyz_z")],
         dtype=np.float64,
     )
-    kotlin_raw_linear = XYZ_TO_SRGB @ kotlin_raw_xyz
+    kotlin_raw_linear = xyz_to_linear_srgb(kotlin_raw_xyz)
     kotlin_raw_srgb_gamma = linear_to_srgb(kotlin_raw_linear)
 
     # Right: Kotlin JPEG pipeline
@@ -297,7 +482,7 @@ def compute_pipelines(row: Dict[str, str], dng_path: Path) -> Dict[str, Dict[str
         [getf(row, "jpeg_xyz_x"), getf(row, "jpeg_xyz_y"), getf(row, "jpeg_xyz_z")],
         dtype=np.float64,
     )
-    jpeg_linear_from_xyz = XYZ_TO_SRGB @ jpeg_xyz
+    jpeg_linear_from_xyz = xyz_to_linear_srgb(jpeg_xyz)
     jpeg_srgb_from_xyz = linear_to_srgb(jpeg_linear_from_xyz)
 
     pipelines: Dict[str, Dict[str, np.ndarray]] = {
@@ -333,12 +518,17 @@ def compute_pipelines(row: Dict[str, str], dng_path: Path) -> Dict[str, Dict[str
     return pipelines
 
 
-def channel_ratio(v: np.ndarray) -> np.ndarray:
-    v = np.clip(v, 0.0, None)
-    s = v.sum()
-    if s <= 1e-6:
-        return np.zeros_like(v)
-    return v / s
+def ratio_differences(pipelines: Dict[str, Dict[str, np.ndarray]]) -> Dict[str, float]:
+    """Max channel-ratio difference of each pipeline's gamma sRGB against the Kotlin JPEG one."""
+    ref_ratio = channel_ratio(pipelines["kotlin_jpeg"]["gamma_srgb"])
+    return {
+        name: float(np.max(np.abs(channel_ratio(stages["gamma_srgb"]) - ref_ratio)))
+        for name, stages in pipelines.items()
+    }
+
+
+def pipeline_verdicts(differences: Dict[str, float], ratio_threshold: float = 0.05) -> Dict[str, str]:
+    return {name: "FAIL" if diff > ratio_threshold else "OK" for name, diff in differences.items()}
 
 
 def build_visualization(
@@ -347,21 +537,30 @@ def build_visualization(
     row: Dict[str, str],
     out_path: Path,
     ratio_threshold: float = 0.05,
+    cache: Optional[roi_result_cache.RoiResultCache] = None,
+    window_postprocess: bool = False,
 ) -> None:
     overlay, bbox = create_roi_overlay(jpeg_path, row)
-    raw_overlay = create_raw_overlay(dng_path, row)
-    pipelines = compute_pipelines(row, dng_path)
-
-    # Final gamma sRGB for ratio comparison
-    ref = pipelines["kotlin_jpeg"]["gamma_srgb"]
-    ref_ratio = channel_ratio(ref)
-
-    verdicts: Dict[str, str] = {}
-    for name, stages in pipelines.items():
-        ratios = channel_ratio(stages["gamma_srgb"])
-        diff = np.max(np.abs(ratios - ref_ratio))
-        verdicts[name] = "FAIL" if diff > ratio_threshold else "OK"
-
+    with raw_cache.open_raw(dng_path) as raw:
+        raw_overlay = create_raw_overlay(raw, row)
+        pipelines = compute_pipelines(row, dng_path, raw, cache, window_postprocess)
+    verdicts = pipeline_verdicts(ratio_differences(pipelines), ratio_threshold)
+    render_visualization(overlay, bbox, raw_overlay, pipelines, verdicts, out_path, window_postprocess)
+
+
+def render_visualization(
+    overlay: Image.Image,
+    bbox: Tuple[int, int, int, int],
+    raw_overlay: Image.Image,
+    pipelines: Dict[str, Dict[str, np.ndarray]],
+    verdicts: Dict[str, str],
+    out_path: Path,
+    window_postprocess: bool = False,
+) -> None:
+    """
+    Draw the previews and the four stage columns into one JPEG; the
+    postprocess column is marked approximate for ``window_postprocess``.
+    """
     # Drawing layout
     font = ImageFont.load_default()
 
@@ -381,9 +580,7 @@ def build_visualization(
     width = padding * 2 + 4 * patch_w + 3 * col_gap
 
     # Preview at top: RAW (grayscale) + JPEG, side-by-side
-    max_preview_w_total = width - padding * 2
-    max_preview_h = 320
-    single_preview_w = (max_preview_w_total - col_gap) / 2.0
+    single_preview_w, max_preview_h = PREVIEW_BOX
 
     def resize_preview(img: Image.Image) -> Image.Image:
         scale = min(
@@ -415,7 +612,7 @@ def build_visualization(
     summary_lines = []
     for name, label in (
         ("rawpy_roi", "Rawpy ROI"),
-        ("rawpy_post", "Rawpy Post"),
+        ("rawpy_post", "Rawpy Post (window approx.)" if window_postprocess else "Rawpy Post"),
         ("kotlin_raw", "Kotlin RAW"),
     ):
         xyz = pipelines[name]["xyz"]
@@ -466,7 +663,8 @@ def build_visualization(
         padding + 2 * (patch_w + col_gap),
         padding + 3 * (patch_w + col_gap),
     ]
-    headers = ["RAWPY ROI", "RAWPY POST", "KOTLIN RAW", "KOTLIN JPEG"]
+    post_header = "RAWPY POST (APPROX.)" if window_postprocess else "RAWPY POST"
+    headers = ["RAWPY ROI", post_header, "KOTLIN RAW", "KOTLIN JPEG"]
 
     header_y = preview_y + preview_h + preview_text_h + 30
     for x, text in zip(col_x, headers):
@@ -486,7 +684,7 @@ def build_visualization(
             vec = stages_dict[stage]
             if stage == "xyz":
                 # Map XYZ to linear sRGB for visualization
-                rgb_lin = XYZ_TO_SRGB @ vec
+                rgb_lin = xyz_to_linear_srgb(vec)
             elif stage.endswith("gamma"):
                 # Gamma sRGB already
                 rgb_lin = srgb_to_linear(vec)
@@ -494,7 +692,7 @@ def build_visualization(
                 # Assume linear rgb-like values
                 rgb_lin = vec
 
-            color = linear_rgb_to_uint8(rgb_lin)
+            color = tuple(linear_to_srgb8(rgb_lin).tolist())
             patch_box = (x, y, x + patch_w, y + patch_h)
             draw.rectangle(patch_box, fill=color, outline=(0, 0, 0), width=2)
 
@@ -519,12 +717,181 @@ def build_visualization(
     print(f"Saved visualization to {out_path}")
 
 
+# Per-process state for the --all-rows render pool, set by _init_render_worker.
+_RENDER_STATE: Dict[str, Any] = {}
+
+
+def _init_render_worker(jpeg_base: OverlayBase, raw_base: OverlayBase, window_postprocess: bool = False) -> None:
+    _RENDER_STATE["jpeg"] = jpeg_base
+    _RENDER_STATE["raw"] = raw_base
+    _RENDER_STATE["window_postprocess"] = window_postprocess
+
+
+def _render_row(
+    row: Dict[str, str],
+    pipelines: Dict[str, Dict[str, np.ndarray]],
+    verdicts: Dict[str, str],
+    out_path: Path,
+) -> Optional[str]:
+    """Render one composite; returns an error message instead of raising."""
+    try:
+        overlay, bbox = draw_roi_overlay(_RENDER_STATE["jpeg"], row)
+        raw_overlay = draw_raw_overlay(_RENDER_STATE["raw"], row)
+        render_visualization(
+            overlay, bbox, raw_overlay, pipelines, verdicts, out_path, _RENDER_STATE["window_postprocess"]
+        )
+    except (KeyError, ValueError) as exc:
+        return f"{type(exc).__name__}: {exc}"
+    return None
+
+
+def roi_means_for_rows(
+    raw: raw_cache.CachedRaw,
+    rows: List[Dict[str, str]],
+    cache: Optional[roi_result_cache.RoiResultCache] = None,
+) -> List[Optional[np.ndarray]]:
+    """
+    CFA means of every row's raw_rect from one cached_roi_means call, so the
+    sensor integral image is built at most once. Rows with an unparsable or
+    empty rect get None and report their error from compute_pipelines.
+    """
+    valid: List[int] = []
+    rects: List[Dict[str, int]] = []
+    for index, row in enumerate(rows):
+        try:
+            rect = raw_rect_from_row(row)
+        except (KeyError, ValueError):
+            continue
+        if rect["bottom"] > rect["top"] and rect["right"] > rect["left"]:
+            valid.append(index)
+            rects.append(rect)
+    means: List[Optional[np.ndarray]] = [None] * len(rows)
+    if rects:
+        batch = raw_roi_pipeline.cached_roi_means(raw, raw_roi_pipeline.rect_array(rects), cache)
+        for index, mean in zip(valid, batch):
+            means[index] = mean
+    return means
+
+
+def build_all_rows(
+    jpeg_path: Path,
+    dng_path: Path,
+    rows: List[Dict[str, str]],
+    out_dir: Path,
+    workers: int,
+    ratio_threshold: float = 0.05,
+    cache: Optional[roi_result_cache.RoiResultCache] = None,
+    window_postprocess: bool = False,
+) -> Path:
+    """
+    Render one composite per row into ``out_dir`` and write the verdict
+    summary CSV; returns the summary path. The DNG is opened and the JPEG
+    read once, stage vectors are computed here and the composites are
+    drawn by ``workers`` processes. Rows whose stages cannot be computed
+    (e.g. an empty ROI) are listed in the summary with their error.
+    """
+    compared = [name for name in PIPELINE_NAMES if name != "kotlin_jpeg"]
+    jpeg_base = jpeg_overlay_base(jpeg_path)
+    all_pipelines: List[Optional[Dict[str, Dict[str, np.ndarray]]]] = []
+    errors: List[Optional[str]] = []
+    with raw_cache.open_raw(dng_path) as raw:
+        raw_base = raw_overlay_base(raw)
+        all_means = roi_means_for_rows(raw, rows, cache)
+        for row, roi_means in zip(rows, all_means):
+            try:
+                all_pipelines.append(compute_pipelines(row, dng_path, raw, cache, window_postprocess, roi_means))
+                errors.append(None)
+            except (KeyError, ValueError) as exc:
+                all_pipelines.append(None)
+                errors.append(f"{type(exc).__name__}: {exc}")
+    no_verdict = {name: "" for name in compared}
+    all_differences = [
+        ratio_differences(pipelines) if pipelines is not None else {} for pipelines in all_pipelines
+    ]
+    all_verdicts = [
+        pipeline_verdicts(diffs, ratio_threshold) if diffs else no_verdict for diffs in all_differences
+    ]
+    out_paths = [out_dir / f"row{index:03d}.jpg" for index in range(len(rows))]
+
+    todo = [index for index, error in enumerate(errors) if error is None]
+    jobs = [(rows[i], all_pipelines[i], all_verdicts[i], out_paths[i]) for i in todo]
+    if not jobs:
+        render_errors = []
+    elif workers <= 1:
+        _init_render_worker(jpeg_base, raw_base, window_postprocess)
+        render_errors = [_render_row(*job) for job in jobs]
+    else:
+        with ProcessPoolExecutor(
+            max_workers=min(workers, len(jobs)),
+            initializer=_init_render_worker,
+            initargs=(jpeg_base, raw_base, window_postprocess),
+        ) as pool:
+            render_errors = list(pool.map(_render_row, *zip(*jobs)))
+    for index, error in zip(todo, render_errors):
+        errors[index] = error
+
+    out_dir.mkdir(parents=True, exist_ok=True)
+    summary_path = out_dir / SUMMARY_NAME
+    with summary_path.open("w", newline="", encoding="utf-8") as fh:
+        writer = csv.writer(fh)
+        writer.writerow(
+            ["row", "timestamp"]
+            + [f"{name}_{field}" for name in compared for field in ("verdict", "ratio_diff")]
+            + ["composite", "error"]
+        )
+        for index, (row, diffs, verdicts, out_path, error) in enumerate(
+            zip(rows, all_differences, all_verdicts, out_paths, errors)
+        ):
+            writer.writerow(
+                [index, row.get("timestamp", "")]
+                + [
+                    value
+                    for name in compared
+                    for value in (verdicts[name], f"{diffs[name]:.6f}" if name in diffs else "")
+                ]
+                + ["" if error else out_path.name, error or ""]
+            )
+
+    print(f"{'row':>4}  " + "  ".join(f"{name:>10}" for name in compared))
+    for index, (verdicts, error) in enumerate(zip(all_verdicts, errors)):
+        line = f"{index:>4}  " + "  ".join(f"{verdicts[name]:>10}" for name in compared)
+        print(line + (f"  (not rendered: {error})" if error else ""))
+    failed = sum(any(verdicts[name] == "FAIL" for name in compared) for verdicts in all_verdicts)
+    skipped = sum(pipelines is None for pipelines in all_pipelines)
+    print(
+        f"{failed}/{len(rows)} rows with a FAIL verdict, {skipped} without stage values; "
+        f"summary saved to {summary_path}"
+    )
+    return summary_path
+
+
 def main() -> None:
     args = parse_args()
+    if args.all_rows:
+        rows = load_roi_rows(args.roi_csv)
+        out_dir = args.out or args.roi_csv.with_name(args.roi_csv.stem + "_three_pipelines")
+        with nullcontext() if args.no_result_cache else roi_result_cache.RoiResultCache() as cache:
+            build_all_rows(
+                args.jpeg,
+                args.dng,
+                rows,
+                out_dir,
+                args.workers,
+                cache=cache,
+                window_postprocess=args.window_postprocess,
+            )
+        return
+
     row = load_roi_row(args.roi_csv, args.roi_index)
     out_path = args.out or args.roi_csv.with_stem(args.roi_csv.stem + "_three_pipelines")
     out_path = out_path.with_suffix(".jpg")
-    build_visualization(args.jpeg, args.dng, row, out_path)
+    with nullcontext() if args.no_result_cache else roi_result_cache.RoiResultCache() as cache:
+        try:
+            build_visualization(
+                args.jpeg, args.dng, row, out_path, cache=cache, window_postprocess=args.window_postprocess
+            )
+        except ValueError as exc:
+            raise SystemExit(str(exc)) from exc
 
 
 if __name__ == "__main__":
@@ -0,0 +1,303 @@
+#!/usr/bin/env python3
+"""
+Header-only DNG metadata extractor.
+
+Walks the TIFF IFD chain (including SubIFDs) with plain struct reads and
+collects the color calibration tags without touching pixel data, so
+matrix-only tools start in milliseconds instead of waiting for libraw.
+
+The returned dict uses the same keys as the metadata.json written by the app
+(colorMatrix1, calibrationIlluminant1, asShotNeutral, ...), so it can be fed
+directly to verify_pipeline.gather_calibration_sets. verify_pipeline's
+calibration_metadata uses it to fill in calibration tags that a capture's
+metadata.json lacks.
+
+Usage:
+  python dng_metadata.py --dng <path/to/dng>
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import struct
+from pathlib import Path
+from typing import BinaryIO, Dict, List, Optional, Tuple
+
+import numpy as np
+
+TAG_NEW_SUBFILE_TYPE = 254
+TAG_IMAGE_WIDTH = 256
+TAG_IMAGE_LENGTH = 257
+TAG_MAKE = 271
+TAG_MODEL = 272
+TAG_ORIENTATION = 274
+TAG_PHOTOMETRIC = 262
+TAG_SUB_IFDS = 330
+TAG_CFA_REPEAT_PATTERN_DIM = 33421
+TAG_CFA_PATTERN = 33422
+TAG_UNIQUE_CAMERA_MODEL = 50708
+TAG_CFA_PLANE_COLOR = 50710
+TAG_BLACK_LEVEL_REPEAT_DIM = 50713
+TAG_BLACK_LEVEL = 50714
+TAG_WHITE_LEVEL = 50717
+TAG_ACTIVE_AREA = 50829
+
+PHOTOMETRIC_CFA = 32803
+
+# Color calibration tags, keyed by the metadata.json name they map to.
+CALIBRATION_TAGS = {
+    "colorMatrix1": 50721,
+    "colorMatrix2": 50722,
+    "colorMatrix3": 52531,
+    "cameraCalibration1": 50723,
+    "cameraCalibration2": 50724,
+    "cameraCalibration3": 52530,
+    "reductionMatrix1": 50725,
+    "reductionMatrix2": 50726,
+    "reductionMatrix3": 52538,
+    "forwardMatrix1": 50964,
+    "forwardMatrix2": 50965,
+    "forwardMatrix3": 52532,
+    "analogBalance": 50727,
+    "asShotNeutral": 50728,
+    "asShotWhiteXY": 50729,
+    "calibrationIlluminant1": 50778,
+    "calibrationIlluminant2": 50779,
+    "calibrationIlluminant3": 52529,
+}
+SCALAR_TAGS = {"calibrationIlluminant1", "calibrationIlluminant2", "calibrationIlluminant3"}
+
+COLOR_CODES = {0: "R", 1: "G", 2: "B", 3: "C", 4: "M", 5: "Y", 6: "W"}
+D65_ILLUMINANT = 21
+
+# TIFF type id -> (struct code, byte size); rationals are read as pairs.
+_TYPES: Dict[int, Tuple[str, int]] = {
+    1: ("B", 1),
+    2: ("s", 1),
+    3: ("H", 2),
+    4: ("I", 4),
+    5: ("II", 8),
+    6: ("b", 1),
+    7: ("B", 1),
+    8: ("h", 2),
+    9: ("i", 4),
+    10: ("ii", 8),
+    11: ("f", 4),
+    12: ("d", 8),
+    13: ("I", 4),
+    16: ("Q", 8),
+    17: ("q", 8),
+    18: ("Q", 8),
+}
+
+
+class _IfdReader:
+    def __init__(self, fh: BinaryIO) -> None:
+        self.fh = fh
+        header = fh.read(16)
+        if header[:2] == b"II":
+            self.order = "<"
+        elif header[:2] == b"MM":
+            self.order = ">"
+        else:
+            raise ValueError("Not a TIFF/DNG file (bad byte order mark).")
+        magic = struct.unpack(self.order + "H", header[2:4])[0]
+        self.big = magic == 43
+        if magic not in (42, 43):
+            raise ValueError(f"Unsupported TIFF magic {magic}.")
+        if self.big:
+            self.first_ifd = struct.unpack(self.order + "Q", header[8:16])[0]
+        else:
+            self.first_ifd = struct.unpack(self.order + "I", header[4:8])[0]
+
+    def read_ifd(self, offset: int) -> Tuple[Dict[int, object], int]:
+        """Return ({tag: value}, next_ifd_offset) for the IFD at ``offset``."""
+        count_fmt, entry_size, value_size, next_fmt = (
+            ("Q", 20, 8, "Q") if self.big else ("H", 12, 4, "I")
+        )
+        self.fh.seek(offset)
+        count_bytes = struct.calcsize(count_fmt)
+        (count,) = struct.unpack(self.order + count_fmt, self.fh.read(count_bytes))
+        raw_entries = self.fh.read(count * entry_size + struct.calcsize(next_fmt))
+        (next_offset,) = struct.unpack(self.order + next_fmt, raw_entries[count * entry_size :])
+        tags: Dict[int, object] = {}
+        for i in range(count):
+            entry = raw_entries[i * entry_size : (i + 1) * entry_size]
+            tag, dtype = struct.unpack(self.order + "HH", entry[:4])
+            if dtype not in _TYPES:
+                continue
+            if self.big:
+                (n,) = struct.unpack(self.order + "Q", entry[4:12])
+            else:
+                (n,) = struct.unpack(self.order + "I", entry[4:8])
+            code, size = _TYPES[dtype]
+            total = n * size
+            payload = entry[12:] if self.big else entry[8:]
+            if total > value_size:
+                (value_offset,) = struct.unpack(self.order + ("Q" if self.big else "I"), payload[:value_size])
+                here = self.fh.tell()
+                self.fh.seek(value_offset)
+                data = self.fh.read(total)
+                self.fh.seek(here)
+            else:
+                data = payload[:total]
+            tags[tag] = self._decode(dtype, code, n, data)
+        return tags, next_offset
+
+    def _decode(self, dtype: int, code: str, n: int, data: bytes) -> object:
+        if dtype == 2:
+            return data.split(b"\x00", 1)[0].decode("ascii", errors="replace")
+        if dtype in (5, 10):
+            pairs = struct.unpack(self.order + code[0] * (2 * n), data)
+            return [num / den if den else 0.0 for num, den in zip(pairs[0::2], pairs[1::2])]
+        return list(struct.unpack(self.order + code * n, data))
+
+
+def read_ifds(dng_path: Path) -> List[Dict[int, object]]:
+    """All IFDs reachable from the header: the main chain plus nested SubIFDs."""
+    with Path(dng_path).open("rb") as fh:
+        reader = _IfdReader(fh)
+        ifds: List[Dict[int, object]] = []
+        pending = [reader.first_ifd]
+        seen = set()
+        while pending:
+            offset = pending.pop(0)
+            if not offset or offset in seen:
+                continue
+            seen.add(offset)
+            tags, next_offset = reader.read_ifd(offset)
+            ifds.append(tags)
+            pending.extend(tags.get(TAG_SUB_IFDS, []) or [])  # type: ignore[arg-type]
+            pending.append(next_offset)
+    return ifds
+
+
+def _first(ifds: List[Dict[int, object]], tag: int) -> Optional[object]:
+    for tags in ifds:
+        if tag in tags:
+            return tags[tag]
+    return None
+
+
+def _raw_ifd(ifds: List[Dict[int, object]]) -> Optional[Dict[int, object]]:
+    for tags in ifds:
+        photometric = tags.get(TAG_PHOTOMETRIC, [None])[0]  # type: ignore[index]
+        subfile = tags.get(TAG_NEW_SUBFILE_TYPE, [0])[0]  # type: ignore[index]
+        if photometric == PHOTOMETRIC_CFA and not (int(subfile) & 1):
+            return tags
+    return None
+
+
+def read_dng_metadata(dng_path: Path) -> dict:
+    """
+    Collect calibration tags, CFA layout and levels in the metadata.json
+    shape. Matrices are flat row-major lists, as written by the app.
+    """
+    ifds = read_ifds(dng_path)
+    metadata: dict = {}
+    for key, tag in CALIBRATION_TAGS.items():
+        value = _first(ifds, tag)
+        if value is None:
+            continue
+        values = [float(v) for v in value]  # type: ignore[union-attr]
+        metadata[key] = int(values[0]) if key in SCALAR_TAGS else values
+
+    for key, tag in (("make", TAG_MAKE), ("model", TAG_MODEL), ("uniqueCameraModel", TAG_UNIQUE_CAMERA_MODEL)):
+        value = _first(ifds, tag)
+        if isinstance(value, str):
+            metadata[key] = value
+    orientation = _first(ifds, TAG_ORIENTATION)
+    if orientation:
+        metadata["orientation"] = int(orientation[0])  # type: ignore[index]
+
+    raw = _raw_ifd(ifds)
+    if raw is None:
+        return metadata
+    width = int(raw[TAG_IMAGE_WIDTH][0])  # type: ignore[index]
+    height = int(raw[TAG_IMAGE_LENGTH][0])  # type: ignore[index]
+    active = raw.get(TAG_ACTIVE_AREA)
+    if active and len(active) == 4:  # type: ignore[arg-type]
+        top, left, bottom, right = (int(v) for v in active)  # type: ignore[union-attr]
+        width, height = right - left, bottom - top
+    metadata["width"] = width
+    metadata["height"] = height
+
+    plane_codes = [int(v) for v in raw.get(TAG_CFA_PLANE_COLOR, [0, 1, 2])]  # type: ignore[union-attr]
+    repeat = raw.get(TAG_CFA_REPEAT_PATTERN_DIM)
+    pattern = raw.get(TAG_CFA_PATTERN)
+    if repeat and pattern:
+        letters = [COLOR_CODES.get(plane_codes[int(code)], "?") for code in pattern]  # type: ignore[union-attr]
+        metadata["cfaRepeatPatternDim"] = [int(v) for v in repeat]  # type: ignore[union-attr]
+        metadata["cfaPattern"] = "".join(letters)
+    metadata["colorDesc"] = "".join(COLOR_CODES.get(code, "?") for code in plane_codes)
+
+    white = raw.get(TAG_WHITE_LEVEL)
+    if white:
+        metadata["whiteLevel"] = float(white[0])  # type: ignore[index]
+    black = raw.get(TAG_BLACK_LEVEL)
+    if black:
+        metadata["blackLevel"] = [float(v) for v in black]  # type: ignore[union-attr]
+        dims = raw.get(TAG_BLACK_LEVEL_REPEAT_DIM)
+        if dims:
+            metadata["blackLevelRepeatDim"] = [int(v) for v in dims]  # type: ignore[union-attr]
+    return metadata
+
+
+def preferred_color_matrix_key(metadata: dict) -> Optional[str]:
+    """
+    Pick the ColorMatrix a single-matrix tool should use: the one calibrated
+    for D65 if present, otherwise the highest-numbered one available.
+    """
+    available = [idx for idx in (1, 2, 3) if f"colorMatrix{idx}" in metadata]
+    if not available:
+        return None
+    for idx in available:
+        if metadata.get(f"calibrationIlluminant{idx}") == D65_ILLUMINANT:
+            return f"colorMatrix{idx}"
+    return f"colorMatrix{available[-1]}"
+
+
+def xyz_to_cam_matrix(metadata: dict, key: Optional[str] = None) -> Optional[np.ndarray]:
+    """
+    3x3 XYZ->Camera matrix (rows = camera R, G, B) from a DNG ColorMatrix,
+    averaging rows of duplicate color planes for 4-plane CFAs.
+    """
+    key = key or preferred_color_matrix_key(metadata)
+    if key is None or key not in metadata:
+        return None
+    values = np.asarray(metadata[key], dtype=np.float64).reshape(-1)
+    if values.size % 3 != 0:
+        return None
+    matrix = values.reshape(-1, 3)
+    desc = metadata.get("colorDesc") or "RGB"
+    if len(desc) != matrix.shape[0]:
+        desc = "RGB" if matrix.shape[0] == 3 else "RGBG"
+    rows = []
+    for target in "RGB":
+        indices = [i for i, ch in enumerate(desc) if ch == target]
+        if not indices:
+            return None
+        rows.append(matrix[indices].mean(axis=0))
+    return np.stack(rows, axis=0)
+
+
+def cam_to_xyz_matrix(metadata: dict, key: Optional[str] = None) -> Optional[np.ndarray]:
+    xyz_to_cam = xyz_to_cam_matrix(metadata, key)
+    if xyz_to_cam is None:
+        return None
+    try:
+        return np.linalg.inv(xyz_to_cam)
+    except np.linalg.LinAlgError:
+        return None
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Dump DNG color calibration tags without decoding pixels.")
+    parser.add_argument("--dng", required=True, type=Path, help="Path to DNG file.")
+    args = parser.parse_args()
+    print(json.dumps(read_dng_metadata(args.dng), indent=2))
+
+
+if __name__ == "__main__":
+    main()
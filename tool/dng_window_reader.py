@@ -0,0 +1,240 @@
+#!/usr/bin/env python3
+"""
+Lazy RAW window reader for DNGs built on tifffile.
+
+Instead of decoding the whole CFA image through libraw, locate the raw IFD
+(CFA photometric, NewSubFileType 0) and read/decode only the strips or tiles
+that overlap the requested raw_rect. Coordinates are relative to the
+ActiveArea origin, matching rawpy's raw_image_visible and the raw_* columns
+of the ROI dump CSV.
+
+Usage:
+  python dng_window_reader.py --dng <path/to/dng> --rect LEFT TOP RIGHT BOTTOM
+"""
+
+from __future__ import annotations
+
+import argparse
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+import tifffile
+
+from extract_ccm_tifffile import COLOR_CODES, tag_values
+
+
+PHOTOMETRIC_CFA = 32803
+TAG_CFA_REPEAT_PATTERN_DIM = 33421
+TAG_CFA_PATTERN = 33422
+TAG_CFA_PLANE_COLOR = 50710
+TAG_BLACK_LEVEL_REPEAT_DIM = 50713
+TAG_BLACK_LEVEL = 50714
+TAG_WHITE_LEVEL = 50717
+TAG_ACTIVE_AREA = 50829
+
+
+@dataclass
+class RawWindow:
+    data: np.ndarray
+    top: int
+    left: int
+    # CFA letters of the 2x2 block starting at (top, left), e.g. "RGGB".
+    pattern: str
+    # Offset of (top, left) within the sensor's CFA repeat.
+    phase: Tuple[int, int]
+    bytes_read: int
+
+
+def _tag_array(tags: tifffile.TiffTags, tag_id: int) -> Optional[np.ndarray]:
+    values = tag_values(tags.get(tag_id))
+    return None if values is None else values.reshape(-1)
+
+
+def find_raw_page(tif: tifffile.TiffFile) -> tifffile.TiffPage:
+    """Return the full-resolution CFA IFD, searching SubIFDs as well."""
+    stack = list(tif.pages)
+    while stack:
+        page = stack.pop(0)
+        if not isinstance(page, tifffile.TiffPage):
+            continue
+        if page.photometric == PHOTOMETRIC_CFA and not (page.subfiletype & 1):
+            return page
+        stack.extend(page.pages or [])
+    raise ValueError(f"No CFA raw IFD found in {tif.filename}")
+
+
+class DngWindowReader:
+    """Keeps the DNG open so several windows can be read from one handle."""
+
+    def __init__(self, dng_path: Path) -> None:
+        # Same workaround as extract_ccm_tifffile: some DNGs carry
+        # non-standard Orientation values that break tifffile's enum.
+        tifffile.tifffile.TIFF.TAG_ENUM.pop(274, None)
+        self.dng_path = Path(dng_path)
+        self._tif = tifffile.TiffFile(str(dng_path))
+        self.page = find_raw_page(self._tif)
+        tags = self.page.tags
+
+        active = _tag_array(tags, TAG_ACTIVE_AREA)
+        if active is not None and active.size == 4:
+            a_top, a_left, a_bottom, a_right = (int(v) for v in active)
+        else:
+            a_top, a_left, a_bottom, a_right = 0, 0, self.page.imagelength, self.page.imagewidth
+        self.origin = (a_top, a_left)
+        self.height = a_bottom - a_top
+        self.width = a_right - a_left
+
+        repeat = _tag_array(tags, TAG_CFA_REPEAT_PATTERN_DIM)
+        self.repeat = (int(repeat[0]), int(repeat[1])) if repeat is not None and repeat.size == 2 else (2, 2)
+        plane_colors = _tag_array(tags, TAG_CFA_PLANE_COLOR)
+        plane_codes = [int(v) for v in plane_colors] if plane_colors is not None else [0, 1, 2]
+        codes = _tag_array(tags, TAG_CFA_PATTERN)
+        if codes is None or codes.size != self.repeat[0] * self.repeat[1]:
+            raise ValueError("CFAPattern tag missing or inconsistent with CFARepeatPatternDim.")
+        # CFAPattern values index CFAPlaneColor, whose values are color codes.
+        self.cfa = np.array(
+            [COLOR_CODES.get(plane_codes[int(code)], "?") for code in codes]
+        ).reshape(self.repeat)
+
+        white = _tag_array(tags, TAG_WHITE_LEVEL)
+        self.white_level = float(white[0]) if white is not None else float(2 ** self.page.bitspersample - 1)
+        black = _tag_array(tags, TAG_BLACK_LEVEL)
+        black_dim = _tag_array(tags, TAG_BLACK_LEVEL_REPEAT_DIM)
+        dims = (int(black_dim[0]), int(black_dim[1])) if black_dim is not None and black_dim.size == 2 else (1, 1)
+        if black is None:
+            black = np.zeros(dims[0] * dims[1], dtype=np.float64)
+        self.black_levels = np.resize(black, dims[0] * dims[1]).reshape(dims)
+
+    def close(self) -> None:
+        self._tif.close()
+
+    def __enter__(self) -> "DngWindowReader":
+        return self
+
+    def __exit__(self, *exc: object) -> None:
+        self.close()
+
+    def pattern_at(self, top: int, left: int) -> str:
+        rep_h, rep_w = self.repeat
+        return "".join(
+            self.cfa[(top + dy) % rep_h, (left + dx) % rep_w] for dy in range(2) for dx in range(2)
+        )
+
+    def read_window(self, rect: Dict[str, int], align: bool = True) -> RawWindow:
+        """
+        Decode the CFA samples inside ``rect``. With ``align`` the window is
+        grown outward to whole CFA repeats so its phase is always (0, 0).
+        """
+        top, bottom = max(rect["top"], 0), min(rect["bottom"], self.height)
+        left, right = max(rect["left"], 0), min(rect["right"], self.width)
+        if bottom <= top or right <= left:
+            raise ValueError(f"Invalid ROI rect: {rect}")
+        if align:
+            rep_h, rep_w = self.repeat
+            top -= top % rep_h
+            left -= left % rep_w
+            bottom = min(bottom + (-bottom) % rep_h, self.height)
+            right = min(right + (-right) % rep_w, self.width)
+
+        page = self.page
+        o_top, o_left = self.origin
+        y0, y1 = top + o_top, bottom + o_top
+        x0, x1 = left + o_left, right + o_left
+        chunk_h, chunk_w = page.chunks[0], page.chunks[1]
+        n_across = page.chunked[1] if len(page.chunked) > 1 else 1
+        indices = [
+            row * n_across + col
+            for row in range(y0 // chunk_h, (y1 - 1) // chunk_h + 1)
+            for col in range(x0 // chunk_w, (x1 - 1) // chunk_w + 1)
+        ]
+        offsets = [page.dataoffsets[i] for i in indices]
+        bytecounts = [page.databytecounts[i] for i in indices]
+
+        window = np.zeros((y1 - y0, x1 - x0), dtype=page.dtype)
+        for data, index in self._tif.filehandle.read_segments(offsets, bytecounts, indices=indices):
+            segment, seg_index, _ = page.decode(data, index, jpegtables=page.jpegtables)
+            if segment is None:
+                continue
+            segment = segment.reshape(segment.shape[-3], segment.shape[-2])
+            seg_y, seg_x = seg_index[-3], seg_index[-2]
+            sy0, sy1 = max(y0, seg_y), min(y1, seg_y + segment.shape[0])
+            sx0, sx1 = max(x0, seg_x), min(x1, seg_x + segment.shape[1])
+            if sy1 <= sy0 or sx1 <= sx0:
+                continue
+            window[sy0 - y0 : sy1 - y0, sx0 - x0 : sx1 - x0] = segment[
+                sy0 - seg_y : sy1 - seg_y, sx0 - seg_x : sx1 - seg_x
+            ]
+
+        rep_h, rep_w = self.repeat
+        return RawWindow(
+            data=window,
+            top=top,
+            left=left,
+            pattern=self.pattern_at(top, left),
+            phase=(top % rep_h, left % rep_w),
+            bytes_read=int(sum(bytecounts)),
+        )
+
+    def window_means(self, window: RawWindow, rect: Optional[Dict[str, int]] = None) -> Dict[str, float]:
+        """
+        RawRoiProcessor-style means (black-subtracted, white-normalized,
+        CFA colors averaged with equal weight) for ``rect`` inside ``window``.
+        """
+        data = window.data
+        if rect is not None:
+            data = data[
+                max(rect["top"] - window.top, 0) : rect["bottom"] - window.top,
+                max(rect["left"] - window.left, 0) : rect["right"] - window.left,
+            ]
+            row0, col0 = max(rect["top"], window.top), max(rect["left"], window.left)
+        else:
+            row0, col0 = window.top, window.left
+        rep_h, rep_w = self.repeat
+        black_h, black_w = self.black_levels.shape
+        per_letter: Dict[str, list] = {"R": [], "G": [], "B": []}
+        for dy in range(rep_h):
+            for dx in range(rep_w):
+                samples = data[dy::rep_h, dx::rep_w]
+                if samples.size == 0:
+                    continue
+                letter = self.cfa[(row0 + dy) % rep_h, (col0 + dx) % rep_w]
+                black = self.black_levels[(row0 + dy) % black_h, (col0 + dx) % black_w]
+                corrected = np.clip(samples.astype(np.float64) - black, 0, None) / self.white_level
+                if letter in per_letter:
+                    per_letter[letter].append(float(corrected.mean()))
+        return {
+            key.lower(): float(np.mean(values)) if values else float("nan")
+            for key, values in per_letter.items()
+        }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Read only the DNG strips/tiles covering a raw_rect.")
+    parser.add_argument("--dng", required=True, type=Path, help="Path to DNG file.")
+    parser.add_argument(
+        "--rect",
+        required=True,
+        type=int,
+        nargs=4,
+        metavar=("LEFT", "TOP", "RIGHT", "BOTTOM"),
+        help="raw_rect in raw_image_visible coordinates.",
+    )
+    args = parser.parse_args()
+    left, top, right, bottom = args.rect
+    rect = {"left": left, "top": top, "right": right, "bottom": bottom}
+    with DngWindowReader(args.dng) as reader:
+        window = reader.read_window(rect)
+        print(f"Sensor (active area): {reader.width}x{reader.height}, CFA repeat {reader.repeat}")
+        print(
+            f"Window: rows {window.top}:{window.top + window.data.shape[0]}, "
+            f"cols {window.left}:{window.left + window.data.shape[1]}, "
+            f"pattern {window.pattern}, phase {window.phase}"
+        )
+        print(f"Bytes read: {window.bytes_read}")
+        print("ROI means:", reader.window_means(window, rect))
+
+
+if __name__ == "__main__":
+    main()
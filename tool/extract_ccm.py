@@ -3,6 +3,9 @@
 Extract and compare the various Color Correction Matrices (CCM) available
 in a DNG snapshot. The script reproduces rawpy's matrix collapsing logic
 so we can port the same math into Kotlin.
+
+rawpy's matrix is read with a bare rawpy.imread (no postprocess, no pixel
+sidecar). --dng-matrix adds the ColorMatrix tag read from the DNG header.
 """
 
 from __future__ import annotations
@@ -15,6 +18,8 @@ from typing import Dict, Iterable, List, Sequence
 import numpy as np
 import rawpy  # type: ignore
 
+from dng_metadata import cam_to_xyz_matrix, preferred_color_matrix_key, read_dng_metadata, xyz_to_cam_matrix
+
 
 def parse_args() -> argparse.Namespace:
     parser = argparse.ArgumentParser(description="Inspect CCM sources for a snapshot.")
@@ -30,6 +35,11 @@ def parse_args() -> argparse.Namespace:
         default=0,
         help="ROI row index to inspect in the CSV (default: 0).",
     )
+    parser.add_argument(
+        "--dng-matrix",
+        action="store_true",
+        help="Also show the DNG ColorMatrix tag (D65 preferred), read from the header only.",
+    )
     return parser.parse_args()
 
 
@@ -71,6 +81,12 @@ def color_matrix_from_rawpy(color_matrix: np.ndarray, color_desc: bytes) -> np.n
     return np.stack(collapsed, axis=1)
 
 
+def read_rawpy_color_matrix(dng_path: Path) -> np.ndarray:
+    """rawpy's collapsed XYZ->Cam matrix; opens the DNG without postprocessing or caching pixels."""
+    with rawpy.imread(str(dng_path)) as raw:
+        return color_matrix_from_rawpy(np.array(raw.color_matrix), raw.color_desc)
+
+
 def summarize(name: str, matrix: np.ndarray | None) -> None:
     print(f"\n{name}:")
     if matrix is None:
@@ -84,15 +100,20 @@ def main() -> None:
     args = parse_args()
 
     row = load_csv_row(args.csv, args.csv_row) if args.csv else None
-    with rawpy.imread(str(args.dng)) as raw:
-        rawpy_matrix = color_matrix_from_rawpy(np.array(raw.color_matrix), raw.color_desc)
-        rawpy_cam_to_xyz = rawpy_matrix.T
-        rawpy_xyz_to_cam = rawpy_matrix
+    rawpy_matrix = read_rawpy_color_matrix(args.dng)
+    rawpy_cam_to_xyz = rawpy_matrix.T
+    rawpy_xyz_to_cam = rawpy_matrix
 
     matrices: Dict[str, np.ndarray | None] = {
         "rawpy_cam_to_xyz": rawpy_cam_to_xyz,
         "rawpy_xyz_to_cam": rawpy_xyz_to_cam,
     }
+    if args.dng_matrix:
+        # A different matrix from rawpy's: the calibration tag itself, header-only.
+        metadata = read_dng_metadata(args.dng)
+        print(f"DNG ColorMatrix used: {preferred_color_matrix_key(metadata)}")
+        matrices["dng_cam_to_xyz"] = cam_to_xyz_matrix(metadata)
+        matrices["dng_xyz_to_cam"] = xyz_to_cam_matrix(metadata)
     if row:
         matrices["app_cam_to_xyz"] = matrix_from_row(row, "cam_to_xyz", 3, 3)
         matrices["app_xyz_to_cam"] = matrix_from_row(row, "xyz_to_cam", 3, 3)
@@ -0,0 +1,265 @@
+#!/usr/bin/env python3
+"""
+Directory-scale CCM extraction into one columnar table.
+
+Scans one or more directory trees for DNGs, reads their color tags with the
+header-only extractor in parallel worker processes, and writes one row per
+DNG: collapsed XYZ->Cam / Cam->XYZ, the raw ColorMatrix1/2 and their
+calibration illuminants. Re-runs are incremental: files whose mtime and size
+match the existing table are carried over without being reopened.
+
+The dng_xyz_to_cam / dng_cam_to_xyz columns come from the DNG ColorMatrix
+tag named in matrix_key (D65 preferred), i.e. extract_ccm's --dng-matrix
+output, not rawpy's color_matrix that extract_ccm prints by default.
+
+Output format follows the suffix: .npz (always available) or .parquet
+(requires pyarrow).
+
+Usage:
+  python extract_ccm_batch.py --root <captures_dir> [--root ...] --output ccm_table.npz
+"""
+
+from __future__ import annotations
+
+import argparse
+import os
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+
+from dng_metadata import cam_to_xyz_matrix, preferred_color_matrix_key, read_dng_metadata, xyz_to_cam_matrix
+
+# Raw ColorMatrix tags hold up to 4 color planes x 3; shorter ones are NaN-padded.
+RAW_MATRIX_SIZE = 12
+
+FLOAT_COLUMNS = ("color_matrix1", "color_matrix2", "dng_xyz_to_cam", "dng_cam_to_xyz")
+COLUMN_SHAPES = {
+    "color_matrix1": (RAW_MATRIX_SIZE,),
+    "color_matrix2": (RAW_MATRIX_SIZE,),
+    "dng_xyz_to_cam": (3, 3),
+    "dng_cam_to_xyz": (3, 3),
+}
+# Tables written before the DNG-matrix columns were renamed.
+LEGACY_COLUMNS = {"xyz_to_cam": "dng_xyz_to_cam", "cam_to_xyz": "dng_cam_to_xyz"}
+
+
+@dataclass
+class CcmRow:
+    path: str
+    mtime_ns: int
+    size: int
+    color_planes: int
+    illuminant1: int
+    illuminant2: int
+    matrix_key: str
+    color_matrix1: np.ndarray
+    color_matrix2: np.ndarray
+    dng_xyz_to_cam: np.ndarray
+    dng_cam_to_xyz: np.ndarray
+    error: str = ""
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Extract CCMs from every DNG under one or more directories.")
+    parser.add_argument("--root", required=True, type=Path, action="append", help="Directory to scan (repeatable).")
+    parser.add_argument("--output", required=True, type=Path, help="Output table (.npz or .parquet).")
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=os.cpu_count() or 1,
+        help="Worker processes (default: CPU count).",
+    )
+    parser.add_argument("--full", action="store_true", help="Ignore the existing table and re-extract everything.")
+    return parser.parse_args()
+
+
+def iter_dngs(roots: Iterable[Path]) -> Iterable[Path]:
+    for root in roots:
+        for dirpath, _, filenames in os.walk(root):
+            for name in filenames:
+                if name.lower().endswith(".dng"):
+                    yield Path(dirpath) / name
+
+
+def _padded(values: Optional[List[float]]) -> np.ndarray:
+    out = np.full(RAW_MATRIX_SIZE, np.nan, dtype=np.float64)
+    if values:
+        count = min(len(values), RAW_MATRIX_SIZE)
+        out[:count] = values[:count]
+    return out
+
+
+def _error_row(path: str, mtime_ns: int, size: int, error: str) -> CcmRow:
+    nan3 = np.full((3, 3), np.nan, dtype=np.float64)
+    return CcmRow(path, mtime_ns, size, 0, 0, 0, "", _padded(None), _padded(None), nan3, nan3.copy(), error)
+
+
+def extract_row(path: str) -> CcmRow:
+    """One table row; any failure on this file is recorded in ``error`` instead of raised."""
+    try:
+        stat = os.stat(path)
+    except OSError as exc:
+        return _error_row(path, 0, 0, f"{type(exc).__name__}: {exc}")
+    try:
+        return _extract_row(path, stat)
+    except Exception as exc:  # noqa: BLE001 - malformed tags raise all sorts; one file must not stop the pool
+        return _error_row(path, stat.st_mtime_ns, stat.st_size, f"{type(exc).__name__}: {exc}")
+
+
+def _extract_row(path: str, stat: os.stat_result) -> CcmRow:
+    nan3 = np.full((3, 3), np.nan, dtype=np.float64)
+    metadata = read_dng_metadata(Path(path))
+    cm1 = metadata.get("colorMatrix1")
+    xyz_to_cam = xyz_to_cam_matrix(metadata)
+    cam_to_xyz = cam_to_xyz_matrix(metadata)
+    return CcmRow(
+        path=path,
+        mtime_ns=stat.st_mtime_ns,
+        size=stat.st_size,
+        color_planes=len(cm1) // 3 if cm1 else 0,
+        illuminant1=int(metadata.get("calibrationIlluminant1", 0)),
+        illuminant2=int(metadata.get("calibrationIlluminant2", 0)),
+        matrix_key=preferred_color_matrix_key(metadata) or "",
+        color_matrix1=_padded(cm1),
+        color_matrix2=_padded(metadata.get("colorMatrix2")),
+        dng_xyz_to_cam=xyz_to_cam if xyz_to_cam is not None else nan3,
+        dng_cam_to_xyz=cam_to_xyz if cam_to_xyz is not None else nan3,
+        error="" if xyz_to_cam is not None else "no usable ColorMatrix",
+    )
+
+
+def rows_to_columns(rows: List[CcmRow]) -> Dict[str, np.ndarray]:
+    columns: Dict[str, np.ndarray] = {
+        "path": np.array([row.path for row in rows], dtype=str),
+        "mtime_ns": np.array([row.mtime_ns for row in rows], dtype=np.int64),
+        "size": np.array([row.size for row in rows], dtype=np.int64),
+        "color_planes": np.array([row.color_planes for row in rows], dtype=np.int16),
+        "illuminant1": np.array([row.illuminant1 for row in rows], dtype=np.int16),
+        "illuminant2": np.array([row.illuminant2 for row in rows], dtype=np.int16),
+        "matrix_key": np.array([row.matrix_key for row in rows], dtype=str),
+        "error": np.array([row.error for row in rows], dtype=str),
+    }
+    for name in FLOAT_COLUMNS:
+        stacked = [getattr(row, name) for row in rows]
+        columns[name] = (
+            np.stack(stacked).astype(np.float64)
+            if stacked
+            else np.zeros((0,) + COLUMN_SHAPES[name], dtype=np.float64)
+        )
+    return columns
+
+
+def columns_to_rows(columns: Dict[str, np.ndarray]) -> List[CcmRow]:
+    return [
+        CcmRow(
+            path=str(columns["path"][i]),
+            mtime_ns=int(columns["mtime_ns"][i]),
+            size=int(columns["size"][i]),
+            color_planes=int(columns["color_planes"][i]),
+            illuminant1=int(columns["illuminant1"][i]),
+            illuminant2=int(columns["illuminant2"][i]),
+            matrix_key=str(columns["matrix_key"][i]),
+            color_matrix1=columns["color_matrix1"][i],
+            color_matrix2=columns["color_matrix2"][i],
+            dng_xyz_to_cam=columns["dng_xyz_to_cam"][i],
+            dng_cam_to_xyz=columns["dng_cam_to_xyz"][i],
+            error=str(columns["error"][i]),
+        )
+        for i in range(len(columns["path"]))
+    ]
+
+
+def _require_pyarrow():
+    try:
+        import pyarrow  # type: ignore
+        import pyarrow.parquet  # type: ignore  # noqa: F401
+    except ImportError as exc:  # pragma: no cover - optional dependency
+        raise SystemExit("Parquet output requires pyarrow. Install it via `pip install pyarrow` or use .npz.") from exc
+    return pyarrow
+
+
+def load_table(path: Path) -> Dict[str, np.ndarray]:
+    if path.suffix.lower() == ".parquet":
+        pa = _require_pyarrow()
+        table = pa.parquet.read_table(str(path))
+        columns = {
+            LEGACY_COLUMNS.get(name, name): table.column(name).to_numpy(zero_copy_only=False)
+            for name in table.column_names
+        }
+        for name in FLOAT_COLUMNS:
+            shape = COLUMN_SHAPES[name]
+            columns[name] = np.array([np.asarray(v, dtype=np.float64) for v in columns[name]]).reshape((-1,) + shape)
+        return columns
+    with np.load(path, allow_pickle=False) as data:
+        return {LEGACY_COLUMNS.get(name, name): data[name] for name in data.files}
+
+
+def save_table(path: Path, columns: Dict[str, np.ndarray]) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(path.name + ".tmp")
+    if path.suffix.lower() == ".parquet":
+        pa = _require_pyarrow()
+        arrays = {}
+        for name, values in columns.items():
+            if name in FLOAT_COLUMNS:
+                arrays[name] = pa.array(values.reshape(len(values), -1).tolist(), type=pa.list_(pa.float64()))
+            else:
+                arrays[name] = pa.array(values.tolist())
+        pa.parquet.write_table(pa.table(arrays), str(tmp_path))
+    else:
+        with tmp_path.open("wb") as fh:
+            np.savez(fh, **columns)
+    os.replace(tmp_path, path)
+
+
+def main() -> None:
+    args = parse_args()
+    previous: Dict[str, CcmRow] = {}
+    if args.output.exists() and not args.full:
+        previous = {row.path: row for row in columns_to_rows(load_table(args.output))}
+
+    kept: List[CcmRow] = []
+    pending: List[str] = []
+    seen = set()
+    for dng in iter_dngs(args.root):
+        path = str(dng.resolve())
+        # Overlapping --root arguments (or symlinks) reach the same file twice.
+        if path in seen:
+            continue
+        seen.add(path)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            pending.append(path)  # extract_row records the error
+            continue
+        old = previous.get(path)
+        if old is not None and old.mtime_ns == stat.st_mtime_ns and old.size == stat.st_size:
+            kept.append(old)
+        else:
+            pending.append(path)
+
+    fresh: List[CcmRow] = []
+    if pending:
+        if args.workers > 1 and len(pending) > 1:
+            with ProcessPoolExecutor(max_workers=args.workers) as pool:
+                fresh = list(pool.map(extract_row, pending, chunksize=max(1, len(pending) // (args.workers * 4))))
+        else:
+            fresh = [extract_row(path) for path in pending]
+
+    rows = sorted(kept + fresh, key=lambda row: row.path)
+    save_table(args.output, rows_to_columns(rows))
+    failed = [row for row in fresh if row.error]
+    for row in failed:
+        print(f"{row.path}: {row.error}")
+    dropped = len(previous) - len(kept) - sum(1 for row in fresh if row.path in previous)
+    print(
+        f"Wrote {len(rows)} rows to {args.output} "
+        f"({len(fresh)} extracted, {len(kept)} unchanged, {dropped} removed, {len(failed)} without a usable matrix)."
+    )
+
+
+if __name__ == "__main__":
+    main()
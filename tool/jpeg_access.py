@@ -0,0 +1,263 @@
+#!/usr/bin/env python3
+"""
+Reduced JPEG decoding for the ROI tools.
+
+The JPEG tools used to decode the full camera JPEG, often rotate it upright
+with rotate(expand=True), and only then crop a small ROI or shrink the
+whole image for a preview. This module keeps two cheaper paths:
+
+* ROI statistics: libjpeg hands out scanlines top to bottom, so
+  read_stored_boxes stops decoding after the MCU row that holds the lowest
+  requested box edge. Nothing below the ROI is decoded. Rows above it
+  still are, because a baseline JPEG has no random access without restart
+  markers. The pixels are identical to a full decode. JpegIntegralImage
+  builds a summed-area table over such a decode for tools that average
+  many boxes of the same image.
+* Previews: open_preview uses PIL's draft() to decode at 1/2, 1/4 or 1/8
+  scale straight from the DCT coefficients, then fits the result into a
+  box.
+
+EXIF orientation is never applied to the full image. Boxes given in
+upright (display) coordinates are remapped to stored coordinates with
+JpegInfo.to_stored_box. Only the small preview is ever transposed.
+
+Usage:
+  python jpeg_access.py --jpeg <path> --box L T R B   # mean sRGB of an upright box
+"""
+
+from __future__ import annotations
+
+import argparse
+from dataclasses import dataclass
+from pathlib import Path
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+from PIL import Image, ImageFile
+
+Box = Tuple[int, int, int, int]
+
+EXIF_ORIENTATION_TAG = 274
+
+# Stored -> upright transposition per EXIF orientation (as ImageOps.exif_transpose).
+ORIENTATION_TRANSPOSE = {
+    2: Image.Transpose.FLIP_LEFT_RIGHT,
+    3: Image.Transpose.ROTATE_180,
+    4: Image.Transpose.FLIP_TOP_BOTTOM,
+    5: Image.Transpose.TRANSPOSE,
+    6: Image.Transpose.ROTATE_270,
+    7: Image.Transpose.TRANSVERSE,
+    8: Image.Transpose.ROTATE_90,
+}
+
+
+def _orientation_of(img: Image.Image) -> int:
+    try:
+        orientation = int(img.getexif().get(EXIF_ORIENTATION_TAG, 1))
+    except (TypeError, ValueError):
+        return 1
+    return orientation if orientation in ORIENTATION_TRANSPOSE else 1
+
+
+@dataclass(frozen=True)
+class JpegInfo:
+    """Header facts about a JPEG: stored pixel size and EXIF orientation (1..8)."""
+
+    path: Path
+    size: Tuple[int, int]
+    orientation: int = 1
+
+    @property
+    def swaps_axes(self) -> bool:
+        return self.orientation in (5, 6, 7, 8)
+
+    @property
+    def upright_size(self) -> Tuple[int, int]:
+        width, height = self.size
+        return (height, width) if self.swaps_axes else (width, height)
+
+    def to_stored_box(self, box: Sequence[int]) -> Box:
+        """
+        Map a half-open (left, top, right, bottom) box in upright pixels to
+        the box covering the same pixels in the stored image.
+        """
+        left, top, right, bottom = (int(v) for v in box)
+        width, height = self.size
+        orientation = self.orientation
+        if orientation == 2:
+            return width - right, top, width - left, bottom
+        if orientation == 3:
+            return width - right, height - bottom, width - left, height - top
+        if orientation == 4:
+            return left, height - bottom, right, height - top
+        if orientation == 5:
+            return top, left, bottom, right
+        if orientation == 6:
+            return top, height - right, bottom, height - left
+        if orientation == 7:
+            return width - bottom, height - right, width - top, height - left
+        if orientation == 8:
+            return width - bottom, left, width - top, right
+        return left, top, right, bottom
+
+    def to_upright(self, img: Image.Image) -> Image.Image:
+        """Apply the EXIF orientation to an image in stored orientation (any scale)."""
+        method = ORIENTATION_TRANSPOSE.get(self.orientation)
+        return img.transpose(method) if method is not None else img
+
+
+def read_jpeg_info(jpeg_path: Path) -> JpegInfo:
+    """Parse only the JPEG header and EXIF block."""
+    with Image.open(jpeg_path) as img:
+        return JpegInfo(Path(jpeg_path), img.size, _orientation_of(img))
+
+
+# Tile record type of the Pillow releases whose decoder internals the partial
+# decode was written against (Pillow >= 11); older ones fall back to a full decode.
+_PIL_TILE = getattr(ImageFile, "_Tile", None)
+
+
+def decode_rows(jpeg_path: Path, rows: int) -> np.ndarray:
+    """
+    RGB uint8 array of the first ``rows`` stored rows. Decoding stops once
+    they are filled, i.e. after the MCU row that contains row ``rows - 1``.
+    The partial decode relies on Pillow internals (``_size``, ``_Tile``);
+    without them the whole image is decoded and cropped.
+    """
+    with Image.open(jpeg_path) as img:
+        width, height = img.size
+        rows = max(1, min(int(rows), height))
+        partial = (
+            _PIL_TILE is not None
+            and hasattr(img, "_size")
+            and rows < height
+            and len(img.tile) == 1
+            and img.tile[0][0] == "jpeg"
+        )
+        if partial:
+            name, _, offset, args = img.tile[0][:4]
+            img._size = (width, rows)
+            img.tile = [_PIL_TILE(name, (0, 0, width, rows), offset, args)]
+            try:
+                img.load()
+            except OSError:
+                # libjpeg reports the unread scanlines at finish time; the
+                # requested rows are complete once the decoder has stopped.
+                if img.tile or img.im is None:
+                    raise
+        return np.asarray(img.convert("RGB"))[:rows]
+
+
+def read_stored_boxes(jpeg_path: Path, boxes: Sequence[Sequence[int]]) -> List[np.ndarray]:
+    """Pixels of several stored-coordinate boxes from one partial decode."""
+    boxes = [tuple(int(v) for v in box) for box in boxes]
+    if not boxes:
+        return []
+    pixels = decode_rows(jpeg_path, max(box[3] for box in boxes))
+    return [pixels[top:bottom, left:right] for left, top, right, bottom in boxes]
+
+
+def mean_srgb(info: JpegInfo, boxes: Sequence[Sequence[int]]) -> List[np.ndarray]:
+    """
+    Mean gamma sRGB (0..1) of each upright box. A mean does not depend on
+    pixel order, so the crops are never rotated.
+    """
+    crops = read_stored_boxes(info.path, [info.to_stored_box(box) for box in boxes])
+    return [
+        crop.reshape(-1, 3).astype(np.float32).mean(axis=0) / np.float32(255.0)
+        if crop.size
+        else np.zeros(3)
+        for crop in crops
+    ]
+
+
+class JpegIntegralImage:
+    """
+    Summed-area table of a JPEG's stored RGB pixels.
+
+    Upright boxes are remapped with JpegInfo.to_stored_box, so the table
+    serves every EXIF orientation (and every rotated or mirrored ROI
+    hypothesis) without transposing the image; each box mean is four
+    lookups per channel. Only the first ``rows`` stored rows are decoded.
+    """
+
+    def __init__(self, info: JpegInfo, rows: Optional[int] = None) -> None:
+        self.info = info
+        pixels = decode_rows(info.path, info.size[1] if rows is None else rows)
+        self.height, self.width = pixels.shape[:2]
+        # uint32 wraps past 2**32, but box sums are differences of table
+        # entries and stay exact while a single box holds < 2**32 / 255 pixels.
+        self.table = np.zeros((self.height + 1, self.width + 1, 3), dtype=np.uint32)
+        np.cumsum(pixels, axis=0, dtype=np.uint32, out=self.table[1:, 1:])
+        np.cumsum(self.table[1:, 1:], axis=1, dtype=np.uint32, out=self.table[1:, 1:])
+
+    def mean_srgb_batch(self, boxes: Sequence[Sequence[int]]) -> np.ndarray:
+        """
+        Mean gamma sRGB (0..1) for an (N, 4) sequence of upright boxes.
+        Boxes that fall outside the decoded rows raise ValueError.
+        """
+        stored = np.array([self.info.to_stored_box(box) for box in boxes], dtype=np.int64).reshape(-1, 4)
+        if self.height < self.info.size[1] and np.any(stored[:, 3] > self.height):
+            raise ValueError(f"Boxes reach below the {self.height} decoded rows")
+        left = np.clip(stored[:, 0], 0, self.width)
+        top = np.clip(stored[:, 1], 0, self.height)
+        right = np.clip(stored[:, 2], 0, self.width)
+        bottom = np.clip(stored[:, 3], 0, self.height)
+        count = np.maximum(right - left, 0) * np.maximum(bottom - top, 0)
+        t = self.table
+        total = t[bottom, right] - t[top, right] - t[bottom, left] + t[top, left]
+        means = total.astype(np.float64) / np.maximum(count, 1)[:, None] / 255.0
+        means[count == 0] = 0.0
+        return means
+
+
+def open_preview(
+    info: JpegInfo,
+    max_width: float,
+    max_height: float,
+    upright: bool = True,
+) -> Tuple[Image.Image, float]:
+    """
+    RGB preview fitted into (max_width, max_height), decoded at the
+    coarsest DCT scale that still covers the box. Returns the preview and
+    its scale relative to the full-resolution pixels. With ``upright``
+    False the preview keeps the stored orientation.
+    """
+    full_w, full_h = info.upright_size if upright else info.size
+    scale = min(max_width / full_w, max_height / full_h, 1.0)
+    target = (max(1, int(full_w * scale)), max(1, int(full_h * scale)))
+    stored_target = (target[1], target[0]) if upright and info.swaps_axes else target
+    with Image.open(info.path) as img:
+        img.draft("RGB", stored_target)
+        preview = img.convert("RGB")
+    if upright:
+        preview = info.to_upright(preview)
+    if preview.size != target:
+        preview = preview.resize(target, Image.LANCZOS)
+    return preview, target[0] / full_w
+
+
+def scale_box(box: Sequence[int], scale: float, size: Tuple[int, int]) -> Box:
+    """Map a full-resolution box onto a preview ``scale`` times the size, at least 1 px."""
+    width, height = size
+    left = min(max(int(box[0] * scale), 0), width - 1)
+    top = min(max(int(box[1] * scale), 0), height - 1)
+    right = min(max(int(np.ceil(box[2] * scale)), left + 1), width)
+    bottom = min(max(int(np.ceil(box[3] * scale)), top + 1), height)
+    return left, top, right, bottom
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Mean sRGB of an upright JPEG box via partial decoding.")
+    parser.add_argument("--jpeg", required=True, type=Path, help="JPEG file.")
+    parser.add_argument("--box", required=True, type=int, nargs=4, metavar=("L", "T", "R", "B"),
+                        help="Box in upright pixel coordinates.")
+    args = parser.parse_args()
+    info = read_jpeg_info(args.jpeg)
+    mean = mean_srgb(info, [args.box])[0]
+    print(f"{args.jpeg}: stored {info.size[0]}x{info.size[1]}, orientation {info.orientation}")
+    print(f"stored box {info.to_stored_box(args.box)}: mean sRGB {np.round(mean * 255.0, 3)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -3,6 +3,8 @@
 Compare two simple color pipelines for a recorded ROI row:
 1) The current Kotlin-style pipeline (uses cam_to_xyz from ROI CSV).
 2) A rawpy-style pipeline (uses cam_to_xyz derived from rawpy's color matrix).
+3) With --dng-matrix, the same pipeline on the inverse of the DNG ColorMatrix
+   tag (D65 calibration preferred), read from the header only.
 
 Each step is plotted to separate PNGs so we can inspect how values evolve.
 """
@@ -16,21 +18,11 @@ from typing import Dict, List, Tuple
 
 import matplotlib.pyplot as plt
 import numpy as np
-import rawpy  # type: ignore
 
-from extract_ccm import color_matrix_from_rawpy
-
-D50 = np.array([0.9642, 1.0, 0.8251], dtype=np.float64)
-D65 = np.array([0.95047, 1.0, 1.08883], dtype=np.float64)
-
-XYZ_TO_SRGB = np.array(
-    [
-        [3.2406, -1.5372, -0.4986],
-        [-0.9689, 1.8758, 0.0415],
-        [0.0557, -0.2040, 1.0570],
-    ],
-    dtype=np.float64,
-)
+from chromatic_adaptation import D50, D65, adapt
+from color_core import linear_to_srgb, xyz_to_linear_srgb
+from dng_metadata import read_dng_metadata, xyz_to_cam_matrix
+from extract_ccm import read_rawpy_color_matrix
 
 
 def parse_args() -> argparse.Namespace:
@@ -44,6 +36,11 @@ def parse_args() -> argparse.Namespace:
         default=Path("pipeline_plots"),
         help="Directory to save matplotlib figures.",
     )
+    parser.add_argument(
+        "--dng-matrix",
+        action="store_true",
+        help="Also plot a pipeline on the DNG ColorMatrix tag (dng_*.png).",
+    )
     return parser.parse_args()
 
 
@@ -52,7 +49,10 @@ def load_row(csv_path: Path, index: int) -> Dict[str, float]:
         rows = list(csv.DictReader(fh))
     if index < 0 or index >= len(rows):
         raise IndexError(f"Row {index} out of range (total {len(rows)})")
-    row = rows[index]
+    return parse_row(rows[index])
+
+
+def parse_row(row: Dict[str, str]) -> Dict[str, float]:
     parsed: Dict[str, float] = {}
     for key, value in row.items():
         if value in ("", None):
@@ -78,41 +78,8 @@ def matrix_from_row(row: Dict[str, float], prefix: str) -> np.ndarray:
 
 
 def adapt_to_d65(xyz: np.ndarray) -> np.ndarray:
-    if xyz.size != 3:
-        raise ValueError("XYZ vector must have length 3")
-    bradford = np.array(
-        [
-            [0.8951, 0.2664, -0.1614],
-            [-0.7502, 1.7135, 0.0367],
-            [0.0389, -0.0685, 1.0296],
-        ],
-        dtype=np.float64,
-    )
-    bradford_inv = np.array(
-        [
-            [0.9869929, -0.1470543, 0.1599627],
-            [0.4323053, 0.5183603, 0.0492912],
-            [-0.0085287, 0.0400428, 0.9684867],
-        ],
-        dtype=np.float64,
-    )
-    src_cone = bradford @ D50
-    dst_cone = bradford @ D65
-    scale = np.divide(dst_cone, src_cone, out=np.ones_like(dst_cone), where=src_cone != 0)
-    cone = bradford @ xyz
-    adapted = cone * scale
-    return bradford_inv @ adapted
-
-
-def linear_to_srgb(linear_rgb: np.ndarray) -> np.ndarray:
-    def gamma_channel(v: float) -> float:
-        if v <= 0.0:
-            return 0.0
-        if v <= 0.0031308:
-            return 12.92 * v
-        return 1.055 * (v ** (1.0 / 2.4)) - 0.055
-
-    return np.array([gamma_channel(channel) for channel in linear_rgb])
+    """Bradford D50 -> D65 for one XYZ vector or an (N, 3) batch."""
+    return adapt(xyz, D50, D65, "bradford")
 
 
 def as_shot_neutral_from_wb(wb: np.ndarray) -> np.ndarray:
@@ -135,9 +102,10 @@ def compute_pipeline(
     steps.append(("xyz_d50", xyz))
     xyz_d65 = adapt_to_d65(xyz)
     steps.append(("xyz_d65", xyz_d65))
-    linear_srgb = XYZ_TO_SRGB @ xyz_d65
+    linear_srgb = xyz_to_linear_srgb(xyz_d65)
     steps.append(("srgb_linear", linear_srgb))
-    gamma_srgb = linear_to_srgb(linear_srgb)
+    # Negative channels encode to 0; values above 1 are left unclamped.
+    gamma_srgb = linear_to_srgb(np.clip(linear_srgb, 0.0, None))
     steps.append(("srgb_gamma", gamma_srgb))
     return steps
 
@@ -157,39 +125,62 @@ def ensure_dir(path: Path) -> None:
     path.mkdir(parents=True, exist_ok=True)
 
 
-def run_pipeline(csv_path: Path, dng_path: Path, row_index: int, output_dir: Path) -> Path:
-    ensure_dir(output_dir)
-    row = load_row(csv_path, row_index)
+def rawpy_cam_to_xyz(dng_path: Path) -> np.ndarray:
+    # Derive cam_to_xyz via rawpy matrix.
+    return np.linalg.inv(read_rawpy_color_matrix(dng_path))
+
+
+def dng_cam_to_xyz(dng_path: Path) -> np.ndarray:
+    """Inverse of the DNG ColorMatrix tag; not the same matrix as rawpy's color_matrix."""
+    xyz_to_cam_dng = xyz_to_cam_matrix(read_dng_metadata(dng_path))
+    if xyz_to_cam_dng is None:
+        raise ValueError(f"No usable ColorMatrix tag in {dng_path}")
+    return np.linalg.inv(xyz_to_cam_dng)
 
+
+def compare_row(
+    row: Dict[str, float], cam_to_xyz_rawpy: np.ndarray
+) -> Tuple[List[Tuple[str, np.ndarray]], List[Tuple[str, np.ndarray]]]:
+    """Run both pipelines on a parsed ROI row; returns (kotlin_steps, rawpy_steps)."""
     camera_rgb = np.array([row["raw_r"], row["raw_g"], row["raw_b"]], dtype=np.float64)
     wb_gains = np.array([row["wb_r_gain"], row["wb_g_gain"], row["wb_b_gain"]], dtype=np.float64)
 
     cam_to_xyz_kotlin = matrix_from_row(row, "cam_to_xyz")
 
-    # Derive cam_to_xyz via rawpy matrix
-    with rawpy.imread(str(dng_path)) as raw:
-        xyz_to_cam_rawpy = color_matrix_from_rawpy(np.array(raw.color_matrix), raw.color_desc)
-    cam_to_xyz_rawpy = np.linalg.inv(xyz_to_cam_rawpy)
-
     kotlin_steps = compute_pipeline("kotlin", camera_rgb, wb_gains, cam_to_xyz_kotlin)
     rawpy_steps = compute_pipeline("rawpy", camera_rgb, wb_gains, cam_to_xyz_rawpy)
+    return kotlin_steps, rawpy_steps
 
-    for step_name, values in kotlin_steps:
-        output_path = output_dir / f"kotlin_{step_name}.png"
-        labels = ["R", "G", "B"] if "srgb" in step_name or "white" in step_name or "camera" in step_name else ["X", "Y", "Z"]
-        save_plot(values, labels, f"Kotlin - {step_name}", output_path)
 
-    for step_name, values in rawpy_steps:
-        output_path = output_dir / f"rawpy_{step_name}.png"
+def save_steps(steps: List[Tuple[str, np.ndarray]], prefix: str, title: str, output_dir: Path) -> None:
+    for step_name, values in steps:
+        output_path = output_dir / f"{prefix}_{step_name}.png"
         labels = ["R", "G", "B"] if "srgb" in step_name or "white" in step_name or "camera" in step_name else ["X", "Y", "Z"]
-        save_plot(values, labels, f"Rawpy - {step_name}", output_path)
+        save_plot(values, labels, f"{title} - {step_name}", output_path)
 
+
+def save_step_plots(
+    kotlin_steps: List[Tuple[str, np.ndarray]], rawpy_steps: List[Tuple[str, np.ndarray]], output_dir: Path
+) -> None:
+    ensure_dir(output_dir)
+    save_steps(kotlin_steps, "kotlin", "Kotlin", output_dir)
+    save_steps(rawpy_steps, "rawpy", "Rawpy", output_dir)
+
+
+def run_pipeline(csv_path: Path, dng_path: Path, row_index: int, output_dir: Path, dng_matrix: bool = False) -> Path:
+    ensure_dir(output_dir)
+    row = load_row(csv_path, row_index)
+    kotlin_steps, rawpy_steps = compare_row(row, rawpy_cam_to_xyz(dng_path))
+    save_step_plots(kotlin_steps, rawpy_steps, output_dir)
+    if dng_matrix:
+        dng_steps = compare_row(row, dng_cam_to_xyz(dng_path))[1]
+        save_steps(dng_steps, "dng", "DNG ColorMatrix", output_dir)
     return output_dir
 
 
 def main() -> None:
     args = parse_args()
-    out_dir = run_pipeline(args.roi_csv, args.dng, args.row, args.output_dir)
+    out_dir = run_pipeline(args.roi_csv, args.dng, args.row, args.output_dir, args.dng_matrix)
     print(f"Plots saved to {out_dir}")
 
 
@@ -1,21 +1,71 @@
 #!/usr/bin/env python3
 """
 Auto-run pipeline_compare on the latest snapshot without CLI arguments.
+
+With --watch, keep polling the snapshot root instead: new snapshot_*
+folders are picked up from the root's mtime, new ROI CSVs from each
+roi_exports folder's mtime, and rows appended to a known CSV from its size.
+Only the new rows are compared (against the newest DNG of their snapshot)
+and each result is appended as one JSON line to the log. A DNG that LibRaw
+cannot read yet (usually one still being copied) is logged as an error and
+its rows are retried once the DNG's name, mtime or size changes.
 """
 
 from __future__ import annotations
 
+import argparse
+import csv
 import datetime
+import io
+import json
+import os
+import struct
+import time
+from dataclasses import dataclass, field
 from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+import rawpy  # type: ignore
+
+from capture_index import SNAPSHOT_PREFIX, CaptureIndex
+from pipeline_compare import compare_row, parse_row, rawpy_cam_to_xyz, run_pipeline, save_step_plots
+
+DEFAULT_POLL_INTERVAL = 0.25
+WATCH_LOG_NAME = "pipeline_compare_log.jsonl"
 
-from pipeline_compare import run_pipeline
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Run pipeline_compare on the newest snapshot, or watch for new ones.")
+    parser.add_argument(
+        "--root",
+        type=Path,
+        default=Path(__file__).resolve().parents[2] / "storage" / "debug",
+        help="Directory holding snapshot_* folders (default: <repo>/storage/debug).",
+    )
+    parser.add_argument("--watch", action="store_true", help="Keep running and compare ROI rows as they are exported.")
+    parser.add_argument(
+        "--interval",
+        type=float,
+        default=DEFAULT_POLL_INTERVAL,
+        help=f"Watch poll interval in seconds (default: {DEFAULT_POLL_INTERVAL}).",
+    )
+    parser.add_argument("--log", type=Path, default=None, help=f"Watch result log (default: <root>/{WATCH_LOG_NAME}).")
+    parser.add_argument("--plots", action="store_true", help="In watch mode, also save per-step plots for every row.")
+    parser.add_argument(
+        "--backfill",
+        action="store_true",
+        help="In watch mode, also compare rows that already exist when the watcher starts.",
+    )
+    return parser.parse_args()
 
 
 def find_latest_snapshot(root: Path) -> Path:
-    candidates = [p for p in root.iterdir() if p.is_dir() and p.name.startswith("snapshot_")]
-    if not candidates:
+    with CaptureIndex() as index:
+        snapshot = index.latest_snapshot(root)
+    if snapshot is None:
         raise FileNotFoundError(f"No snapshot directories found under {root}")
-    return max(candidates, key=lambda p: p.stat().st_mtime)
+    return snapshot
 
 
 def find_latest_file(folder: Path, pattern: str, recursive: bool = False) -> Path:
@@ -26,10 +76,216 @@ def find_latest_file(folder: Path, pattern: str, recursive: bool = False) -> Pat
     return files[0]
 
 
+def _mtime_ns(path: Path) -> Optional[int]:
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+
+@dataclass
+class CsvCursor:
+    """How far into one ROI CSV the watcher has read."""
+
+    offset: int = 0
+    rows: int = 0
+    header: List[str] = field(default_factory=list)
+
+    def read_new_rows(self, csv_path: Path) -> List[Tuple[int, Dict[str, str]]]:
+        """Parse complete lines appended since the last call, as (row_index, row)."""
+        try:
+            size = os.stat(csv_path).st_size
+        except OSError:
+            return []
+        if size < self.offset:
+            # Rewritten rather than appended: start over.
+            self.offset, self.rows, self.header = 0, 0, []
+        if size == self.offset:
+            return []
+        with csv_path.open("rb") as fh:
+            fh.seek(self.offset)
+            chunk = fh.read(size - self.offset)
+        end = chunk.rfind(b"\n") + 1
+        if end == 0:
+            return []  # Partial line; wait for the writer to finish it.
+        encoding = "utf-8-sig" if self.offset == 0 else "utf-8"
+        self.offset += end
+        lines = chunk[:end].decode(encoding).splitlines()
+        if not self.header:
+            self.header = next(csv.reader([lines.pop(0)]), [])
+        rows = []
+        for row in csv.DictReader(io.StringIO("\n".join(lines)), fieldnames=self.header):
+            rows.append((self.rows, row))
+            self.rows += 1
+        return rows
+
+
+@dataclass
+class SnapshotState:
+    exports_mtime: Optional[int] = None
+    cursors: Dict[Path, CsvCursor] = field(default_factory=dict)
+
+
+class SnapshotWatcher:
+    """
+    Polls ``root`` for ROI rows that appeared since the previous poll. Each
+    poll stats the root, every snapshot's roi_exports folder and every known
+    CSV; directories are only listed when their mtime changed.
+    """
+
+    def __init__(self, root: Path, backfill: bool = False) -> None:
+        self.root = root
+        self.root_mtime: Optional[int] = None
+        self.snapshots: Dict[Path, SnapshotState] = {}
+        if not backfill:
+            # Consume everything already on disk so only later exports are reported.
+            for _ in self.poll():
+                pass
+
+    def _update_snapshots(self) -> None:
+        mtime = _mtime_ns(self.root)
+        if mtime == self.root_mtime:
+            return
+        self.root_mtime = mtime
+        current = set()
+        if mtime is not None:
+            with os.scandir(self.root) as entries:
+                current = {
+                    Path(entry.path)
+                    for entry in entries
+                    if entry.name.startswith(SNAPSHOT_PREFIX) and entry.is_dir(follow_symlinks=False)
+                }
+        for snapshot in set(self.snapshots) - current:
+            del self.snapshots[snapshot]
+        for snapshot in sorted(current - set(self.snapshots)):
+            self.snapshots[snapshot] = SnapshotState()
+
+    def poll(self) -> Iterator[Tuple[Path, Path, int, Dict[str, str]]]:
+        """Yield (snapshot, csv_path, row_index, row) for every new ROI row."""
+        self._update_snapshots()
+        for snapshot, state in self.snapshots.items():
+            exports = snapshot / "documents" / "roi_exports"
+            mtime = _mtime_ns(exports)
+            if mtime != state.exports_mtime:
+                state.exports_mtime = mtime
+                names = set()
+                if mtime is not None:
+                    with os.scandir(exports) as entries:
+                        names = {entry.name for entry in entries if entry.name.endswith(".csv") and entry.is_file()}
+                state.cursors = {path: cursor for path, cursor in state.cursors.items() if path.name in names}
+                for name in sorted(names):
+                    state.cursors.setdefault(exports / name, CsvCursor())
+            # Appends don't touch the folder mtime, so every known CSV is checked.
+            for csv_path, cursor in state.cursors.items():
+                for index, row in cursor.read_new_rows(csv_path):
+                    yield snapshot, csv_path, index, row
+
+
+def latest_dng_state(snapshot: Path) -> Optional[Tuple[str, int, int]]:
+    """(name, mtime_ns, size) of the snapshot's newest DNG, or None if there is none."""
+    try:
+        dng_path = find_latest_file(snapshot / "Pictures", "*.dng", recursive=True)
+        stat = dng_path.stat()
+    except OSError:
+        return None
+    return dng_path.name, stat.st_mtime_ns, stat.st_size
+
+
+def _json_values(values) -> List[Optional[float]]:
+    # Rows with empty CSV fields produce NaN, which strict JSON cannot hold.
+    return [round(float(v), 6) if np.isfinite(v) else None for v in values]
+
+
+def compare_watched_row(
+    snapshot: Path,
+    csv_path: Path,
+    index: int,
+    raw_row: Dict[str, str],
+    dng_matrices: Dict[Tuple[Path, int, int], np.ndarray],
+    plots: bool,
+) -> dict:
+    """
+    One log record for a ROI row. If LibRaw cannot read the DNG, the record
+    carries ``pending`` plus the DNG's mtime and size so the row can be retried.
+    """
+    record = {
+        "time": datetime.datetime.now().isoformat(timespec="milliseconds"),
+        "snapshot": snapshot.name,
+        "csv": csv_path.name,
+        "row": index,
+        "timestamp": raw_row.get("timestamp"),
+    }
+    try:
+        dng_path = find_latest_file(snapshot / "Pictures", "*.dng", recursive=True)
+        stat = dng_path.stat()
+        key = (dng_path, stat.st_mtime_ns, stat.st_size)
+        record["dng"] = dng_path.name
+        if key not in dng_matrices:
+            try:
+                dng_matrices[key] = rawpy_cam_to_xyz(dng_path)
+            except (rawpy.LibRawError, struct.error) as exc:
+                record["error"] = f"{type(exc).__name__}: {exc}"
+                record["pending"] = True
+                record["dng_mtime_ns"] = stat.st_mtime_ns
+                record["dng_size"] = stat.st_size
+                return record
+        kotlin_steps, rawpy_steps = compare_row(parse_row(raw_row), dng_matrices[key])
+    except (FileNotFoundError, KeyError, ValueError, np.linalg.LinAlgError) as exc:
+        record["error"] = str(exc)
+        return record
+    kotlin_srgb = dict(kotlin_steps)["srgb_gamma"]
+    rawpy_srgb = dict(rawpy_steps)["srgb_gamma"]
+    record["kotlin_srgb"] = _json_values(kotlin_srgb)
+    record["rawpy_srgb"] = _json_values(rawpy_srgb)
+    record["max_srgb_diff"] = _json_values([np.max(np.abs(kotlin_srgb - rawpy_srgb))])[0]
+    if plots:
+        plot_dir = snapshot / "pipeline_plots_watch" / f"{csv_path.stem}_row{index}"
+        save_step_plots(kotlin_steps, rawpy_steps, plot_dir)
+        record["plots"] = str(plot_dir)
+    return record
+
+
+def watch(args: argparse.Namespace) -> None:
+    log_path = args.log or args.root / WATCH_LOG_NAME
+    watcher = SnapshotWatcher(args.root, backfill=args.backfill)
+    dng_matrices: Dict[Tuple[Path, int, int], np.ndarray] = {}
+    # Rows whose DNG LibRaw could not read, with the DNG state that failed.
+    pending: List[Tuple[Tuple[Path, Path, int, Dict[str, str]], Tuple[str, int, int]]] = []
+    print(f"Watching {args.root} every {args.interval:.2f}s; logging to {log_path}")
+    log_path.parent.mkdir(parents=True, exist_ok=True)
+    with log_path.open("a", encoding="utf-8") as log:
+        while True:
+            states = {job[0]: latest_dng_state(job[0]) for job, _ in pending}
+            retry = [job for job, failed in pending if states[job[0]] not in (None, failed)]
+            pending = [(job, failed) for job, failed in pending if states[job[0]] in (None, failed)]
+            for job in retry + list(watcher.poll()):
+                snapshot, csv_path, index, raw_row = job
+                record = compare_watched_row(snapshot, csv_path, index, raw_row, dng_matrices, args.plots)
+                log.write(json.dumps(record) + "\n")
+                log.flush()
+                if record.get("pending"):
+                    pending.append((job, (record["dng"], record["dng_mtime_ns"], record["dng_size"])))
+                    print(f"{snapshot.name}/{csv_path.name} row {index}: {record['error']} (will retry)")
+                elif "error" in record:
+                    print(f"{snapshot.name}/{csv_path.name} row {index}: {record['error']}")
+                else:
+                    print(
+                        f"{snapshot.name}/{csv_path.name} row {index}: kotlin={record['kotlin_srgb']} "
+                        f"rawpy={record['rawpy_srgb']} max|diff|={record['max_srgb_diff']}"
+                    )
+            time.sleep(args.interval)
+
+
 def main() -> None:
-    repo_root = Path(__file__).resolve().parents[2]
-    snapshot_root = repo_root / "storage" / "debug"
-    snapshot = find_latest_snapshot(snapshot_root)
+    args = parse_args()
+    if args.watch:
+        try:
+            watch(args)
+        except KeyboardInterrupt:
+            pass
+        return
+
+    snapshot = find_latest_snapshot(args.root)
 
     csv_folder = snapshot / "documents" / "roi_exports"
     csv_path = find_latest_file(csv_folder, "*.csv")
@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+"""
+Cached multi-resolution previews of a capture for the overlay renderers.
+
+The visualization tools only ever show the DNG and the JPEG at a few
+hundred pixels, but used to build full-resolution images (a float32 copy of
+the whole CFA plane, a full JPEG copy) and LANCZOS them down for every run.
+This module keeps, per capture file, uint8 previews at 1/2, 1/4 and 1/8 of
+the full resolution:
+
+  RAW  : grayscale, black/white normalized, each level a box mean of the
+         CFA values (1/2 is plain 2x2 binning of the Bayer quad).
+  JPEG : RGB box means of the stored (not EXIF-rotated) pixels.
+
+Levels are .npy files next to the raw_cache sidecar of the same content
+hash, so they are built once and memory-mapped afterwards. Renderers pick
+the coarsest level that still covers their preview box and map ROI
+rectangles from full-resolution to level coordinates with scale_rect.
+
+Usage:
+  python preview_pyramid.py [--dng <path>] [--jpeg <path>]   # warm the cache
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import tempfile
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Callable, Dict, Optional, Sequence, Tuple
+
+import numpy as np
+from PIL import Image
+
+from raw_cache import CachedRaw, cache_root, content_hash
+
+PYRAMID_FACTORS = (2, 4, 8)
+PYRAMID_FORMAT = 1
+
+
+def scale_rect(rect: Sequence[int], factor: int, level_size: Tuple[int, int]) -> Tuple[int, int, int, int]:
+    """
+    Map a full-resolution (left, top, right, bottom) rect onto the level
+    that is ``factor`` times smaller, keeping it at least one pixel wide.
+    """
+    width, height = level_size
+    left = min(max(int(rect[0]) // factor, 0), width - 1)
+    top = min(max(int(rect[1]) // factor, 0), height - 1)
+    right = min(max(-(-int(rect[2]) // factor), left + 1), width)
+    bottom = min(max(-(-int(rect[3]) // factor), top + 1), height)
+    return left, top, right, bottom
+
+
+@dataclass
+class PreviewPyramid:
+    """Full-resolution size plus uint8 preview levels keyed by downscale factor."""
+
+    size: Tuple[int, int]
+    levels: Dict[int, np.ndarray]
+    full: Callable[[], np.ndarray] = field(repr=False)
+
+    def factor_for(self, max_width: float, max_height: float) -> int:
+        """Coarsest factor whose level is at least as large as the full image fitted into the box."""
+        scale = min(max_width / self.size[0], max_height / self.size[1], 1.0)
+        usable = [factor for factor in self.levels if scale * factor <= 1.0]
+        return max(usable, default=1)
+
+    def level(self, factor: int) -> np.ndarray:
+        return self.full() if factor == 1 else self.levels[factor]
+
+    def image(self, factor: int) -> Image.Image:
+        """Level ``factor`` as an RGB PIL image (factor 1 is the full resolution)."""
+        pixels = np.ascontiguousarray(self.level(factor))
+        return Image.fromarray(pixels, mode="L" if pixels.ndim == 2 else "RGB").convert("RGB")
+
+    def fit(self, max_width: float, max_height: float) -> Tuple[Image.Image, int]:
+        """Image of the level to downscale into a (max_width, max_height) box, and its factor."""
+        factor = self.factor_for(max_width, max_height)
+        return self.image(factor), factor
+
+
+def _box_halve(level: np.ndarray) -> np.ndarray:
+    """2x2 box mean in float32; a trailing odd row/column is dropped."""
+    h2, w2 = level.shape[0] // 2, level.shape[1] // 2
+    out = np.zeros((h2, w2) + level.shape[2:], dtype=np.float32)
+    for dy in range(2):
+        for dx in range(2):
+            out += level[dy : 2 * h2 : 2, dx : 2 * w2 : 2]
+    out *= np.float32(0.25)
+    return out
+
+
+def _to_uint8(level: np.ndarray) -> np.ndarray:
+    return np.clip(level + 0.5, 0.0, 255.0).astype(np.uint8)
+
+
+def _save_levels(entry_dir: Path, prefix: str, levels: Dict[int, np.ndarray]) -> None:
+    entry_dir.mkdir(parents=True, exist_ok=True)
+    for factor, pixels in levels.items():
+        out_path = entry_dir / f"{prefix}_{factor}.npy"
+        fd, tmp_name = tempfile.mkstemp(prefix=out_path.stem + ".", suffix=".npy", dir=entry_dir)
+        try:
+            with os.fdopen(fd, "wb") as fh:
+                np.save(fh, pixels)
+            os.replace(tmp_name, out_path)
+        finally:
+            if os.path.exists(tmp_name):
+                os.remove(tmp_name)
+
+
+def _load_levels(entry_dir: Path, prefix: str) -> Optional[Dict[int, np.ndarray]]:
+    paths = {factor: entry_dir / f"{prefix}_{factor}.npy" for factor in PYRAMID_FACTORS}
+    if not all(path.exists() for path in paths.values()):
+        return None
+    return {factor: np.load(path, mmap_mode="r") for factor, path in paths.items()}
+
+
+def _build_levels(base: np.ndarray, normalize: Callable[[np.ndarray], np.ndarray]) -> Dict[int, np.ndarray]:
+    levels: Dict[int, np.ndarray] = {}
+    level, current = base, 1
+    for factor in PYRAMID_FACTORS:
+        while current < factor:
+            level, current = _box_halve(level), current * 2
+        levels[factor] = _to_uint8(normalize(level))
+    return levels
+
+
+def _raw_normalizer(raw: CachedRaw) -> Callable[[np.ndarray], np.ndarray]:
+    # Same global black/white mapping as the full-resolution RAW overlay.
+    black = float(min(getattr(raw, "black_level_per_channel", [0])))
+    white = float(raw.white_level or raw.raw_image_visible.max() or 1.0)
+    denom = max(1.0, white - black)
+    return lambda values: np.clip((values - black) / denom, 0.0, 1.0) * 255.0
+
+
+def raw_pyramid(raw: CachedRaw, cache_dir: Optional[Path] = None) -> PreviewPyramid:
+    """Grayscale preview pyramid of ``raw``'s visible CFA plane, built on first use."""
+    height, width = raw.raw_image_visible.shape
+    normalize = _raw_normalizer(raw)
+    entry_dir = cache_root(cache_dir) / raw.content_hash
+    prefix = f"preview_gray_v{PYRAMID_FORMAT}"
+    levels = _load_levels(entry_dir, prefix)
+    if levels is None:
+        _save_levels(entry_dir, prefix, _build_levels(raw.raw_image_visible, normalize))
+        levels = _load_levels(entry_dir, prefix)
+
+    def full() -> np.ndarray:
+        return _to_uint8(normalize(raw.raw_image_visible.astype(np.float32)))
+
+    return PreviewPyramid(size=(width, height), levels=levels, full=full)
+
+
+def jpeg_pyramid(jpeg_path: Path, cache_dir: Optional[Path] = None) -> Tuple[PreviewPyramid, int]:
+    """RGB preview pyramid of the JPEG's stored pixels and its EXIF orientation tag."""
+    from render_jpeg_roi import get_orientation
+
+    entry_dir = cache_root(cache_dir) / content_hash(jpeg_path, cache_dir)
+    prefix = f"preview_rgb_v{PYRAMID_FORMAT}"
+    meta_path = entry_dir / f"{prefix}.json"
+
+    def full() -> np.ndarray:
+        with Image.open(jpeg_path) as img:
+            return np.asarray(img.convert("RGB"))
+
+    levels = _load_levels(entry_dir, prefix)
+    if levels is None or not meta_path.exists():
+        with Image.open(jpeg_path) as img:
+            orientation_tag = get_orientation(img)
+            pixels = np.asarray(img.convert("RGB"))
+        _save_levels(entry_dir, prefix, _build_levels(pixels, lambda values: values))
+        meta = {"size": [pixels.shape[1], pixels.shape[0]], "orientation": orientation_tag}
+        meta_path.write_text(json.dumps(meta), encoding="utf-8")
+        levels = _load_levels(entry_dir, prefix)
+    meta = json.loads(meta_path.read_text(encoding="utf-8"))
+    pyramid = PreviewPyramid(size=(meta["size"][0], meta["size"][1]), levels=levels, full=full)
+    return pyramid, int(meta["orientation"])
+
+
+def main() -> None:
+    from raw_cache import open_raw
+
+    parser = argparse.ArgumentParser(description="Build the cached preview pyramids for a capture.")
+    parser.add_argument("--dng", type=Path, nargs="*", default=[], help="DNG file(s) to build RAW previews for.")
+    parser.add_argument("--jpeg", type=Path, nargs="*", default=[], help="JPEG file(s) to build previews for.")
+    parser.add_argument("--cache-dir", type=Path, default=None, help="Override the cache directory.")
+    args = parser.parse_args()
+    for dng_path in args.dng:
+        with open_raw(dng_path, args.cache_dir) as raw:
+            pyramid = raw_pyramid(raw, args.cache_dir)
+        sizes = ", ".join(f"1/{f}: {lvl.shape[1]}x{lvl.shape[0]}" for f, lvl in sorted(pyramid.levels.items()))
+        print(f"{dng_path}: {sizes}")
+    for jpeg_path in args.jpeg:
+        pyramid, orientation = jpeg_pyramid(jpeg_path, args.cache_dir)
+        sizes = ", ".join(f"1/{f}: {lvl.shape[1]}x{lvl.shape[0]}" for f, lvl in sorted(pyramid.levels.items()))
+        print(f"{jpeg_path}: {sizes} (orientation {orientation})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+"""
+Sidecar cache for decoded DNG data shared by the RAW inspection tools.
+
+The first time a DNG is seen, libraw (via rawpy) decodes it once and the
+visible CFA plane, raw_colors_visible and the scalar calibration fields are
+written as .npy/.json files into a directory named after the SHA-256 of the
+DNG bytes. Later runs, from any tool, memory-map those files instead of
+decoding the DNG again. The content hash itself is remembered per
+(path, size, mtime_ns), in memory and in a small stat index next to the
+entries, so a cache hit does not read the whole DNG; the file is hashed
+only when it is new or has changed.
+
+Cache location: $COLOR_TOOL_RAW_CACHE, or ~/.cache/color_design_tool/raw.
+
+Usage:
+  python raw_cache.py --dng <path/to/dng>   # warm the cache and print the key
+"""
+
+from __future__ import annotations
+
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+CACHE_ENV = "COLOR_TOOL_RAW_CACHE"
+DEFAULT_CACHE_DIR = Path.home() / ".cache" / "color_design_tool" / "raw"
+CACHE_FORMAT = 1
+
+_HASH_CHUNK = 1 << 20
+STAT_INDEX_DIR = "stat_index"
+
+# (resolved path, size, mtime_ns) -> SHA-256, for files seen by this process.
+_HASH_MEMO: Dict[Tuple[str, int, int], str] = {}
+
+
+@dataclass
+class CachedRaw:
+    """
+    Read-only stand-in for the subset of rawpy.RawPy the tools use.
+
+    Array fields are memory-mapped from the sidecar, so slicing a small ROI
+    only pages in the rows it touches.
+    """
+
+    content_hash: str
+    raw_image_visible: np.ndarray
+    raw_colors_visible: np.ndarray
+    raw_pattern: np.ndarray
+    black_level_per_channel: List[int]
+    white_level: int
+    color_desc: bytes
+    camera_whitebalance: List[float]
+    color_matrix: np.ndarray
+    rgb_xyz_matrix: np.ndarray
+
+    def __enter__(self) -> "CachedRaw":
+        return self
+
+    def __exit__(self, *exc: object) -> None:
+        return None
+
+
+def cache_root(cache_dir: Optional[Path] = None) -> Path:
+    if cache_dir is not None:
+        return Path(cache_dir)
+    env = os.environ.get(CACHE_ENV)
+    return Path(env) if env else DEFAULT_CACHE_DIR
+
+
+def dng_content_hash(dng_path: Path) -> str:
+    digest = hashlib.sha256()
+    with Path(dng_path).open("rb") as fh:
+        for chunk in iter(lambda: fh.read(_HASH_CHUNK), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def content_hash(path: Path, cache_dir: Optional[Path] = None) -> str:
+    """
+    SHA-256 of ``path``'s bytes, looked up by (path, size, mtime_ns) first.
+    Only a file that is new to the stat index, or was modified, is hashed.
+    """
+    resolved = Path(path).resolve()
+    stat = resolved.stat()
+    stat_key = (str(resolved), stat.st_size, stat.st_mtime_ns)
+    cached = _HASH_MEMO.get(stat_key)
+    if cached is not None:
+        return cached
+    index_path = cache_root(cache_dir) / STAT_INDEX_DIR / hashlib.sha1(repr(stat_key).encode("utf-8")).hexdigest()
+    try:
+        cached = index_path.read_text(encoding="ascii").strip()
+    except OSError:
+        cached = ""
+    if len(cached) != 64:
+        cached = dng_content_hash(resolved)
+        try:
+            index_path.parent.mkdir(parents=True, exist_ok=True)
+            fd, tmp_name = tempfile.mkstemp(prefix=index_path.name + ".", dir=index_path.parent)
+            with os.fdopen(fd, "w", encoding="ascii") as fh:
+                fh.write(cached)
+            os.replace(tmp_name, index_path)
+        except OSError:
+            pass  # The index is only a shortcut; a read-only cache still works.
+    _HASH_MEMO[stat_key] = cached
+    return cached
+
+
+def _write_sidecar(dng_path: Path, entry_dir: Path) -> None:
+    import rawpy  # type: ignore  # only needed on a cache miss
+
+    entry_dir.parent.mkdir(parents=True, exist_ok=True)
+    tmp_dir = Path(tempfile.mkdtemp(prefix=entry_dir.name + ".", dir=entry_dir.parent))
+    try:
+        with rawpy.imread(str(dng_path)) as raw:
+            np.save(tmp_dir / "raw_image_visible.npy", np.ascontiguousarray(raw.raw_image_visible))
+            np.save(tmp_dir / "raw_colors_visible.npy", np.ascontiguousarray(raw.raw_colors_visible))
+            meta = {
+                "format": CACHE_FORMAT,
+                "source": str(Path(dng_path).resolve()),
+                "raw_pattern": np.asarray(raw.raw_pattern).tolist(),
+                "black_level_per_channel": [int(v) for v in raw.black_level_per_channel],
+                "white_level": int(raw.white_level),
+                "color_desc": raw.color_desc.decode("ascii"),
+                "camera_whitebalance": [float(v) for v in raw.camera_whitebalance],
+                "color_matrix": np.asarray(raw.color_matrix, dtype=np.float64).tolist(),
+                "rgb_xyz_matrix": np.asarray(raw.rgb_xyz_matrix, dtype=np.float64).tolist(),
+            }
+        (tmp_dir / "meta.json").write_text(json.dumps(meta, indent=2), encoding="utf-8")
+        try:
+            os.replace(tmp_dir, entry_dir)
+        except OSError:
+            # Another process published the same entry first; keep theirs.
+            if not (entry_dir / "meta.json").exists():
+                raise
+    finally:
+        if tmp_dir.exists():
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+def _load_meta(entry_dir: Path) -> Optional[Dict[str, Any]]:
+    meta_path = entry_dir / "meta.json"
+    if not meta_path.exists():
+        return None
+    meta = json.loads(meta_path.read_text(encoding="utf-8"))
+    if meta.get("format") != CACHE_FORMAT:
+        return None
+    return meta
+
+
+def open_raw(dng_path: Path, cache_dir: Optional[Path] = None) -> CachedRaw:
+    """
+    Return the decoded CFA data for ``dng_path``, decoding through libraw
+    only if no sidecar exists yet for its content hash.
+    """
+    digest = content_hash(dng_path, cache_dir)
+    entry_dir = cache_root(cache_dir) / digest
+    meta = _load_meta(entry_dir)
+    if meta is None:
+        if entry_dir.exists():
+            shutil.rmtree(entry_dir, ignore_errors=True)
+        _write_sidecar(Path(dng_path), entry_dir)
+        meta = _load_meta(entry_dir)
+        if meta is None:
+            raise RuntimeError(f"Failed to populate RAW cache entry {entry_dir}")
+    return CachedRaw(
+        content_hash=digest,
+        raw_image_visible=np.load(entry_dir / "raw_image_visible.npy", mmap_mode="r"),
+        raw_colors_visible=np.load(entry_dir / "raw_colors_visible.npy", mmap_mode="r"),
+        raw_pattern=np.asarray(meta["raw_pattern"]),
+        black_level_per_channel=list(meta["black_level_per_channel"]),
+        white_level=int(meta["white_level"]),
+        color_desc=meta["color_desc"].encode("ascii"),
+        camera_whitebalance=list(meta["camera_whitebalance"]),
+        color_matrix=np.asarray(meta["color_matrix"], dtype=np.float64),
+        rgb_xyz_matrix=np.asarray(meta["rgb_xyz_matrix"], dtype=np.float64),
+    )
+
+
+def _params_key(params: Dict[str, Any]) -> str:
+    # rawpy enums (e.g. ColorSpace.sRGB) are keyed by their repr.
+    normalized = {
+        key: (list(value) if isinstance(value, tuple) else value)
+        for key, value in sorted(params.items())
+    }
+    payload = json.dumps(normalized, default=repr, sort_keys=True)
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()[:16]
+
+
+def load_postprocessed(dng_path: Path, cache_dir: Optional[Path] = None, **params: Any) -> np.ndarray:
+    """
+    Memory-mapped result of ``rawpy.RawPy.postprocess(**params)``, cached
+    next to the decoded sidecar under a key derived from ``params``.
+    """
+    cached = open_raw(dng_path, cache_dir)
+    entry_dir = cache_root(cache_dir) / cached.content_hash
+    out_path = entry_dir / f"postprocess_{_params_key(params)}.npy"
+    if not out_path.exists():
+        import rawpy  # type: ignore
+
+        with rawpy.imread(str(dng_path)) as raw:
+            rgb = raw.postprocess(**params)
+        fd, tmp_name = tempfile.mkstemp(prefix=out_path.stem + ".", suffix=".npy", dir=entry_dir)
+        try:
+            with os.fdopen(fd, "wb") as fh:
+                np.save(fh, rgb)
+            os.replace(tmp_name, out_path)
+        finally:
+            if os.path.exists(tmp_name):
+                os.remove(tmp_name)
+    return np.load(out_path, mmap_mode="r")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Warm the decoded-RAW sidecar cache for DNG files.")
+    parser.add_argument("--dng", required=True, type=Path, nargs="+", help="DNG file(s) to cache.")
+    parser.add_argument("--cache-dir", type=Path, default=None, help="Override the cache directory.")
+    args = parser.parse_args()
+    for dng_path in args.dng:
+        cached = open_raw(dng_path, args.cache_dir)
+        height, width = cached.raw_image_visible.shape
+        print(f"{dng_path}: {cached.content_hash} ({width}x{height}, {cached.color_desc.decode('ascii')})")
+
+
+if __name__ == "__main__":
+    main()
@@ -9,18 +9,17 @@ from __future__ import annotations
 
 import argparse
 import csv
+from contextlib import nullcontext
 from dataclasses import dataclass
 from pathlib import Path
 from typing import Dict, List, Sequence
 
 import numpy as np
 
-try:
-    import rawpy  # type: ignore
-except ImportError as exc:  # pragma: no cover - helper script
-    raise SystemExit(
-        "rawpy is required. Install it via `pip install rawpy`."
-    ) from exc
+from color_core import parse_float
+from raw_cache import open_raw
+from raw_roi_pipeline import cached_roi_means, rect_array
+from roi_result_cache import RoiResultCache
 
 
 @dataclass
@@ -39,13 +38,6 @@ class RoiEntry:
             f"{self.raw_rect['top']}:{self.raw_rect['bottom']}]"
 
 
-def _parse_float(value: str) -> float:
-    try:
-        return float(value)
-    except (TypeError, ValueError):
-        return float("nan")
-
-
 def load_roi_entries(csv_path: Path) -> List[RoiEntry]:
     with csv_path.open(newline="", encoding="utf-8") as fh:
         reader = csv.DictReader(fh)
@@ -56,10 +48,10 @@ def load_roi_entries(csv_path: Path) -> List[RoiEntry]:
             RoiEntry(
                 index=idx,
                 normalized={
-                    "left": _parse_float(row.get("roi_left", "")),
-                    "top": _parse_float(row.get("roi_top", "")),
-                    "right": _parse_float(row.get("roi_right", "")),
-                    "bottom": _parse_float(row.get("roi_bottom", "")),
+                    "left": parse_float(row.get("roi_left", "")),
+                    "top": parse_float(row.get("roi_top", "")),
+                    "right": parse_float(row.get("roi_right", "")),
+                    "bottom": parse_float(row.get("roi_bottom", "")),
                 },
                 raw_rect={
                     "left": int(float(row.get("raw_left", 0) or 0)),
@@ -68,91 +60,30 @@ def load_roi_entries(csv_path: Path) -> List[RoiEntry]:
                     "bottom": int(float(row.get("raw_bottom", 0) or 0)),
                 },
                 raw_rgb={
-                    "r": _parse_float(row.get("raw_r", "")),
-                    "g": _parse_float(row.get("raw_g", "")),
-                    "b": _parse_float(row.get("raw_b", "")),
+                    "r": parse_float(row.get("raw_r", "")),
+                    "g": parse_float(row.get("raw_g", "")),
+                    "b": parse_float(row.get("raw_b", "")),
                 },
                 linear_rgb={
-                    "r": _parse_float(row.get("linear_r", "")),
-                    "g": _parse_float(row.get("linear_g", "")),
-                    "b": _parse_float(row.get("linear_b", "")),
+                    "r": parse_float(row.get("linear_r", "")),
+                    "g": parse_float(row.get("linear_g", "")),
+                    "b": parse_float(row.get("linear_b", "")),
                 },
                 xyz={
-                    "x": _parse_float(row.get("xyz_x", "")),
-                    "y": _parse_float(row.get("xyz_y", "")),
-                    "z": _parse_float(row.get("xyz_z", "")),
+                    "x": parse_float(row.get("xyz_x", "")),
+                    "y": parse_float(row.get("xyz_y", "")),
+                    "z": parse_float(row.get("xyz_z", "")),
                 },
                 wb_gains={
-                    "r": _parse_float(row.get("wb_r_gain", "")),
-                    "g": _parse_float(row.get("wb_g_gain", "")),
-                    "b": _parse_float(row.get("wb_b_gain", "")),
+                    "r": parse_float(row.get("wb_r_gain", "")),
+                    "g": parse_float(row.get("wb_g_gain", "")),
+                    "b": parse_float(row.get("wb_b_gain", "")),
                 },
             )
         )
     return entries
 
 
-def channel_name_map(raw: rawpy.RawPy) -> Dict[int, str]:
-    """Map channel indices reported by rawpy to RGB letters."""
-    desc = raw.color_desc.decode("ascii")
-    mapping = {}
-    for idx, letter in enumerate(desc):
-        if letter == "G":
-            # rawpy exposes two green channels; treat them both as "G".
-            mapping[idx] = "G"
-        else:
-            mapping[idx] = letter
-    return mapping
-
-
-def channel_black_levels(raw: rawpy.RawPy) -> Dict[int, float]:
-    """Return the black level for each CFA index."""
-    blacks = raw.black_level_per_channel
-    mapping = {}
-    # There can be up to 4 values (RGGB). Fall back to the first entry.
-    for idx in range(len(raw.color_desc)):
-        mapping[idx] = float(blacks[idx] if idx < len(blacks) else blacks[0])
-    return mapping
-
-
-def compute_roi_means(
-    raw: rawpy.RawPy,
-    rect: Dict[str, int],
-) -> Dict[str, float]:
-    """Compute normalized averages per RGB channel within the ROI."""
-    top, bottom = rect["top"], rect["bottom"]
-    left, right = rect["left"], rect["right"]
-    if bottom <= top or right <= left:
-        raise ValueError(f"Invalid ROI rect: {rect}")
-
-    raw_img = raw.raw_image_visible.astype(np.float64)
-    raw_colors = raw.raw_colors_visible
-    roi_img = raw_img[top:bottom, left:right]
-    roi_colors = raw_colors[top:bottom, left:right]
-
-    black_levels = channel_black_levels(raw)
-    white_level = float(raw.white_level or roi_img.max())
-    denom = max(1.0, white_level)
-    channel_map = channel_name_map(raw)
-
-    accumulator: Dict[str, List[float]] = {"R": [], "G": [], "B": []}
-    for channel_idx, rgb_letter in channel_map.items():
-        mask = roi_colors == channel_idx
-        if not np.any(mask):
-            continue
-        values = roi_img[mask]
-        corrected = np.clip(values - black_levels[channel_idx], 0, None) / denom
-        accumulator[rgb_letter].append(float(np.mean(corrected)))
-
-    # Average the two green channels if necessary.
-    means = {
-        "r": float(np.mean(accumulator["R"])) if accumulator["R"] else float("nan"),
-        "g": float(np.mean(accumulator["G"])) if accumulator["G"] else float("nan"),
-        "b": float(np.mean(accumulator["B"])) if accumulator["B"] else float("nan"),
-    }
-    return means
-
-
 def compare(entry: RoiEntry, measured: Dict[str, float]) -> Dict[str, float]:
     return {
         channel: measured[channel] - entry.raw_rgb[channel]
@@ -182,6 +113,16 @@ def main() -> None:
         nargs="*",
         help="Optional list of ROI indices to inspect (defaults to all).",
     )
+    parser.add_argument(
+        "--quiet",
+        action="store_true",
+        help="Only print the worst per-channel difference instead of every ROI.",
+    )
+    parser.add_argument(
+        "--no-result-cache",
+        action="store_true",
+        help="Recompute ROI means instead of using the shared ROI result cache.",
+    )
     args = parser.parse_args()
 
     entries = load_roi_entries(args.roi_csv)
@@ -200,23 +141,34 @@ def main() -> None:
 
     print(f"Loaded {len(entries)} ROI rows; evaluating {len(target_entries)} entries.")
     print(f"Opening DNG: {args.dng}")
-    with rawpy.imread(str(args.dng)) as raw:
+    with open_raw(args.dng) as raw, (nullcontext() if args.no_result_cache else RoiResultCache()) as cache:
         print("Camera color info:")
         print(f"  Color desc: {raw.color_desc.decode('ascii')}")
         print(f"  White level: {raw.white_level}")
         print(f"  Black levels: {raw.black_level_per_channel}")
         print(f"  RGB→XYZ matrix:\n{raw.rgb_xyz_matrix}")
 
-        for entry in target_entries:
-            measured = compute_roi_means(raw, entry.raw_rect)
-            diffs = compare(entry, measured)
-            print("=" * 60)
-            print(entry.label)
-            print(f"  Logged raw RGB : {entry.raw_rgb}")
-            print(f"  rawpy raw RGB  : {measured}")
-            print(f"  Difference     : {diffs}")
-            print(f"  Logged WB gains: {entry.wb_gains}")
-            print(f"  Logged XYZ     : {entry.xyz}")
+        measured_all = cached_roi_means(raw, rect_array([entry.raw_rect for entry in target_entries]), cache)
+
+    logged_all = np.array(
+        [[entry.raw_rgb["r"], entry.raw_rgb["g"], entry.raw_rgb["b"]] for entry in target_entries],
+        dtype=np.float64,
+    )
+    if args.quiet:
+        worst = np.nanmax(np.abs(measured_all - logged_all), axis=0)
+        print(f"Max |rawpy - logged| raw RGB over {len(target_entries)} ROIs: {worst}")
+        return
+
+    for entry, row in zip(target_entries, measured_all):
+        measured = {"r": float(row[0]), "g": float(row[1]), "b": float(row[2])}
+        diffs = compare(entry, measured)
+        print("=" * 60)
+        print(entry.label)
+        print(f"  Logged raw RGB : {entry.raw_rgb}")
+        print(f"  rawpy raw RGB  : {measured}")
+        print(f"  Difference     : {diffs}")
+        print(f"  Logged WB gains: {entry.wb_gains}")
+        print(f"  Logged XYZ     : {entry.xyz}")
 
 
 if __name__ == "__main__":
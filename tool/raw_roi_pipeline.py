@@ -14,21 +14,17 @@ from __future__ import annotations
 import argparse
 import csv
 import json
+from contextlib import nullcontext
 from dataclasses import dataclass, asdict
 from pathlib import Path
-from typing import Dict, Iterable, List, Sequence, Optional
+from typing import Dict, List, Sequence, Optional
 
 import numpy as np
 import rawpy  # type: ignore
 
-XYZ_TO_SRGB = np.array(
-    [
-        [3.2406, -1.5372, -0.4986],
-        [-0.9689, 1.8758, 0.0415],
-        [0.0557, -0.2040, 1.0570],
-    ],
-    dtype=np.float64,
-)
+from color_core import linear_to_srgb, parse_float, xyz_to_linear_srgb
+from raw_cache import open_raw
+from roi_result_cache import RoiResultCache, result_key
 
 
 @dataclass
@@ -70,13 +66,6 @@ class RoiComputation:
     srgb_b: float
 
 
-def _parse_float(value: str) -> float:
-    try:
-        return float(value)
-    except (TypeError, ValueError):
-        return float("nan")
-
-
 def load_roi_entries(csv_path: Path) -> List[RoiEntry]:
     with csv_path.open(newline="", encoding="utf-8") as fh:
         reader = csv.DictReader(fh)
@@ -87,10 +76,10 @@ def load_roi_entries(csv_path: Path) -> List[RoiEntry]:
             RoiEntry(
                 index=idx,
                 normalized={
-                    "left": _parse_float(row.get("roi_left", "")),
-                    "top": _parse_float(row.get("roi_top", "")),
-                    "right": _parse_float(row.get("roi_right", "")),
-                    "bottom": _parse_float(row.get("roi_bottom", "")),
+                    "left": parse_float(row.get("roi_left", "")),
+                    "top": parse_float(row.get("roi_top", "")),
+                    "right": parse_float(row.get("roi_right", "")),
+                    "bottom": parse_float(row.get("roi_bottom", "")),
                 },
                 raw_rect={
                     "left": int(float(row.get("raw_left", 0) or 0)),
@@ -99,40 +88,40 @@ def load_roi_entries(csv_path: Path) -> List[RoiEntry]:
                     "bottom": int(float(row.get("raw_bottom", 0) or 0)),
                 },
                 raw_rgb={
-                    "r": _parse_float(row.get("raw_r", "")),
-                    "g": _parse_float(row.get("raw_g", "")),
-                    "b": _parse_float(row.get("raw_b", "")),
+                    "r": parse_float(row.get("raw_r", "")),
+                    "g": parse_float(row.get("raw_g", "")),
+                    "b": parse_float(row.get("raw_b", "")),
                 },
                 wb_gains={
-                    "r": _parse_float(row.get("wb_r_gain", "")),
-                    "g": _parse_float(row.get("wb_g_gain", "")),
-                    "b": _parse_float(row.get("wb_b_gain", "")),
+                    "r": parse_float(row.get("wb_r_gain", "")),
+                    "g": parse_float(row.get("wb_g_gain", "")),
+                    "b": parse_float(row.get("wb_b_gain", "")),
                 },
                 device_linear={
-                    "r": _parse_float(row.get("linear_r", "")),
-                    "g": _parse_float(row.get("linear_g", "")),
-                    "b": _parse_float(row.get("linear_b", "")),
+                    "r": parse_float(row.get("linear_r", "")),
+                    "g": parse_float(row.get("linear_g", "")),
+                    "b": parse_float(row.get("linear_b", "")),
                 }
                 if row.get("linear_r") is not None
                 else None,
                 device_xyz={
-                    "x": _parse_float(row.get("xyz_x", "")),
-                    "y": _parse_float(row.get("xyz_y", "")),
-                    "z": _parse_float(row.get("xyz_z", "")),
+                    "x": parse_float(row.get("xyz_x", "")),
+                    "y": parse_float(row.get("xyz_y", "")),
+                    "z": parse_float(row.get("xyz_z", "")),
                 }
                 if row.get("xyz_x") is not None
                 else None,
                 rawpy_xyz={
-                    "x": _parse_float(row.get("rawpy_x", "")),
-                    "y": _parse_float(row.get("rawpy_y", "")),
-                    "z": _parse_float(row.get("rawpy_z", "")),
+                    "x": parse_float(row.get("rawpy_x", "")),
+                    "y": parse_float(row.get("rawpy_y", "")),
+                    "z": parse_float(row.get("rawpy_z", "")),
                 }
                 if row.get("rawpy_x") is not None
                 else None,
                 rawpy_srgb={
-                    "r": _parse_float(row.get("rawpy_srgb_r", "")),
-                    "g": _parse_float(row.get("rawpy_srgb_g", "")),
-                    "b": _parse_float(row.get("rawpy_srgb_b", "")),
+                    "r": parse_float(row.get("rawpy_srgb_r", "")),
+                    "g": parse_float(row.get("rawpy_srgb_g", "")),
+                    "b": parse_float(row.get("rawpy_srgb_b", "")),
                 }
                 if row.get("rawpy_srgb_r") is not None
                 else None,
@@ -189,62 +178,266 @@ def dump_color_matrices(raw: rawpy.RawPy, cam2xyz: np.ndarray, output_json: Path
     print(f"Wrote matrix dump to {output_json}")
 
 
-def compute_roi_means(raw: rawpy.RawPy, rect: Dict[str, int]) -> Dict[str, float]:
+class CfaIntegralImage:
+    """
+    Black-level-corrected summed-area tables, one per 2x2 CFA phase.
+
+    Each table covers the strided plane ``raw_image_visible[r::2, c::2]`` so
+    the whole sensor is corrected and integrated once; afterwards any ROI
+    mean is four table lookups per CFA phase, independent of the ROI size.
+    """
+
+    def __init__(self, raw: rawpy.RawPy) -> None:
+        raw_img = raw.raw_image_visible
+        raw_colors = raw.raw_colors_visible
+        self.height, self.width = raw_img.shape
+        black_levels = raw.black_level_per_channel
+        white_level = float(raw.white_level or np.max(raw_img))
+        if white_level == 0:
+            white_level = 1.0
+        self.desc = raw.color_desc.decode("ascii")
+
+        self.phases: List[tuple[int, int, int]] = []
+        self.tables: List[np.ndarray] = []
+        for row in range(min(2, self.height)):
+            for col in range(min(2, self.width)):
+                cfa_index = int(raw_colors[row, col])
+                plane = raw_img[row::2, col::2].astype(np.float64)
+                plane -= black_levels[cfa_index]
+                np.clip(plane, 0.0, None, out=plane)
+                plane /= white_level
+                table = np.zeros((plane.shape[0] + 1, plane.shape[1] + 1), dtype=np.float64)
+                np.cumsum(plane, axis=0, out=table[1:, 1:])
+                np.cumsum(table[1:, 1:], axis=1, out=table[1:, 1:])
+                self.phases.append((row, col, cfa_index))
+                self.tables.append(table)
+
+    def channel_means_batch(self, rects: np.ndarray) -> Dict[int, np.ndarray]:
+        """
+        Mean corrected value per CFA index for an (N, 4) array of
+        left/top/right/bottom rects. Rows where an index has no samples are NaN.
+        """
+        rects = np.asarray(rects, dtype=np.int64).reshape(-1, 4)
+        invalid = (rects[:, 3] <= rects[:, 1]) | (rects[:, 2] <= rects[:, 0])
+        if np.any(invalid):
+            raise ValueError(f"Invalid ROI rects at rows {np.flatnonzero(invalid).tolist()}")
+        left = np.clip(rects[:, 0], 0, self.width)
+        top = np.clip(rects[:, 1], 0, self.height)
+        right = np.clip(rects[:, 2], 0, self.width)
+        bottom = np.clip(rects[:, 3], 0, self.height)
+
+        sums: Dict[int, np.ndarray] = {}
+        counts: Dict[int, np.ndarray] = {}
+        for (row, col, cfa_index), table in zip(self.phases, self.tables):
+            # Plane index k covers sensor row 2k + row; map [top, bottom) onto it.
+            y0, y1 = (top - row + 1) // 2, (bottom - row + 1) // 2
+            x0, x1 = (left - col + 1) // 2, (right - col + 1) // 2
+            count = np.maximum(y1 - y0, 0) * np.maximum(x1 - x0, 0)
+            total = table[y1, x1] - table[y0, x1] - table[y1, x0] + table[y0, x0]
+            total = np.where(count > 0, total, 0.0)
+            sums[cfa_index] = sums.get(cfa_index, 0.0) + total
+            counts[cfa_index] = counts.get(cfa_index, 0) + count
+
+        means: Dict[int, np.ndarray] = {}
+        for cfa_index, total in sums.items():
+            count = counts[cfa_index]
+            means[cfa_index] = np.where(count > 0, total / np.maximum(count, 1), np.nan)
+        return means
+
+    def roi_means_batch(self, rects: np.ndarray) -> np.ndarray:
+        """
+        (N, 3) R/G/B averages for an (N, 4) rect array, giving each CFA index
+        (e.g. G1/G2) equal weight like ``compute_roi_means``.
+        """
+        per_index = self.channel_means_batch(rects)
+        count = len(next(iter(per_index.values()))) if per_index else 0
+        result = np.full((count, 3), np.nan, dtype=np.float64)
+        for column, letter in enumerate("RGB"):
+            values = [mean for idx, mean in per_index.items() if self.desc[idx] == letter]
+            if not values:
+                continue
+            stacked = np.stack(values)
+            present = ~np.isnan(stacked)
+            total = np.where(present, stacked, 0.0).sum(axis=0)
+            n = present.sum(axis=0)
+            result[:, column] = np.where(n > 0, total / np.maximum(n, 1), np.nan)
+        return result
+
+    def channel_means(self, rect: Dict[str, int]) -> Dict[int, float]:
+        """Mean corrected value per CFA index inside ``rect`` (absent indices are omitted)."""
+        if rect["bottom"] <= rect["top"] or rect["right"] <= rect["left"]:
+            raise ValueError(f"Invalid ROI rect: {rect}")
+        per_index = self.channel_means_batch(rect_array([rect]))
+        return {idx: float(mean[0]) for idx, mean in per_index.items() if not np.isnan(mean[0])}
+
+    def roi_means(self, rect: Dict[str, int]) -> Dict[str, float]:
+        """Averages per RGB letter, giving each CFA index (e.g. G1/G2) equal weight."""
+        if rect["bottom"] <= rect["top"] or rect["right"] <= rect["left"]:
+            raise ValueError(f"Invalid ROI rect: {rect}")
+        r, g, b = self.roi_means_batch(rect_array([rect]))[0]
+        return {"r": float(r), "g": float(g), "b": float(b)}
+
+
+def rect_array(rects: Sequence[Dict[str, int]]) -> np.ndarray:
+    """Stack raw_rect dicts into an (N, 4) left/top/right/bottom array."""
+    return np.array(
+        [[rect["left"], rect["top"], rect["right"], rect["bottom"]] for rect in rects],
+        dtype=np.int64,
+    ).reshape(-1, 4)
+
+
+def compute_roi_means(
+    raw: rawpy.RawPy,
+    rect: Dict[str, int],
+    integral: Optional[CfaIntegralImage] = None,
+) -> Dict[str, float]:
     """
     Mimics RawRoiProcessor: subtracts channel-specific black level, normalizes
     by white level, and averages per CFA channel within the ROI.
+
+    Pass a prebuilt ``CfaIntegralImage`` when evaluating several ROIs of the
+    same capture so the sensor is only corrected and integrated once.
     """
-    top, bottom = rect["top"], rect["bottom"]
-    left, right = rect["left"], rect["right"]
-    if bottom <= top or right <= left:
-        raise ValueError(f"Invalid ROI rect: {rect}")
-
-    raw_img = raw.raw_image_visible.astype(np.float64)
-    raw_colors = raw.raw_colors_visible
-
-    roi_img = raw_img[top:bottom, left:right]
-    roi_colors = raw_colors[top:bottom, left:right]
-
-    black_levels = raw.black_level_per_channel
-    white_level = raw.white_level or np.max(roi_img)
-    if white_level == 0:
-        white_level = 1.0
-
-    def avg_channel(indices: Iterable[int]) -> float:
-        values = []
-        for idx in indices:
-            mask = roi_colors == idx
-            if not np.any(mask):
-                continue
-            samples = roi_img[mask]
-            corrected = np.clip(samples - black_levels[idx], 0, None) / white_level
-            values.append(np.mean(corrected))
-        if not values:
-            return float("nan")
-        return float(np.mean(values))
-
-    # raw.color_desc order matches raw_colors channel indices
-    desc = raw.color_desc.decode("ascii")
-    r_indices = [i for i, ch in enumerate(desc) if ch == "R"]
-    g_indices = [i for i, ch in enumerate(desc) if ch == "G"]
-    b_indices = [i for i, ch in enumerate(desc) if ch == "B"]
-
-    return {
-        "r": avg_channel(r_indices),
-        "g": avg_channel(g_indices),
-        "b": avg_channel(b_indices),
-    }
-
-
-def linear_to_srgb(linear_rgb: np.ndarray) -> np.ndarray:
-    linear_rgb = np.clip(linear_rgb, 0.0, None)
-    threshold = 0.0031308
-    srgb = np.where(
-        linear_rgb <= threshold,
-        linear_rgb * 12.92,
-        1.055 * np.power(linear_rgb, 1 / 2.4) - 0.055,
+    if integral is None:
+        integral = CfaIntegralImage(raw)
+    return integral.roi_means(rect)
+
+
+def cached_roi_means(
+    raw: rawpy.RawPy,
+    rects: np.ndarray,
+    cache: Optional[RoiResultCache] = None,
+) -> np.ndarray:
+    """
+    ``CfaIntegralImage.roi_means_batch`` for an (N, 4) rect array, served
+    from the ROI result cache where possible. The integral image is only
+    built when at least one rect misses. ``raw`` must come from open_raw so
+    its content hash is known.
+    """
+    rects = np.asarray(rects, dtype=np.int64).reshape(-1, 4)
+    if cache is None:
+        return CfaIntegralImage(raw).roi_means_batch(rects)
+    keys = [result_key(raw.content_hash, rect, "cfa_means") for rect in rects]
+    hits = cache.get_many(keys)
+    means = np.full((len(rects), 3), np.nan, dtype=np.float64)
+    missing = []
+    for i, hit in enumerate(hits):
+        if hit is None:
+            missing.append(i)
+        else:
+            means[i] = hit["raw"]
+    if missing:
+        fresh = CfaIntegralImage(raw).roi_means_batch(rects[missing])
+        means[missing] = fresh
+        cache.put_many((keys[i], {"raw": fresh[j]}) for j, i in enumerate(missing))
+    return means
+
+
+@dataclass
+class RoiBatchResult:
+    """Stage vectors for N ROIs, each an (N, 3) array."""
+
+    gains: np.ndarray
+    raw: np.ndarray
+    wb: np.ndarray
+    xyz: np.ndarray
+    srgb_linear: np.ndarray
+    srgb: np.ndarray
+
+    def computations(self, indices: Sequence[int]) -> List[RoiComputation]:
+        return [
+            RoiComputation(
+                roi_index=index,
+                raw_r=float(self.raw[i, 0]),
+                raw_g=float(self.raw[i, 1]),
+                raw_b=float(self.raw[i, 2]),
+                wb_r=float(self.wb[i, 0]),
+                wb_g=float(self.wb[i, 1]),
+                wb_b=float(self.wb[i, 2]),
+                xyz_x=float(self.xyz[i, 0]),
+                xyz_y=float(self.xyz[i, 1]),
+                xyz_z=float(self.xyz[i, 2]),
+                srgb_r=float(self.srgb[i, 0]),
+                srgb_g=float(self.srgb[i, 1]),
+                srgb_b=float(self.srgb[i, 2]),
+            )
+            for i, index in enumerate(indices)
+        ]
+
+
+def evaluate_rois(
+    integral: CfaIntegralImage,
+    cam2xyz: np.ndarray,
+    rects: np.ndarray,
+    wb_gains: np.ndarray,
+    fallback_wb: Optional[np.ndarray] = None,
+) -> RoiBatchResult:
+    """
+    Runs RAW means -> WB -> cam2xyz -> sRGB for (N, 4) rects and (N, 3) WB
+    gains in one vectorized pass. Rows with non-finite gains use
+    ``fallback_wb`` (typically the DNG camera_whitebalance) when given.
+    """
+    return evaluate_means(integral.roi_means_batch(rects), cam2xyz, wb_gains, fallback_wb)
+
+
+def evaluate_means(
+    camera_rgb: np.ndarray,
+    cam2xyz: np.ndarray,
+    wb_gains: np.ndarray,
+    fallback_wb: Optional[np.ndarray] = None,
+) -> RoiBatchResult:
+    """``evaluate_rois`` for (N, 3) RAW means that were already computed."""
+    wb = np.array(wb_gains, dtype=np.float64).reshape(-1, 3)
+    if fallback_wb is not None:
+        missing = ~np.all(np.isfinite(wb), axis=1)
+        wb[missing] = np.asarray(fallback_wb, dtype=np.float64)[:3]
+    balanced = camera_rgb * wb
+    xyz = balanced @ cam2xyz.T
+    srgb_linear = xyz_to_linear_srgb(xyz)
+    srgb = linear_to_srgb(srgb_linear, clip=True)
+    return RoiBatchResult(
+        gains=wb,
+        raw=camera_rgb,
+        wb=balanced,
+        xyz=xyz,
+        srgb_linear=srgb_linear,
+        srgb=srgb,
     )
-    return np.clip(srgb, 0.0, 1.0)
+
+
+def print_roi_report(entry: RoiEntry, result: RoiBatchResult, row: int) -> None:
+    xyz = result.xyz[row]
+    srgb = result.srgb[row]
+    srgb_uint8 = np.clip(np.round(srgb * 255), 0, 255).astype(int)
+    print("=" * 70)
+    print(entry.label)
+    r, g, b = result.raw[row]
+    print("Recomputed RAW averages:", {"r": float(r), "g": float(g), "b": float(b)})
+    print("WB gains used:", result.gains[row])
+    print("WB-corrected camera RGB:", result.wb[row])
+    print("XYZ from matrix:", xyz)
+    print("Linear sRGB:", result.srgb_linear[row])
+    print("sRGB (gamma):", srgb)
+    print("sRGB 0-255:", srgb_uint8)
+    if entry.device_xyz:
+        diff_xyz = xyz - np.array(
+            [
+                entry.device_xyz.get("x", np.nan),
+                entry.device_xyz.get("y", np.nan),
+                entry.device_xyz.get("z", np.nan),
+            ]
+        )
+        print("ΔXYZ vs device:", diff_xyz)
+    if entry.rawpy_xyz:
+        diff_rawpy = xyz - np.array(
+            [
+                entry.rawpy_xyz.get("x", np.nan),
+                entry.rawpy_xyz.get("y", np.nan),
+                entry.rawpy_xyz.get("z", np.nan),
+            ]
+        )
+        print("ΔXYZ vs rawpy column:", diff_rawpy)
+    print("----")
 
 
 def main() -> None:
@@ -274,6 +467,16 @@ def main() -> None:
         type=Path,
         help="Optional path to dump DNG color matrix details (includes inverse).",
     )
+    parser.add_argument(
+        "--quiet",
+        action="store_true",
+        help="Skip per-ROI printing (useful for large CSVs).",
+    )
+    parser.add_argument(
+        "--no-result-cache",
+        action="store_true",
+        help="Recompute ROI means instead of using the shared ROI result cache.",
+    )
     args = parser.parse_args()
 
     entries = load_roi_entries(args.roi_csv)
@@ -290,7 +493,8 @@ def main() -> None:
     else:
         target_entries = entries
 
-    with rawpy.imread(str(args.dng)) as raw:
+    with open_raw(args.dng) as raw, (nullcontext() if args.no_result_cache else RoiResultCache()) as cache:
+        # rawpy's color_matrix comes from the sidecar, so no libraw decode on a cache hit.
         cam2xyz = get_cam2xyz_matrix(raw)
         if cam2xyz is None:
             raise SystemExit("DNG does not expose color_matrix; cannot continue.")
@@ -301,74 +505,20 @@ def main() -> None:
         if args.matrix_json:
             dump_color_matrices(raw, cam2xyz, args.matrix_json)
 
-        computed: List[RoiComputation] = []
-        for entry in target_entries:
-            print("=" * 70)
-            print(entry.label)
-            roi_means = compute_roi_means(raw, entry.raw_rect)
-            print("Recomputed RAW averages:", roi_means)
-            wb = np.array(
-                [
-                    entry.wb_gains["r"],
-                    entry.wb_gains["g"],
-                    entry.wb_gains["b"],
-                ],
-                dtype=np.float64,
-            )
-            # Replace NaNs with camera defaults if necessary.
-            if not np.all(np.isfinite(wb)):
-                wb = np.array(raw.camera_whitebalance[:3], dtype=np.float64)
-            camera_rgb = np.array(
-                [roi_means["r"], roi_means["g"], roi_means["b"]], dtype=np.float64
-            )
-            balanced = camera_rgb * wb
-            xyz = cam2xyz @ balanced
-            srgb_linear = XYZ_TO_SRGB @ xyz
-            srgb = linear_to_srgb(srgb_linear)
-            srgb_uint8 = np.clip(np.round(srgb * 255), 0, 255).astype(int)
-
-            print("WB gains used:", wb)
-            print("WB-corrected camera RGB:", balanced)
-            print("XYZ from matrix:", xyz)
-            print("Linear sRGB:", srgb_linear)
-            print("sRGB (gamma):", srgb)
-            print("sRGB 0-255:", srgb_uint8)
-            if entry.device_xyz:
-                diff_xyz = xyz - np.array(
-                    [
-                        entry.device_xyz.get("x", np.nan),
-                        entry.device_xyz.get("y", np.nan),
-                        entry.device_xyz.get("z", np.nan),
-                    ]
-                )
-                print("ΔXYZ vs device:", diff_xyz)
-            if entry.rawpy_xyz:
-                diff_rawpy = xyz - np.array(
-                    [
-                        entry.rawpy_xyz.get("x", np.nan),
-                        entry.rawpy_xyz.get("y", np.nan),
-                        entry.rawpy_xyz.get("z", np.nan),
-                    ]
-                )
-                print("ΔXYZ vs rawpy column:", diff_rawpy)
-            computed.append(
-                RoiComputation(
-                    roi_index=entry.index,
-                    raw_r=camera_rgb[0],
-                    raw_g=camera_rgb[1],
-                    raw_b=camera_rgb[2],
-                    wb_r=balanced[0],
-                    wb_g=balanced[1],
-                    wb_b=balanced[2],
-                    xyz_x=xyz[0],
-                    xyz_y=xyz[1],
-                    xyz_z=xyz[2],
-                    srgb_r=srgb[0],
-                    srgb_g=srgb[1],
-                    srgb_b=srgb[2],
-                )
-            )
-            print("----")
+        rects = rect_array([entry.raw_rect for entry in target_entries])
+        wb_gains = np.array(
+            [[entry.wb_gains["r"], entry.wb_gains["g"], entry.wb_gains["b"]] for entry in target_entries],
+            dtype=np.float64,
+        )
+        # Replace NaNs with camera defaults if necessary.
+        camera_wb = np.array(raw.camera_whitebalance[:3], dtype=np.float64)
+        camera_rgb = cached_roi_means(raw, rects, cache)
+        result = evaluate_means(camera_rgb, cam2xyz, wb_gains, fallback_wb=camera_wb)
+        if not args.quiet:
+            for row, entry in enumerate(target_entries):
+                print_roi_report(entry, result, row)
+        computed = result.computations([entry.index for entry in target_entries])
+        print(f"Evaluated {len(computed)} ROIs.")
     if args.output_json:
         payload = [asdict(result) for result in computed]
         args.output_json.write_text(json.dumps(payload, indent=2), encoding="utf-8")
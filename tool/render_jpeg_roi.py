@@ -2,21 +2,26 @@
 """
 Render JPEG ROI visualization and average color statistics.
 
+The ROI statistics come from a partial decode that stops below the ROI, and
+the overlay is drawn on a draft-mode preview (see jpeg_access).
+
 Usage:
   python render_jpeg_roi.py --jpeg <path/to/jpeg> --roi-csv <roi_dump.csv> \
-         [--roi-index 0] [--out out.jpg]
+         [--roi-index 0] [--max-preview 1600] [--out out.jpg]
 """
 
 from __future__ import annotations
 
 import argparse
-import csv
 from pathlib import Path
 from typing import Dict
 
 import numpy as np
 from PIL import ExifTags, Image, ImageDraw, ImageFont
 
+from color_core import load_roi_row, srgb_to_linear
+from jpeg_access import open_preview, read_jpeg_info, read_stored_boxes, scale_box
+
 
 def parse_args() -> argparse.Namespace:
   parser = argparse.ArgumentParser(description="Visualize ROI on captured JPEG.")
@@ -25,21 +30,14 @@ def parse_args() -> argparse.Namespace:
                       help="ROI dump CSV exported by the app.")
   parser.add_argument("--roi-index", type=int, default=0,
                       help="ROI index (row) to visualize, default 0.")
+  parser.add_argument("--max-preview", type=int, default=1600,
+                      help="Longest side of the overlay preview in pixels "
+                      "(default 1600; 0 keeps the full resolution).")
   parser.add_argument("--out", type=Path, default=None,
                       help="Optional output path for visualization JPEG.")
   return parser.parse_args()
 
 
-def load_roi_row(csv_path: Path, index: int) -> Dict[str, str]:
-  with csv_path.open(newline="", encoding="utf-8") as fh:
-    reader = list(csv.DictReader(fh))
-  if not reader:
-    raise SystemExit("ROI CSV is empty.")
-  if index < 0 or index >= len(reader):
-    raise SystemExit(f"ROI index {index} out of range (0..{len(reader)-1}).")
-  return reader[index]
-
-
 def get_orientation(img: Image.Image) -> int:
   if hasattr(img, "_getexif"):
     exif = img._getexif()  # type: ignore[attr-defined]
@@ -102,17 +100,6 @@ def map_rect(rotated: Dict[str, float], width: int, height: int) -> tuple[int, i
   return left, top, right, bottom
 
 
-def srgb_to_linear(value: np.ndarray) -> np.ndarray:
-  threshold = 0.04045
-  return np.where(value <= threshold, value / 12.92,
-                  ((value + 0.055) / 1.055) ** 2.4)
-
-
-def linear_to_srgb(value: np.ndarray) -> np.ndarray:
-  return np.where(value <= 0.0031308, value * 12.92,
-                  1.055 * (value ** (1 / 2.4)) - 0.055)
-
-
 def main() -> None:
   args = parse_args()
   row = load_roi_row(args.roi_csv, args.roi_index)
@@ -123,29 +110,29 @@ def main() -> None:
       "bottom": float(row["roi_bottom"]),
   }
 
-  orig_img = Image.open(args.jpeg)
-  orientation_tag = get_orientation(orig_img)
-  orig_img = orig_img.convert("RGB")
+  info = read_jpeg_info(args.jpeg)
   orientation_deg = {
       3: 180,
       6: 270,
       8: 90,
-  }.get(orientation_tag, 0)
-  width, height = orig_img.size
+  }.get(info.orientation, 0)
+  width, height = info.size
 
   rotated = rotate_rect(normalized, orientation_deg)
   left, top, right, bottom = map_rect(rotated, width, height)
   bbox = (left, top, right, bottom)
 
-  roi = orig_img.crop(bbox)
-  srgb = np.asarray(roi).astype(np.float32) / 255.0
+  roi = read_stored_boxes(args.jpeg, [bbox])[0]
+  srgb = roi.astype(np.float32) / 255.0
   avg_srgb_gamma = srgb.mean(axis=(0, 1))
   avg_linear = srgb_to_linear(avg_srgb_gamma)
   display_rgb = tuple(np.clip((avg_srgb_gamma * 255).round().astype(int), 0, 255))
 
-  overlay = orig_img.copy()
+  # Overlay stays in stored orientation, like the bbox above.
+  max_preview = args.max_preview or max(width, height)
+  overlay, scale = open_preview(info, max_preview, max_preview, upright=False)
   draw = ImageDraw.Draw(overlay)
-  draw.rectangle(bbox, outline=(255, 165, 0), width=6)
+  draw.rectangle(scale_box(bbox, scale, overlay.size), outline=(255, 165, 0), width=6)
 
   padding = 20
   patch_w, patch_h = 320, 200
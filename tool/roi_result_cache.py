@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+"""
+Content-addressed cache for per-ROI pipeline results.
+
+The RAW inspection tools keep recomputing the same ROI means and stage
+vectors for a given (DNG, raw_rect, WB gains, matrix) combination. Results
+are stored here under a SHA-256 key built from the DNG content hash (the
+same one raw_cache uses), the rect, a stage name, the pipeline parameters
+and PIPELINE_VERSION. Each entry is a small dict of named float arrays kept
+in one SQLite file.
+
+Entries are evicted least-recently-used once the payload total exceeds the
+size cap. Bump PIPELINE_VERSION whenever the math behind a cached stage
+changes: opening the cache with a different version drops every entry.
+
+Cache location: $COLOR_TOOL_ROI_CACHE, or
+~/.cache/color_design_tool/roi_results.sqlite3.
+
+Usage:
+  python roi_result_cache.py [--purge] [--max-mb 256]   # prints entry count and size
+"""
+
+from __future__ import annotations
+
+import argparse
+import hashlib
+import io
+import json
+import os
+import sqlite3
+import time
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Mapping, Optional, Sequence, Union
+
+import numpy as np
+
+CACHE_ENV = "COLOR_TOOL_ROI_CACHE"
+DEFAULT_CACHE_PATH = Path.home() / ".cache" / "color_design_tool" / "roi_results.sqlite3"
+DEFAULT_MAX_BYTES = 256 << 20
+
+# Bump whenever the computation behind any cached stage changes.
+PIPELINE_VERSION = 1
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    key TEXT PRIMARY KEY,
+    payload BLOB NOT NULL,
+    size INTEGER NOT NULL,
+    last_used REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS entries_last_used ON entries(last_used);
+"""
+
+Rect = Union[Mapping[str, int], Sequence[int]]
+
+
+def cache_path(path: Optional[Path] = None) -> Path:
+    if path is not None:
+        return Path(path)
+    env = os.environ.get(CACHE_ENV)
+    return Path(env) if env else DEFAULT_CACHE_PATH
+
+
+def _plain(value: Any) -> Any:
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, (tuple, list)):
+        return [_plain(item) for item in value]
+    if isinstance(value, dict):
+        return {str(key): _plain(item) for key, item in value.items()}
+    return value
+
+
+def result_key(content_hash: str, rect: Rect, stage: str, **params: Any) -> str:
+    """
+    Cache key for one ROI result. ``params`` may hold scalars, sequences,
+    numpy arrays or dicts of those; floats are hashed at full precision and
+    anything else (e.g. rawpy enums) by its repr.
+    """
+    if isinstance(rect, Mapping):
+        rect = (rect["left"], rect["top"], rect["right"], rect["bottom"])
+    payload = {
+        "version": PIPELINE_VERSION,
+        "dng": content_hash,
+        "rect": [int(v) for v in rect],
+        "stage": stage,
+        "params": _plain(params),
+    }
+    encoded = json.dumps(payload, sort_keys=True, default=repr)
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+
+def _encode(arrays: Mapping[str, np.ndarray]) -> bytes:
+    buffer = io.BytesIO()
+    np.savez(buffer, **{name: np.asarray(value) for name, value in arrays.items()})
+    return buffer.getvalue()
+
+
+def _decode(payload: bytes) -> Dict[str, np.ndarray]:
+    with np.load(io.BytesIO(payload), allow_pickle=False) as data:
+        return {name: data[name] for name in data.files}
+
+
+class RoiResultCache:
+    """SQLite-backed LRU store of ROI results; use as a context manager."""
+
+    def __init__(self, path: Optional[Path] = None, max_bytes: int = DEFAULT_MAX_BYTES) -> None:
+        self.path = cache_path(path)
+        self.max_bytes = max_bytes
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(str(self.path), timeout=30.0)
+        self._conn.executescript(_SCHEMA)
+        version = self._conn.execute("PRAGMA user_version").fetchone()[0]
+        if version != PIPELINE_VERSION:
+            self.purge()
+            self._conn.execute(f"PRAGMA user_version = {PIPELINE_VERSION}")
+
+    def close(self) -> None:
+        self._conn.close()
+
+    def __enter__(self) -> "RoiResultCache":
+        return self
+
+    def __exit__(self, *exc: object) -> None:
+        self.close()
+
+    def purge(self) -> None:
+        with self._conn:
+            self._conn.execute("DELETE FROM entries")
+        self._conn.execute("VACUUM")
+
+    def stats(self) -> Dict[str, int]:
+        count, total = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries").fetchone()
+        return {"entries": int(count), "bytes": int(total)}
+
+    def get_many(self, keys: Sequence[str]) -> List[Optional[Dict[str, np.ndarray]]]:
+        """Results for ``keys`` in order (None for misses); hits count as used."""
+        found: Dict[str, bytes] = {}
+        for start in range(0, len(keys), 500):
+            chunk = list(keys[start : start + 500])
+            placeholders = ",".join("?" * len(chunk))
+            found.update(
+                self._conn.execute(f"SELECT key, payload FROM entries WHERE key IN ({placeholders})", chunk)
+            )
+        if found:
+            now = time.time()
+            with self._conn:
+                self._conn.executemany("UPDATE entries SET last_used = ? WHERE key = ?", [(now, key) for key in found])
+        return [_decode(found[key]) if key in found else None for key in keys]
+
+    def get(self, key: str) -> Optional[Dict[str, np.ndarray]]:
+        return self.get_many([key])[0]
+
+    def put_many(self, items: Iterable[tuple]) -> None:
+        """Store (key, {name: array}) pairs, then evict down to the size cap."""
+        now = time.time()
+        rows = []
+        for key, arrays in items:
+            payload = _encode(arrays)
+            rows.append((key, payload, len(payload), now))
+        with self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO entries (key, payload, size, last_used) VALUES (?, ?, ?, ?)", rows
+            )
+            self._evict()
+
+    def put(self, key: str, arrays: Mapping[str, np.ndarray]) -> None:
+        self.put_many([(key, arrays)])
+
+    def evict(self) -> None:
+        with self._conn:
+            self._evict()
+
+    def _evict(self) -> None:
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        doomed = []
+        for key, size in self._conn.execute("SELECT key, size FROM entries ORDER BY last_used"):
+            if total <= self.max_bytes:
+                break
+            doomed.append((key,))
+            total -= size
+        self._conn.executemany("DELETE FROM entries WHERE key = ?", doomed)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Inspect or clear the ROI result cache.")
+    parser.add_argument("--cache", type=Path, default=None, help="Override the cache database path.")
+    parser.add_argument("--purge", action="store_true", help="Drop every cached result.")
+    parser.add_argument("--max-mb", type=float, default=None, help="Evict least-recently-used entries down to this size.")
+    args = parser.parse_args()
+    max_bytes = int(args.max_mb * (1 << 20)) if args.max_mb is not None else DEFAULT_MAX_BYTES
+    with RoiResultCache(args.cache, max_bytes=max_bytes) as cache:
+        if args.purge:
+            cache.purge()
+        if args.max_mb is not None:
+            cache.evict()
+        stats = cache.stats()
+        print(f"{cache.path}: {stats['entries']} entries, {stats['bytes'] / (1 << 20):.2f} MiB (version {PIPELINE_VERSION})")
+
+
+if __name__ == "__main__":
+    main()
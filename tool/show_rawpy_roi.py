@@ -15,6 +15,8 @@ import matplotlib.pyplot as plt
 import numpy as np
 import rawpy  # type: ignore
 
+from raw_cache import load_postprocessed
+
 
 def parse_args() -> argparse.Namespace:
     parser = argparse.ArgumentParser(description="Show rawpy render with ROI rectangle overlay.")
@@ -51,13 +53,13 @@ def main() -> None:
     args = parse_args()
     row = load_row(args.roi_csv, args.row)
 
-    with rawpy.imread(str(args.dng)) as raw:
-        rgb = raw.postprocess(
-            use_camera_wb=True,
-            no_auto_bright=True,
-            output_bps=8,
-            output_color=rawpy.ColorSpace.sRGB,
-        )
+    rgb = load_postprocessed(
+        args.dng,
+        use_camera_wb=True,
+        no_auto_bright=True,
+        output_bps=8,
+        output_color=rawpy.ColorSpace.sRGB,
+    )
 
     h, w, _ = rgb.shape
     # Use the actual RAW buffer ROI coordinates as recorded by the app.
@@ -0,0 +1,48 @@
+"""
+Equivalence tests for the verify_pipeline demosaic kernels.
+
+Usage:
+  python -m pytest test_demosaic.py
+"""
+
+from __future__ import annotations
+
+import numpy as np
+import pytest
+
+from verify_pipeline import BAYER_PATTERNS, demosaic_bilinear, demosaic_bilinear_masked, demosaic_superpixel
+
+# Odd sizes and every CFA phase exercise the explicit border frame.
+SHAPES = ((1, 1), (2, 3), (5, 7), (64, 33), (120, 160))
+
+
+def _sample(shape) -> np.ndarray:
+    rng = np.random.default_rng(shape[0] * 1000 + shape[1])
+    # Slightly out of [0, 1] so clipping paths are exercised too.
+    return rng.uniform(-0.05, 1.05, size=shape).astype(np.float32)
+
+
+@pytest.mark.parametrize("pattern", BAYER_PATTERNS)
+@pytest.mark.parametrize("shape", SHAPES)
+def test_strided_matches_masked(shape, pattern):
+    mosaic = _sample(shape)
+    np.testing.assert_allclose(demosaic_bilinear(mosaic, pattern), demosaic_bilinear_masked(mosaic, pattern), atol=1e-6)
+
+
+@pytest.mark.parametrize("pattern", ("RRRB", "GGRB", "RGBG", "RGB", "RGGX"))
+def test_non_bayer_pattern_rejected(pattern):
+    with pytest.raises(ValueError, match="Unsupported CFA pattern"):
+        demosaic_bilinear(_sample((8, 8)), pattern)
+
+
+@pytest.mark.parametrize("pattern", BAYER_PATTERNS)
+def test_superpixel_reads_each_block(pattern):
+    mosaic = _sample((6, 9))
+    rgb = demosaic_superpixel(mosaic, pattern)
+    assert rgb.shape == (3, 4, 3)
+    block = mosaic[2:4, 4:6]
+    values = dict(R=[], G=[], B=[])
+    for idx, color in enumerate(pattern):
+        values[color].append(block[idx // 2, idx % 2])
+    expected = np.clip([values["R"][0], np.mean(values["G"]), values["B"][0]], 0.0, 1.0)
+    np.testing.assert_allclose(rgb[1, 2], expected, atol=1e-6)
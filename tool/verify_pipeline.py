@@ -1,12 +1,63 @@
+import argparse
 import json
+import os
+import shutil
+import struct
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from dataclasses import dataclass
 from pathlib import Path
 from typing import Optional
 
 import cv2
 import matplotlib.pyplot as plt
 import numpy as np
-import rawpy
 
+from capture_index import CaptureIndex
+from ccm_interpolation import color_matrix_interpolator
+from dng_metadata import CALIBRATION_TAGS, read_dng_metadata
+from raw_cache import open_raw
+
+DEFAULT_MEMORY_BUDGET_MB = 512
+# 3x3 bilinear kernel as {(dy, dx): weight}; same as interpolate_plane's kernel.
+BILINEAR_TAPS = {
+    (-1, -1): 1, (-1, 0): 2, (-1, 1): 1,
+    (0, -1): 2, (0, 0): 4, (0, 1): 2,
+    (1, -1): 1, (1, 0): 2, (1, 1): 1,
+}
+# 2x2 layouts demosaic_bilinear supports (greens on a diagonal).
+BAYER_PATTERNS = ("RGGB", "BGGR", "GRBG", "GBRG")
+# Rough peak bytes per pixel of one band: float32 mosaic + normalized plane,
+# demosaic masks and per-channel filter buffers, the black/WB stages.
+TILE_BASE_BYTES_PER_PIXEL = 96
+# Extra bytes per pixel per CCM variant (CCM + gamma float32 RGB and temporaries).
+TILE_VARIANT_BYTES_PER_PIXEL = 48
+# Halo rows around each band: covers the 3x3 bilinear kernel and is even so
+# every band starts on the same CFA phase as the full frame.
+TILE_HALO = 2
+PREVIEW_MAX_SIDE = 2048
+# Full-frame mode splits the image into this many bands per worker so the
+# pool stays busy when bands finish unevenly.
+BANDS_PER_WORKER = 4
+# Smallest band worth scheduling: the 2 * TILE_HALO rows recomputed per band
+# stay a few percent of the work. Worker counts are lowered before bands get
+# smaller than this to fit the memory budget.
+MIN_BAND_ROWS = 32 * TILE_HALO
+# Gamma LUT entries for ColorPipeline(lut_size=GAMMA_LUT_SIZE); 64K keeps the
+# interpolated curve within a fraction of an 8-bit step even near black, where
+# x ** (1 / 2.2) is steepest. Off by default: numpy's SIMD float32 pow was
+# ~5x faster than the interpolated lookup on a 6 MP frame.
+GAMMA_LUT_SIZE = 65536
+GAMMA_CHUNK = 1 << 16
+# Scale applied to |gamma - reference| difference maps before display/saving.
+DIFF_GAIN = 4.0
+DEFAULT_REFERENCE_CCM = "colorMatrix_interpolated"
+PLOTTED_CCMS = ("colorMatrix1", "colorMatrix_interpolated")
+PREVIEW_MODES = ("superpixel", "full")
+STAGE_FORMATS = ("png", "jpg")
 
 ILLUMINANT_INFO = {
     0: ("Unknown", None),
@@ -44,36 +95,23 @@ def find_metadata_file(directory: Path) -> Optional[Path]:
     return None
 
 
+def is_capture_dir(directory: Path) -> bool:
+    metadata_ok = find_metadata_file(directory) is not None
+    has_dng = any(directory.glob("*.dng")) or any(directory.glob("*.DNG"))
+    return metadata_ok and has_dng
+
+
+def find_capture_dirs(root: Path) -> list[Path]:
+    """``root`` itself if it is a capture, otherwise every capture below it."""
+    if is_capture_dir(root):
+        return [root]
+    with CaptureIndex() as index:
+        return index.capture_dirs(root)
+
+
 def locate_data_dir(base_dir: Path) -> Path:
     """Return a directory that holds metadata.json and a DNG file."""
-
-    def has_required_files(directory: Path) -> bool:
-        metadata_ok = find_metadata_file(directory) is not None
-        has_dng = any(directory.glob("*.dng")) or any(directory.glob("*.DNG"))
-        return metadata_ok and has_dng
-
-    def score_candidate(directory: Path, metadata_path: Path) -> tuple[int, float]:
-        name = metadata_path.name
-        score = 0
-        if name.endswith("_metadata.json"):
-            score += 10
-        meta_stem = name
-        if meta_stem.lower().endswith("_metadata.json"):
-            meta_stem = meta_stem[: -len("_metadata.json")]
-        meta_stem = Path(meta_stem).stem.lower()
-        dng_stems = {p.stem.lower() for p in directory.glob("*.dng")}
-        dng_stems.update(p.stem.lower() for p in directory.glob("*.DNG"))
-        if meta_stem in dng_stems:
-            score += 20
-        dir_str = str(directory).lower()
-        if "pipeline" in dir_str:
-            score += 5
-        if "debug" in dir_str:
-            score += 1
-        mtime = metadata_path.stat().st_mtime
-        return score, mtime
-
-    if has_required_files(base_dir):
+    if is_capture_dir(base_dir):
         return base_dir
 
     search_roots = [base_dir]
@@ -81,19 +119,9 @@ def locate_data_dir(base_dir: Path) -> Path:
     if storage_dir.exists():
         search_roots.append(storage_dir)
 
-    candidates: list[tuple[int, float, Path]] = []
-    metadata_patterns = ["metadata.json", "*_metadata.json"]
-    for root in search_roots:
-        for pattern in metadata_patterns:
-            for metadata_path in root.rglob(pattern):
-                candidate = metadata_path.parent
-                if has_required_files(candidate):
-                    score, mtime = score_candidate(candidate, metadata_path)
-                    candidates.append((score, mtime, candidate))
-
-    if candidates:
-        candidates.sort(key=lambda item: (item[0], item[1]), reverse=True)
-        best = candidates[0][2]
+    with CaptureIndex() as index:
+        best = index.best_capture(search_roots)
+    if best is not None:
         print(f"Selected data directory: {best}")
         return best
 
@@ -166,36 +194,6 @@ def get_camera_neutral(metadata: dict, color_planes: int) -> np.ndarray:
     return arr
 
 
-def xy_to_cct(x: float, y: float) -> Optional[float]:
-    denom = 0.1858 - y
-    if abs(denom) < 1e-9:
-        return None
-    n = (x - 0.3320) / denom
-    cct = 449.0 * n**3 + 3525.0 * n**2 + 6823.3 * n + 5520.33
-    if cct <= 0:
-        return None
-    return float(cct)
-
-
-def camera_neutral_to_xy(camera_neutral: list[float], color_matrix: list[list[float]]) -> Optional[tuple[float, float]]:
-    if len(camera_neutral) < 3:
-        return None
-    cam = np.asarray(camera_neutral[:3], dtype=np.float64)
-    matrix = np.asarray(color_matrix, dtype=np.float64)
-    try:
-        xyz = np.linalg.solve(matrix, cam)
-    except np.linalg.LinAlgError:
-        return None
-    denom = np.sum(xyz)
-    if abs(denom) < 1e-9:
-        return None
-    xyz = xyz / denom
-    x, y = float(xyz[0]), float(xyz[1])
-    if x <= 0 or y <= 0:
-        return None
-    return x, y
-
-
 def gather_calibration_sets(metadata: dict) -> tuple[int, list[dict]]:
     color_planes = infer_color_plane_count(metadata)
     calibrations = []
@@ -229,85 +227,31 @@ def gather_calibration_sets(metadata: dict) -> tuple[int, list[dict]]:
     return color_planes, calibrations
 
 
-def blend_matrices(low: Optional[np.ndarray], high: Optional[np.ndarray], weight: float) -> Optional[np.ndarray]:
-    if low is None and high is None:
-        return None
-    if high is None or np.isclose(weight, 0.0):
-        return np.array(low, dtype=np.float64) if low is not None else None
-    if low is None or np.isclose(weight, 1.0):
-        return np.array(high, dtype=np.float64) if high is not None else None
-    return (1.0 - weight) * low + weight * high
-
-
-def select_calibration_pair(calibrations: list[dict], cct: Optional[float]) -> tuple[dict, dict, float]:
-    if len(calibrations) == 1 or cct is None:
-        return calibrations[0], calibrations[0], 0.0
-    if cct <= calibrations[0]["cct"]:
-        return calibrations[0], calibrations[0], 0.0
-    if cct >= calibrations[-1]["cct"]:
-        return calibrations[-1], calibrations[-1], 0.0
-    for idx in range(len(calibrations) - 1):
-        low = calibrations[idx]
-        high = calibrations[idx + 1]
-        if low["cct"] <= cct <= high["cct"]:
-            denom = (1.0 / high["cct"]) - (1.0 / low["cct"])
-            if abs(denom) < 1e-9:
-                weight = 0.0
-            else:
-                weight = ((1.0 / cct) - (1.0 / low["cct"])) / denom
-            return low, high, float(np.clip(weight, 0.0, 1.0))
-    return calibrations[-2], calibrations[-1], 1.0
+def calibration_metadata(metadata: dict, dng_path: Path) -> dict:
+    """
+    ``metadata`` with the calibration tags it lacks (colorMatrixN,
+    calibrationIlluminantN, cameraCalibrationN, asShotNeutral, ...) filled in
+    from the DNG header, read without decoding pixels. metadata.json wins.
+    """
+    missing = [key for key in CALIBRATION_TAGS if key not in metadata]
+    if not missing:
+        return metadata
+    try:
+        header = read_dng_metadata(dng_path)
+    except (OSError, ValueError, struct.error) as exc:
+        print(f"Unable to read DNG calibration tags: {exc}")
+        return metadata
+    merged = dict(metadata)
+    merged.update({key: header[key] for key in missing if key in header})
+    return merged
 
 
 def interpolate_color_matrices(metadata: dict) -> tuple[str, list[list[float]], dict]:
     color_planes, calibrations = gather_calibration_sets(metadata)
     analog_balance = get_analog_balance(metadata, color_planes)
     camera_neutral = get_camera_neutral(metadata, color_planes)
-
-    initial_xy = None
-    for cal in calibrations:
-        initial_xy = camera_neutral_to_xy(camera_neutral.tolist(), cal["color_matrix"].tolist())
-        if initial_xy is not None:
-            break
-    if initial_xy is None:
-        initial_xy = (0.3127, 0.3290)
-    xy = np.asarray(initial_xy, dtype=np.float64)
-
-    final_low = calibrations[0]
-    final_high = calibrations[-1]
-    final_weight = 0.0
-    cct_estimate = None
-    for _ in range(10):
-        cct_estimate = xy_to_cct(float(xy[0]), float(xy[1]))
-        low, high, weight = select_calibration_pair(calibrations, cct_estimate)
-        color_matrix = blend_matrices(low["color_matrix"], high["color_matrix"], weight)
-        camera_calibration = blend_matrices(low["camera_calibration"], high["camera_calibration"], weight)
-        if color_matrix is None or camera_calibration is None:
-            raise ValueError("Unable to blend calibration matrices.")
-        xyz_to_camera = analog_balance @ camera_calibration @ color_matrix
-        pseudo_inv = np.linalg.pinv(xyz_to_camera)
-        xyz = pseudo_inv @ camera_neutral
-        denom = np.sum(xyz)
-        if abs(denom) < 1e-9:
-            break
-        new_xy = np.asarray([xyz[0] / denom, xyz[1] / denom], dtype=np.float64)
-        final_low, final_high, final_weight = low, high, float(weight)
-        if np.linalg.norm(new_xy - xy) < 1e-6:
-            xy = new_xy
-            break
-        xy = new_xy
-
-    blended_matrix = blend_matrices(final_low["color_matrix"], final_high["color_matrix"], final_weight)
-    if blended_matrix is None:
-        raise ValueError("Failed to compute interpolated color matrix.")
-    info = {
-        "white_cct": cct_estimate,
-        "low_temp": final_low["cct"],
-        "high_temp": final_high["cct"],
-        "low_name": final_low["name"],
-        "high_name": final_high["name"],
-        "weight": final_weight,
-    }
+    interpolator = color_matrix_interpolator(calibrations, analog_balance)
+    blended_matrix, info = interpolator.resolve(camera_neutral)
     return "colorMatrix_interpolated", blended_matrix.tolist(), info
 
 
@@ -435,7 +379,8 @@ def interpolate_plane(values: np.ndarray, mask: np.ndarray) -> np.ndarray:
     return filtered / weights
 
 
-def demosaic_bilinear(mosaic: np.ndarray, pattern: str = "RGGB") -> np.ndarray:
+def demosaic_bilinear_masked(mosaic: np.ndarray, pattern: str = "RGGB") -> np.ndarray:
+    """Reference mask-convolution bilinear demosaic; see demosaic_bilinear."""
     h, w = mosaic.shape
     pattern = pattern.upper()
     if len(pattern) != 4 or any(ch not in "RGB" for ch in pattern):
@@ -460,13 +405,115 @@ def demosaic_bilinear(mosaic: np.ndarray, pattern: str = "RGGB") -> np.ndarray:
     return np.clip(rgb, 0.0, 1.0)
 
 
-def apply_white_balance(rgb: np.ndarray, wb_gains: dict) -> np.ndarray:
+def wb_gain_vector(wb_gains: dict) -> np.ndarray:
     gains = {k: float(v) for k, v in wb_gains.items()}
     r_gain = gains.get("r", 1.0)
     g_gain = gains.get("g", (gains.get("gEven", 1.0) + gains.get("gOdd", 1.0)) * 0.5)
     b_gain = gains.get("b", 1.0)
-    gain_vec = np.array([r_gain, g_gain, b_gain], dtype=np.float32)
-    return rgb * gain_vec
+    return np.array([r_gain, g_gain, b_gain], dtype=np.float32)
+
+
+def _demosaic_border(mosaic: np.ndarray, pattern_grid: np.ndarray, planes: np.ndarray) -> None:
+    """
+    Fill the 1-px frame of the (3, H, W) ``planes`` with the same weights cv2's
+    BORDER_REFLECT convolution gives, evaluated explicitly per pixel.
+    """
+    h, w = mosaic.shape
+    rows = np.arange(h)
+    cols = np.arange(w)
+    ys = np.concatenate([np.zeros(w, dtype=int), np.full(w, h - 1), rows, rows])
+    xs = np.concatenate([cols, cols, np.zeros(h, dtype=int), np.full(h, w - 1)])
+    frame = np.unique(ys * w + xs)
+    ys, xs = frame // w, frame % w
+    center_colors = pattern_grid[ys % 2, xs % 2]
+    for channel, color in enumerate("RGB"):
+        num = np.zeros(ys.size, dtype=np.float32)
+        den = np.zeros(ys.size, dtype=np.float32)
+        for (dy, dx), weight in BILINEAR_TAPS.items():
+            # BORDER_REFLECT maps -1 -> 0 and h -> h - 1 for a radius-1 kernel.
+            yy = np.clip(ys + dy, 0, h - 1)
+            xx = np.clip(xs + dx, 0, w - 1)
+            hit = pattern_grid[yy % 2, xx % 2] == color
+            num += np.where(hit, np.float32(weight) * mosaic[yy, xx], np.float32(0.0))
+            den += np.float32(weight) * hit
+        interpolated = num / np.maximum(den, np.float32(1e-6))
+        planes[channel, ys, xs] = np.where(center_colors == color, mosaic[ys, xs], interpolated)
+
+
+def demosaic_bilinear(mosaic: np.ndarray, pattern: str = "RGGB") -> np.ndarray:
+    """
+    Bilinear demosaic on the four strided CFA sub-planes.
+
+    Away from the border every output phase sees a fixed set of same-color
+    neighbors with equal kernel weights, so each missing color is the mean
+    of 2 or 4 shifted sub-plane views; no masks or convolutions are needed.
+    The 1-px frame is filled by _demosaic_border. Channels are built as
+    separate planes and interleaved once at the end. Output is identical to
+    demosaic_bilinear_masked for the BAYER_PATTERNS layouts; anything else
+    raises ValueError.
+    """
+    h, w = mosaic.shape
+    pattern = pattern.upper()
+    if pattern not in BAYER_PATTERNS:
+        raise ValueError(f"Unsupported CFA pattern: {pattern} (expected one of {', '.join(BAYER_PATTERNS)})")
+
+    pattern_grid = np.array(list(pattern)).reshape(2, 2)
+    mosaic = np.asarray(mosaic, dtype=np.float32)
+    planes = np.empty((3, h, w), dtype=np.float32)
+    for py in range(2):
+        # First interior row (>= 1) with this phase; interior ends at h - 2.
+        y0 = 2 - py if py == 0 else 1
+        for px in range(2):
+            x0 = 2 - px if px == 0 else 1
+            rows, cols = slice(y0, h - 1, 2), slice(x0, w - 1, 2)
+            center = mosaic[rows, cols]
+            if center.size == 0:
+                continue
+            for channel, color in enumerate("RGB"):
+                dst = planes[channel, rows, cols]
+                if pattern_grid[py, px] == color:
+                    dst[...] = center
+                    continue
+                taps = [
+                    (dy, dx)
+                    for (dy, dx) in BILINEAR_TAPS
+                    if pattern_grid[(py + dy) % 2, (px + dx) % 2] == color
+                ]
+                views = [mosaic[y0 + dy : h - 1 + dy : 2, x0 + dx : w - 1 + dx : 2] for dy, dx in taps]
+                np.add(views[0], views[1], out=dst)
+                for view in views[2:]:
+                    dst += view
+                dst *= np.float32(1.0 / len(taps))
+    _demosaic_border(mosaic, pattern_grid, planes)
+    np.clip(planes, 0.0, 1.0, out=planes)
+    return cv2.merge([planes[0], planes[1], planes[2]])
+
+
+def demosaic_superpixel(mosaic: np.ndarray, pattern: str = "RGGB") -> np.ndarray:
+    """
+    Half-resolution demosaic: every 2x2 CFA block becomes one RGB pixel,
+    read straight from the strided CFA planes with the two greens averaged.
+    A trailing odd row/column is dropped.
+    """
+    pattern = pattern.upper()
+    if len(pattern) != 4 or sorted(pattern) != ["B", "G", "G", "R"]:
+        raise ValueError(f"Superpixel demosaic needs one R, two G and one B per 2x2 block, got {pattern}")
+    h2, w2 = mosaic.shape[0] // 2, mosaic.shape[1] // 2
+    rgb = np.empty((h2, w2, 3), dtype=np.float32)
+    greens = []
+    for idx, color in enumerate(pattern):
+        plane = mosaic[idx // 2 : 2 * h2 : 2, idx % 2 : 2 * w2 : 2]
+        if color == "G":
+            greens.append(plane)
+        else:
+            rgb[..., "RGB".index(color)] = plane
+    np.add(greens[0], greens[1], out=rgb[..., 1], dtype=np.float32)
+    rgb[..., 1] *= 0.5
+    return np.clip(rgb, 0.0, 1.0, out=rgb)
+
+
+def apply_white_balance(rgb: np.ndarray, wb_gains: dict) -> np.ndarray:
+    return rgb * wb_gain_vector(wb_gains)
 
 
 def apply_ccm(rgb: np.ndarray, ccm: list) -> np.ndarray:
@@ -482,6 +529,115 @@ def apply_gamma(rgb: np.ndarray, gamma: float = 2.2) -> np.ndarray:
     return rgb_clipped ** inv_gamma
 
 
+class ColorPipeline:
+    """
+    Compiled WB -> CCM -> gamma for one matrix.
+
+    WB gains are folded into the CCM (M @ diag(gains)) so the color step is a
+    single 3x3 pass over the black-level stage (values in [0, 1]). The staged
+    path clips after WB, so pixels with a balanced channel above 1.0 are
+    found by comparing against 1 / gain and redone with separate gains.
+
+    The transfer curve is the float32 power law; ``lut_size`` > 0 swaps in a
+    LUT (optionally interpolated) for builds where pow is not vectorized.
+
+    Every call accepts ``out=`` (which may alias the input) to avoid
+    full-frame temporaries.
+    """
+
+    def __init__(
+        self,
+        ccm,
+        wb_gains: Optional[dict] = None,
+        gamma: float = 2.2,
+        lut_size: int = 0,
+        interpolate: bool = True,
+    ) -> None:
+        matrix = np.asarray(ccm, dtype=np.float64).reshape(3, 3)
+        self.unfolded_t = np.ascontiguousarray(matrix.T, dtype=np.float32)
+        self.gains: Optional[np.ndarray] = None
+        self.wb_limits: Optional[np.ndarray] = None
+        if wb_gains:
+            gains = wb_gain_vector(wb_gains)
+            self.gains = gains
+            with np.errstate(divide="ignore"):
+                self.wb_limits = np.where(gains > 1.0, np.float32(1.0) / gains, np.float32(np.inf)).astype(np.float32)
+            matrix = matrix @ np.diag(gains.astype(np.float64))
+        self.matrix_t = np.ascontiguousarray(matrix.T, dtype=np.float32)
+        self.gamma = gamma
+        self.interpolate = interpolate
+        self.lut_size = lut_size
+        if not lut_size:
+            return
+        self.lut_scale = np.float32(lut_size - 1)
+        lut = np.linspace(0.0, 1.0, lut_size, dtype=np.float64) ** (1.0 / gamma)
+        self.lut = lut.astype(np.float32)
+        # Per-entry slope for linear interpolation; padded so index lut_size-1 is valid.
+        self.lut_delta = np.append(np.diff(self.lut), np.float32(0.0)).astype(np.float32)
+
+    def saturated(self, rgb: np.ndarray) -> Optional[np.ndarray]:
+        """Mask of pixels whose balanced value clips, or None without WB gains."""
+        if self.wb_limits is None:
+            return None
+        return np.any(rgb > self.wb_limits, axis=-1)
+
+    def apply_matrix(
+        self, rgb: np.ndarray, out: Optional[np.ndarray] = None, saturated: Optional[np.ndarray] = None
+    ) -> np.ndarray:
+        """
+        Linear, clipped camera->output RGB (the CCM stage). ``saturated``
+        may pass in a precomputed saturated() mask shared by several pipelines
+        with the same gains.
+        """
+        if out is None:
+            out = np.empty(rgb.shape, dtype=np.float32)
+        if saturated is None:
+            saturated = self.saturated(rgb)
+        # Copied before the matmul because ``out`` may alias ``rgb``.
+        clipped = rgb[saturated] if saturated is not None and saturated.any() else None
+        np.matmul(rgb, self.matrix_t, out=out)
+        if clipped is not None:
+            balanced = np.clip(clipped * self.gains, 0.0, 1.0)
+            out[saturated] = balanced @ self.unfolded_t
+        np.clip(out, 0.0, 1.0, out=out)
+        return out
+
+    def encode(self, linear: np.ndarray, out: Optional[np.ndarray] = None) -> np.ndarray:
+        """Transfer curve for values already clipped to [0, 1]."""
+        if out is None:
+            out = np.empty(linear.shape, dtype=np.float32)
+        elif not out.flags.c_contiguous:
+            raise ValueError("ColorPipeline.encode needs a C-contiguous out array.")
+        if not self.lut_size:
+            return np.power(linear, np.float32(1.0 / self.gamma), out=out)
+        src = linear.reshape(-1)
+        dst = out.reshape(-1)
+        chunk = min(GAMMA_CHUNK, src.size) or 1
+        pos = np.empty(chunk, dtype=np.float32)
+        idx = np.empty(chunk, dtype=np.intp)
+        for start in range(0, src.size, chunk):
+            stop = min(start + chunk, src.size)
+            n = stop - start
+            np.multiply(src[start:stop], self.lut_scale, out=pos[:n])
+            if self.interpolate:
+                idx[:n] = pos[:n]  # inputs are >= 0, so the cast floors
+                pos[:n] -= idx[:n]
+                np.take(self.lut, idx[:n], out=dst[start:stop])
+                dst[start:stop] += np.take(self.lut_delta, idx[:n]) * pos[:n]
+            else:
+                np.rint(pos[:n], out=pos[:n])
+                idx[:n] = pos[:n]
+                np.take(self.lut, idx[:n], out=dst[start:stop])
+        return out
+
+    def __call__(
+        self, rgb: np.ndarray, out: Optional[np.ndarray] = None, linear_out: Optional[np.ndarray] = None
+    ) -> np.ndarray:
+        """Gamma-encoded output. ``linear_out`` receives the CCM stage if given."""
+        linear = self.apply_matrix(rgb, out=linear_out if linear_out is not None else out)
+        return self.encode(linear, out=out)
+
+
 def sanitize_color_desc(color_desc_raw) -> str:
     if isinstance(color_desc_raw, bytes):
         color_desc = color_desc_raw.decode("ascii", errors="ignore")
@@ -491,41 +647,154 @@ def sanitize_color_desc(color_desc_raw) -> str:
     return filtered or "RGBG"
 
 
+def cfa_pattern_string(raw) -> str:
+    color_desc = sanitize_color_desc(raw.color_desc)
+    pattern_chars = []
+    for idx in raw.raw_pattern.flatten():
+        if idx >= len(color_desc):
+            raise ValueError(f"CFA pattern index {idx} out of range for color desc '{color_desc}'")
+        pattern_chars.append(color_desc[idx])
+    return "".join(pattern_chars).upper()
+
+
 def load_dng_mosaic(dng_path: Path) -> tuple[np.ndarray, str]:
-    with rawpy.imread(str(dng_path)) as raw:
+    with open_raw(dng_path) as raw:
         mosaic = raw.raw_image_visible.astype(np.float32)
-        color_desc = sanitize_color_desc(raw.color_desc)
-        pattern_indices = raw.raw_pattern
-        pattern_chars = []
-        for idx in pattern_indices.flatten():
-            if idx >= len(color_desc):
-                raise ValueError(f"CFA pattern index {idx} out of range for color desc '{color_desc}'")
-            pattern_chars.append(color_desc[idx])
-        pattern = "".join(pattern_chars).upper()
+        pattern = cfa_pattern_string(raw)
 
     return mosaic, pattern
 
 
-def prepare_base_images(dng_path: Path, metadata: dict) -> tuple[np.ndarray, np.ndarray]:
-    mosaic, pattern = load_dng_mosaic(dng_path)
-    height, width = mosaic.shape
-    meta_width = int(metadata.get("width", width))
-    meta_height = int(metadata.get("height", height))
-    if (meta_height, meta_width) != (height, width):
+class StageTimer:
+    """Thread-safe busy time and pixel counts per pipeline stage."""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.seconds: dict = {}
+        self.pixels: dict = {}
+        # Band workers actually used, after the memory budget capped them.
+        self.workers = 1
+
+    @contextmanager
+    def stage(self, name: str, pixels: int):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                self.seconds[name] = self.seconds.get(name, 0.0) + elapsed
+                self.pixels[name] = self.pixels.get(name, 0) + pixels
+
+    def report(self, wall_seconds: float, frame_pixels: int) -> None:
+        megapixels = frame_pixels / 1e6
         print(
-            f"Warning: metadata dimensions ({meta_width}x{meta_height}) "
-            f"do not match DNG ({width}x{height}); using DNG size."
+            f"Processed {megapixels:.1f} MP in {wall_seconds:.2f}s with {self.workers} worker(s) "
+            f"({megapixels / max(wall_seconds, 1e-9):.1f} MP/s)"
         )
-    normalized = subtract_black_level(mosaic, metadata["blackLevel"], metadata["whiteLevel"])
-    stage_black = demosaic_bilinear(normalized, pattern=pattern)
-    stage_wb = np.clip(apply_white_balance(stage_black, metadata["wbGains"]), 0.0, 1.0)
+        for name, seconds in self.seconds.items():
+            rate = self.pixels[name] / 1e6 / max(seconds, 1e-9)
+            print(f"  {name:<14} {seconds:8.2f}s busy  {rate:8.1f} MP/s per worker")
+
+
+def full_frame_band_rows(height: int, workers: int) -> int:
+    if workers <= 1:
+        return max(height, 1)
+    rows = -(-height // (workers * BANDS_PER_WORKER))
+    rows = max(rows, MIN_BAND_ROWS)
+    return rows + rows % 2
+
+
+def run_bands(height: int, band_rows: int, workers: int, func) -> None:
+    """
+    Call ``func(y0, y1, halo_top, halo_bottom)`` for every band, on a thread
+    pool when ``workers`` > 1. Bands write disjoint rows of preallocated
+    outputs; cv2.filter2D and numpy's large-array kernels release the GIL.
+    """
+    bands = list(iter_bands(height, band_rows))
+    if workers <= 1 or len(bands) == 1:
+        for band in bands:
+            func(*band)
+        return
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for future in [pool.submit(func, *band) for band in bands]:
+            future.result()
+
+
+def process_band(
+    mosaic: np.ndarray,
+    pattern: str,
+    metadata: dict,
+    y0: int,
+    y1: int,
+    halo_top: int,
+    halo_bottom: int,
+    timer: StageTimer,
+) -> tuple[np.ndarray, np.ndarray]:
+    """Black level -> demosaic -> WB for rows y0:y1, using the halo rows around them."""
+    pixels = (y1 - y0) * mosaic.shape[1]
+    with timer.stage("load", pixels):
+        band = mosaic[halo_top:halo_bottom].astype(np.float32)
+    with timer.stage("black level", pixels):
+        normalized = subtract_black_level(band, metadata["blackLevel"], metadata["whiteLevel"])
+    with timer.stage("demosaic", pixels):
+        stage_black = demosaic_bilinear(normalized, pattern=pattern)[y0 - halo_top : y1 - halo_top]
+    with timer.stage("white balance", pixels):
+        stage_wb = np.clip(apply_white_balance(stage_black, metadata["wbGains"]), 0.0, 1.0)
+    return stage_black, stage_wb
+
+
+def prepare_base_images(
+    dng_path: Path, metadata: dict, workers: int = 1, timer: Optional[StageTimer] = None
+) -> tuple[np.ndarray, np.ndarray]:
+    timer = timer or StageTimer()
+    with open_raw(dng_path) as raw:
+        mosaic = raw.raw_image_visible
+        pattern = cfa_pattern_string(raw)
+        height, width = mosaic.shape
+        meta_width = int(metadata.get("width", width))
+        meta_height = int(metadata.get("height", height))
+        if (meta_height, meta_width) != (height, width):
+            print(
+                f"Warning: metadata dimensions ({meta_width}x{meta_height}) "
+                f"do not match DNG ({width}x{height}); using DNG size."
+            )
+        stage_black = np.empty((height, width, 3), dtype=np.float32)
+        stage_wb = np.empty((height, width, 3), dtype=np.float32)
+
+        def run(y0: int, y1: int, halo_top: int, halo_bottom: int) -> None:
+            stage_black[y0:y1], stage_wb[y0:y1] = process_band(
+                mosaic, pattern, metadata, y0, y1, halo_top, halo_bottom, timer
+            )
+
+        run_bands(height, full_frame_band_rows(height, workers), workers, run)
     print(f"Using WB gains: {metadata['wbGains']}")
     return stage_black, stage_wb
 
 
-def build_stages_for_ccm(stage_black: np.ndarray, stage_wb: np.ndarray, ccm: list, label: str) -> list:
-    stage_ccm = np.clip(apply_ccm(stage_wb, ccm), 0.0, 1.0)
-    stage_gamma = apply_gamma(stage_ccm)
+def render_superpixel_previews(dng_path: Path, metadata: dict, ccm_variants: list, labels) -> dict:
+    """
+    Quarter-size stages for the plotted variants, via demosaic_superpixel.
+    Black level is applied after binning, which only differs from the
+    full-resolution path where a green sample sits below the black level.
+    """
+    with open_raw(dng_path) as raw:
+        binned = demosaic_superpixel(raw.raw_image_visible, pattern=cfa_pattern_string(raw))
+    stage_black = subtract_black_level(binned, metadata["blackLevel"], metadata["whiteLevel"])
+    stage_wb = np.clip(apply_white_balance(stage_black, metadata["wbGains"]), 0.0, 1.0)
+    previews = {}
+    for label, ccm in ccm_variants:
+        if label in labels:
+            previews[label] = build_stages_for_ccm(stage_black, stage_wb, ccm, label, metadata["wbGains"])
+    return previews
+
+
+def build_stages_for_ccm(
+    stage_black: np.ndarray, stage_wb: np.ndarray, ccm: list, label: str, wb_gains: dict
+) -> list:
+    """Stage list for one CCM; the CCM stage is computed from ``stage_black`` with WB folded in."""
+    stage_ccm = np.empty(stage_black.shape, dtype=np.float32)
+    stage_gamma = ColorPipeline(ccm, wb_gains)(stage_black, linear_out=stage_ccm)
     return [
         ("Black Level", stage_black),
         ("White Balance", stage_wb),
@@ -534,24 +803,411 @@ def build_stages_for_ccm(stage_black: np.ndarray, stage_wb: np.ndarray, ccm: lis
     ]
 
 
-def plot_stages(stages: list, title: Optional[str] = None) -> None:
+@dataclass
+class VariantStack:
+    ccm: np.ndarray  # (K, H, W, 3) linear, clipped
+    gamma: np.ndarray  # (K, H, W, 3)
+    diff: np.ndarray  # (K, H, W, 3) |gamma - gamma[reference]|
+
+
+class CcmVariantEngine:
+    """
+    Evaluates K CCMs together over the shared black-level stage: each
+    variant is a ColorPipeline with the WB gains folded into its matrix, the
+    WB saturation mask is computed once per tile for all of them, and every
+    variant gets a difference map against the reference.
+    """
+
+    def __init__(self, ccm_variants: list, reference: Optional[str] = None, wb_gains: Optional[dict] = None) -> None:
+        self.labels = [label for label, _ in ccm_variants]
+        if not self.labels:
+            raise ValueError("At least one CCM variant is required.")
+        self.pipelines = [ColorPipeline(ccm, wb_gains) for _, ccm in ccm_variants]
+        self.reference = self.labels.index(reference) if reference in self.labels else 0
+        self.encoder = ColorPipeline(np.eye(3))
+        self.diff_sum = np.zeros(len(self.labels), dtype=np.float64)
+        self.diff_max = np.zeros(len(self.labels), dtype=np.float64)
+        self.pixels = 0
+        self._stats_lock = threading.Lock()
+
+    @property
+    def reference_label(self) -> str:
+        return self.labels[self.reference]
+
+    def allocate(self, height: int, width: int) -> VariantStack:
+        shape = (len(self.labels), height, width, 3)
+        return VariantStack(
+            ccm=np.empty(shape, dtype=np.float32),
+            gamma=np.empty(shape, dtype=np.float32),
+            diff=np.empty(shape, dtype=np.float32),
+        )
+
+    def render(
+        self, stage_black: np.ndarray, out: Optional[VariantStack] = None, timer: Optional[StageTimer] = None
+    ) -> VariantStack:
+        """
+        Render every variant for ``stage_black``. ``out`` may hold row slices
+        of a larger preallocated stack; calls on disjoint rows are thread-safe.
+        """
+        height, width, _ = stage_black.shape
+        if out is None:
+            out = self.allocate(height, width)
+        timer = timer or StageTimer()
+        pixels = height * width * len(self.labels)
+        with timer.stage("ccm", pixels):
+            # One GEMM per matrix into the shared stack; numpy's broadcast
+            # matmul over (K, H) batches of (W, 3) rows is slower than this.
+            saturated = self.pipelines[0].saturated(stage_black)
+            for idx, pipeline in enumerate(self.pipelines):
+                pipeline.apply_matrix(stage_black, out=out.ccm[idx], saturated=saturated)
+        with timer.stage("gamma", pixels):
+            for idx in range(len(self.labels)):
+                self.encoder.encode(out.ccm[idx], out=out.gamma[idx])
+        with timer.stage("diff", pixels):
+            np.subtract(out.gamma, out.gamma[self.reference], out=out.diff)
+            np.abs(out.diff, out=out.diff)
+            flat = out.diff.reshape(len(self.labels), -1)
+            band_sum = flat.sum(axis=1, dtype=np.float64)
+            band_max = flat.max(axis=1) if flat.size else np.zeros(len(self.labels))
+        with self._stats_lock:
+            self.diff_sum += band_sum
+            self.diff_max = np.maximum(self.diff_max, band_max)
+            self.pixels += height * width * 3
+        return out
+
+    def stage_names(self) -> list:
+        """Names of every stage render_variant_bands writes, shared stages first."""
+        names = ["Black Level", "White Balance"]
+        for idx, label in enumerate(self.labels):
+            names.extend([f"CCM ({label})", f"Gamma ({label})"])
+            if idx != self.reference:
+                names.append(f"Diff ({label})")
+        return names
+
+    def stages(self, index: int, stage_black: np.ndarray, stage_wb: np.ndarray, stack: VariantStack) -> list:
+        label = self.labels[index]
+        stages = [
+            ("Black Level", stage_black),
+            ("White Balance", stage_wb),
+            (f"CCM ({label})", stack.ccm[index]),
+            (f"Gamma ({label})", stack.gamma[index]),
+        ]
+        if index != self.reference:
+            stages.append((f"Diff ({label})", stack.diff[index] * DIFF_GAIN))
+        return stages
+
+    def report(self) -> None:
+        print(f"Gamma differences vs {self.reference_label}:")
+        for idx, label in enumerate(self.labels):
+            if idx == self.reference:
+                continue
+            mean = self.diff_sum[idx] / max(self.pixels, 1)
+            print(f"  {label}: mean={mean:.5f} max={self.diff_max[idx]:.5f}")
+
+
+def budget_band_rows(
+    width: int, bytes_per_pixel: int, memory_budget_mb: float, workers: int, halo: int = 0
+) -> tuple[int, int]:
+    """
+    (band rows, workers) so that ``workers`` concurrent bands of
+    ``bytes_per_pixel`` plus ``halo`` rows on each side fit the budget.
+    Workers are dropped until each band gets at least MIN_BAND_ROWS; a single
+    band never goes below that, even if it overshoots the budget.
+    """
+    budget_rows = int(memory_budget_mb * 1024 * 1024 // (bytes_per_pixel * max(width, 1)))
+    workers = max(min(workers, budget_rows // (MIN_BAND_ROWS + 2 * halo)), 1)
+    rows = budget_rows // workers - 2 * halo
+    # Even band heights keep every band start on CFA phase (0, 0).
+    return max(rows - rows % 2, MIN_BAND_ROWS), workers
+
+
+def variant_band_rows(width: int, variant_count: int, memory_budget_mb: float, workers: int) -> tuple[int, int]:
+    """Bands whose (K, rows, W, 3) variant stacks fit the budget, for in-memory base images."""
+    return budget_band_rows(width, TILE_VARIANT_BYTES_PER_PIXEL * max(variant_count, 1), memory_budget_mb, workers)
+
+
+def tile_band_rows(width: int, variant_count: int, memory_budget_mb: float, workers: int) -> tuple[int, int]:
+    bytes_per_pixel = TILE_BASE_BYTES_PER_PIXEL + TILE_VARIANT_BYTES_PER_PIXEL * max(variant_count, 1)
+    return budget_band_rows(width, bytes_per_pixel, memory_budget_mb, workers, TILE_HALO)
+
+
+def report_worker_budget(requested: int, workers: int, memory_budget_mb: float) -> None:
+    if workers < requested:
+        print(f"Memory budget {memory_budget_mb:g} MB fits {workers} of {requested} worker(s); using {workers}.")
+
+
+def iter_bands(height: int, band_rows: int):
+    """Yield (y0, y1, halo_top, halo_bottom) covering ``height`` rows."""
+    for y0 in range(0, height, band_rows):
+        y1 = min(y0 + band_rows, height)
+        # At the real image edges no halo is added, so cv2's BORDER_REFLECT
+        # sees the same neighborhood as in the full-frame pass.
+        yield y0, y1, max(y0 - TILE_HALO, 0), min(y1 + TILE_HALO, height)
+
+
+def to_bgr_uint8(img: np.ndarray) -> np.ndarray:
+    return (np.clip(img, 0.0, 1.0) * 255.0).round().astype(np.uint8)[..., ::-1]
+
+
+def render_variant_bands(
+    engine: CcmVariantEngine,
+    band_source,
+    height: int,
+    width: int,
+    band_rows: int,
+    scratch_dir: Path,
+    workers: int = 1,
+    timer: Optional[StageTimer] = None,
+) -> dict:
+    """
+    Render every variant band by band and write each stage into a uint8 BGR
+    memmap under ``scratch_dir``; ``band_source(y0, y1, halo_top,
+    halo_bottom)`` returns the (black level, WB) rows y0:y1. Only one
+    (K, band, W, 3) stack per running band is alive, and the difference
+    statistics accumulate in ``engine`` as the bands go. Returns {stage name:
+    memmap}, with the stage names of CcmVariantEngine.stages.
+    """
+    timer = timer or StageTimer()
+    timer.workers = workers
+    names = engine.stage_names()
+    outputs = {
+        name: np.lib.format.open_memmap(
+            scratch_dir / f"stage_{idx}.npy", mode="w+", dtype=np.uint8, shape=(height, width, 3)
+        )
+        for idx, name in enumerate(names)
+    }
+
+    def run(y0: int, y1: int, halo_top: int, halo_bottom: int) -> None:
+        stage_black, stage_wb = band_source(y0, y1, halo_top, halo_bottom)
+        stack = engine.render(stage_black, timer=timer)
+        with timer.stage("write", (y1 - y0) * width * len(names)):
+            outputs["Black Level"][y0:y1] = to_bgr_uint8(stage_black)
+            outputs["White Balance"][y0:y1] = to_bgr_uint8(stage_wb)
+            for idx in range(len(engine.labels)):
+                for name, img in engine.stages(idx, stage_black, stage_wb, stack)[2:]:
+                    outputs[name][y0:y1] = to_bgr_uint8(img)
+
+    run_bands(height, band_rows, workers, run)
+    for out in outputs.values():
+        out.flush()
+    return outputs
+
+
+def render_stages_full_frame(
+    stage_black: np.ndarray,
+    stage_wb: np.ndarray,
+    metadata: dict,
+    ccm_variants: list,
+    scratch_dir: Path,
+    memory_budget_mb: float = DEFAULT_MEMORY_BUDGET_MB,
+    reference: Optional[str] = None,
+    workers: int = 1,
+    timer: Optional[StageTimer] = None,
+) -> dict:
+    """
+    CCM/gamma/diff stages for full-frame base images from
+    prepare_base_images, as render_variant_bands memmaps. The variant stack
+    of the concurrent bands stays within ``memory_budget_mb``.
+    """
+    engine = CcmVariantEngine(ccm_variants, reference, metadata["wbGains"])
+    requested = max(workers, 1)
+    height, width, _ = stage_black.shape
+    band_rows, workers = variant_band_rows(width, len(ccm_variants), memory_budget_mb, requested)
+    report_worker_budget(requested, workers, memory_budget_mb)
+    band_rows = min(band_rows, full_frame_band_rows(height, workers))
+    print(f"Processing {len(ccm_variants)} CCM variants in bands of {band_rows} rows: {', '.join(engine.labels)}")
+
+    def band_source(y0: int, y1: int, *_halo: int) -> tuple[np.ndarray, np.ndarray]:
+        return stage_black[y0:y1], stage_wb[y0:y1]
+
+    outputs = render_variant_bands(engine, band_source, height, width, band_rows, scratch_dir, workers, timer)
+    engine.report()
+    return outputs
+
+
+def render_stages_tiled(
+    dng_path: Path,
+    metadata: dict,
+    ccm_variants: list,
+    scratch_dir: Path,
+    memory_budget_mb: float = DEFAULT_MEMORY_BUDGET_MB,
+    reference: Optional[str] = None,
+    workers: int = 1,
+    timer: Optional[StageTimer] = None,
+) -> dict:
+    """
+    Stream black level -> demosaic -> WB -> CCM -> gamma over row bands of
+    the cached mosaic and write each stage into a uint8 BGR memmap under
+    ``scratch_dir``. Returns {stage name: memmap}, with the same stage names
+    as CcmVariantEngine.stages. Pixels match the full-frame path exactly.
+    With several workers the budget is shared between concurrent bands; see
+    budget_band_rows for how the worker count is capped.
+    """
+    engine = CcmVariantEngine(ccm_variants, reference, metadata["wbGains"])
+    timer = timer or StageTimer()
+    requested = max(workers, 1)
+    with open_raw(dng_path) as raw:
+        mosaic = raw.raw_image_visible
+        pattern = cfa_pattern_string(raw)
+        height, width = mosaic.shape
+        band_rows, workers = tile_band_rows(width, len(ccm_variants), memory_budget_mb, requested)
+        report_worker_budget(requested, workers, memory_budget_mb)
+        print(
+            f"Tiled mode: {height}x{width}, bands of {band_rows} rows "
+            f"(budget {memory_budget_mb:g} MB, {workers} worker(s))"
+        )
+
+        def band_source(y0: int, y1: int, halo_top: int, halo_bottom: int) -> tuple[np.ndarray, np.ndarray]:
+            return process_band(mosaic, pattern, metadata, y0, y1, halo_top, halo_bottom, timer)
+
+        outputs = render_variant_bands(engine, band_source, height, width, band_rows, scratch_dir, workers, timer)
+    print(f"Using WB gains: {metadata['wbGains']}")
+    engine.report()
+    return outputs
+
+
+class StageImageWriter:
+    """
+    Encodes stage images and figures on a thread pool; cv2.imwrite releases
+    the GIL, so PNG/JPEG compression overlaps with the next capture's work.
+    ``workers=0`` writes synchronously. Arrays handed over must not be
+    modified until drain() returns.
+    """
+
+    def __init__(self, workers: int = 0) -> None:
+        self._pool = ThreadPoolExecutor(max_workers=workers) if workers > 0 else None
+        self._pending: dict = {}
+
+    def write(self, path: Path, bgr: np.ndarray) -> None:
+        if self._pool is None:
+            if not cv2.imwrite(str(path), bgr):
+                raise OSError(f"Failed to write {path}")
+            return
+        self._pending[path] = self._pool.submit(cv2.imwrite, str(path), bgr)
+
+    def copy(self, src: Path, dst: Path) -> None:
+        source = self._pending.get(src)
+        if source is None:
+            shutil.copyfile(src, dst)
+            return
+
+        def copy_when_written() -> bool:
+            # The source task was queued first, so it is already running or done.
+            return bool(source.result()) and shutil.copyfile(src, dst) is not None
+
+        self._pending[dst] = self._pool.submit(copy_when_written)
+
+    def drain(self) -> None:
+        pending, self._pending = self._pending, {}
+        failed = [path for path, future in pending.items() if not future.result()]
+        if failed:
+            raise OSError(f"Failed to write {len(failed)} image(s), e.g. {failed[0]}")
+
+    def close(self) -> None:
+        self.drain()
+        if self._pool is not None:
+            self._pool.shutdown()
+
+
+class FigureRenderer:
+    """
+    One Agg figure reused for every plot in headless runs. Each plot is
+    rasterized on the shared canvas and handed to the writer as BGR pixels.
+    """
+
+    def __init__(self, writer: StageImageWriter) -> None:
+        from matplotlib.backends.backend_agg import FigureCanvasAgg
+        from matplotlib.figure import Figure
+
+        self.figure = Figure()
+        self.canvas = FigureCanvasAgg(self.figure)
+        self.writer = writer
+
+    def subplots(self, ncols: int, figsize: tuple[float, float]):
+        self.figure.clear()
+        self.figure.set_size_inches(*figsize)
+        axes = self.figure.subplots(1, ncols, squeeze=False)[0]
+        return self.figure, list(axes)
+
+    def save(self, path: Path) -> None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.figure.tight_layout()
+        self.canvas.draw()
+        rgba = np.asarray(self.canvas.buffer_rgba())
+        self.writer.write(path, cv2.cvtColor(rgba, cv2.COLOR_RGBA2BGR))
+        print(f"Saved {path}")
+
+
+def save_stage_memmaps(
+    outputs: dict,
+    label: str,
+    output_dir: Path,
+    shared_paths: dict,
+    writer: Optional[StageImageWriter] = None,
+    image_format: str = "png",
+) -> None:
+    """Encode one variant's stages; shared stages are encoded once and copied."""
+    writer = writer or StageImageWriter()
+    output_dir.mkdir(parents=True, exist_ok=True)
+    names = ("Black Level", "White Balance", f"CCM ({label})", f"Gamma ({label})", f"Diff ({label})")
+    for name in (name for name in names if name in outputs):
+        slug = name.lower().replace(" ", "_")
+        out_path = output_dir / f"stage_{slug}.{image_format}"
+        if name in shared_paths:
+            writer.copy(shared_paths[name], out_path)
+        else:
+            writer.write(out_path, outputs[name])
+            if not name.endswith(f"({label})"):
+                shared_paths[name] = out_path
+        print(f"Saved {out_path}")
+
+
+def preview_from_bgr(bgr: np.ndarray, max_side: int = PREVIEW_MAX_SIDE) -> np.ndarray:
+    step = max(1, -(-max(bgr.shape[:2]) // max_side))
+    return bgr[::step, ::step, ::-1].astype(np.float32) / 255.0
+
+
+def _new_figure(ncols: int, figsize: tuple[float, float], renderer: Optional[FigureRenderer]):
+    if renderer is not None:
+        return renderer.subplots(ncols, figsize)
+    fig, axes = plt.subplots(1, ncols, figsize=figsize)
+    return fig, list(np.atleast_1d(axes))
+
+
+def _finish_figure(renderer: Optional[FigureRenderer], save_path: Optional[Path]) -> None:
+    if renderer is None:
+        plt.tight_layout()
+        plt.show()
+    else:
+        renderer.save(save_path)
+
+
+def plot_stages(
+    stages: list,
+    title: Optional[str] = None,
+    renderer: Optional[FigureRenderer] = None,
+    save_path: Optional[Path] = None,
+) -> None:
     titles = [name for name, _ in stages]
     images = [np.clip(img, 0.0, 1.0) for _, img in stages]
-    fig, axes = plt.subplots(1, len(images), figsize=(4 * len(images), 4))
-    if len(images) == 1:
-        axes = [axes]
-    for ax, title, img in zip(axes, titles, images):
+    fig, axes = _new_figure(len(images), (4 * len(images), 4), renderer)
+    for ax, stage_title, img in zip(axes, titles, images):
         ax.imshow(img)
-        ax.set_title(title)
+        ax.set_title(stage_title)
         ax.axis("off")
     fig.suptitle(title or "Full Image ISP Stages")
-    plt.tight_layout()
-    plt.show()
-
-
-def plot_ccm_comparison(first_img: np.ndarray, second_img: np.ndarray, info: Optional[dict] = None) -> None:
-    diff = np.clip(np.abs(first_img - second_img) * 4.0, 0.0, 1.0)
-    fig, axes = plt.subplots(1, 3, figsize=(12, 4))
+    _finish_figure(renderer, save_path)
+
+
+def plot_ccm_comparison(
+    first_img: np.ndarray,
+    second_img: np.ndarray,
+    info: Optional[dict] = None,
+    renderer: Optional[FigureRenderer] = None,
+    save_path: Optional[Path] = None,
+) -> None:
+    diff = np.clip(np.abs(first_img - second_img) * DIFF_GAIN, 0.0, 1.0)
+    fig, axes = _new_figure(3, (12, 4), renderer)
     axes[0].imshow(np.clip(first_img, 0.0, 1.0))
     axes[0].set_title("Gamma (ColorMatrix1)")
     axes[0].axis("off")
@@ -572,8 +1228,7 @@ def plot_ccm_comparison(first_img: np.ndarray, second_img: np.ndarray, info: Opt
             f"{white_text} between {info.get('low_name', '?')}({info.get('low_temp', 0):.0f}K) "
             f"and {info.get('high_name', '?')}({info.get('high_temp', 0):.0f}K)"
         )
-    plt.tight_layout()
-    plt.show()
+    _finish_figure(renderer, save_path)
 
 
 def slugify(name: str) -> str:
@@ -581,31 +1236,92 @@ def slugify(name: str) -> str:
     return safe.strip("_").lower() or "ccm"
 
 
-def save_stage_images(stages: list, output_dir: Path) -> None:
+def save_stage_images(
+    stages: list, output_dir: Path, writer: Optional[StageImageWriter] = None, image_format: str = "png"
+) -> None:
+    writer = writer or StageImageWriter()
     output_dir.mkdir(parents=True, exist_ok=True)
     for name, img in stages:
         clipped = np.clip(img, 0.0, 1.0)
         img_uint8 = (clipped * 255.0).round().astype(np.uint8)
         bgr = cv2.cvtColor(img_uint8, cv2.COLOR_RGB2BGR)
         slug = name.lower().replace(" ", "_")
-        out_path = output_dir / f"stage_{slug}.png"
-        cv2.imwrite(str(out_path), bgr)
+        out_path = output_dir / f"stage_{slug}.{image_format}"
+        writer.write(out_path, bgr)
         print(f"Saved {out_path}")
 
 
-def main() -> None:
-    base_dir = Path(__file__).resolve().parent
-    data_dir = locate_data_dir(base_dir)
-    print(f"Using data directory: {data_dir}")
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Full-frame ISP stage check for a debug capture.")
+    parser.add_argument(
+        "--tiled",
+        action="store_true",
+        help="Stream the pipeline over row bands so peak memory stays within --memory-budget-mb.",
+    )
+    parser.add_argument(
+        "--memory-budget-mb",
+        type=float,
+        default=DEFAULT_MEMORY_BUDGET_MB,
+        help=f"Working-set budget for the per-band CCM variant stacks, and for the whole pipeline with --tiled "
+        f"(default: {DEFAULT_MEMORY_BUDGET_MB}).",
+    )
+    parser.add_argument(
+        "--reference",
+        default=DEFAULT_REFERENCE_CCM,
+        help="CCM variant the difference maps are computed against (falls back to the first variant).",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=os.cpu_count() or 1,
+        help="Threads for band-parallel demosaic/color processing (default: CPU count); "
+        "lowered when --memory-budget-mb cannot hold that many bands.",
+    )
+    parser.add_argument(
+        "--preview-mode",
+        choices=PREVIEW_MODES,
+        default="superpixel",
+        help="Plot previews from a half-resolution 2x2 superpixel demosaic (default) or the full-resolution stages.",
+    )
+    parser.add_argument(
+        "--batch",
+        type=Path,
+        nargs="+",
+        default=None,
+        metavar="DIR",
+        help="Headless mode: process every capture in (or below) these directories and save figures instead of showing them.",
+    )
+    parser.add_argument(
+        "--encode-workers",
+        type=int,
+        default=os.cpu_count() or 1,
+        help="Threads for PNG/JPEG encoding (0 = encode inline; default: CPU count).",
+    )
+    parser.add_argument(
+        "--stage-format",
+        choices=STAGE_FORMATS,
+        default="png",
+        help="File format for saved stage images (default: png).",
+    )
+    return parser.parse_args()
+
 
+def run_capture(
+    data_dir: Path,
+    args: argparse.Namespace,
+    writer: StageImageWriter,
+    renderer: Optional[FigureRenderer] = None,
+) -> None:
+    """Process one capture directory; figures are shown, or saved when ``renderer`` is given."""
     metadata_path = find_metadata_file(data_dir)
     if metadata_path is None:
         raise FileNotFoundError(f"No metadata file found in {data_dir}")
-    raw_metadata = load_metadata(metadata_path)
-    proc_metadata = normalize_metadata(raw_metadata)
     dng_path = find_dng_file(data_dir)
     print(f"Using DNG file: {dng_path.name}")
-    stage_black, stage_wb = prepare_base_images(dng_path, proc_metadata)
+    json_metadata = load_metadata(metadata_path)
+    # Levels and WB stay as recorded by the app; only color calibration is filled in.
+    proc_metadata = normalize_metadata(json_metadata)
+    raw_metadata = calibration_metadata(json_metadata, dng_path)
     ccm_variants = collect_ccm_variants(raw_metadata)
     interpolation_info = None
     try:
@@ -619,18 +1335,114 @@ def main() -> None:
     except ValueError as exc:
         print(f"Unable to compute interpolated CCM: {exc}")
     output_root = data_dir / "pipeline_outputs_full_frame"
-    comparison_images = {}
-    for label, ccm in ccm_variants:
-        print(f"Processing CCM: {label}")
-        stages = build_stages_for_ccm(stage_black, stage_wb, ccm, label)
-        save_stage_images(stages, output_root / slugify(label))
-        if label in {"colorMatrix1", "colorMatrix_interpolated"}:
-            plot_stages(stages, title=f"{label} ISP Stages")
-            comparison_images[label] = stages[-1][1]
-    if interpolation_info and {"colorMatrix1", "colorMatrix_interpolated"} <= comparison_images.keys():
+    preview_stages = {}
+    if args.preview_mode == "superpixel":
+        preview_stages = render_superpixel_previews(dng_path, proc_metadata, ccm_variants, PLOTTED_CCMS)
+    timer = StageTimer()
+    start = time.perf_counter()
+    output_root.mkdir(parents=True, exist_ok=True)
+    with tempfile.TemporaryDirectory(prefix=".tiles_", dir=output_root) as scratch:
+        if args.tiled:
+            outputs = render_stages_tiled(
+                dng_path,
+                proc_metadata,
+                ccm_variants,
+                Path(scratch),
+                args.memory_budget_mb,
+                args.reference,
+                args.workers,
+                timer,
+            )
+        else:
+            stage_black, stage_wb = prepare_base_images(dng_path, proc_metadata, args.workers, timer)
+            outputs = render_stages_full_frame(
+                stage_black,
+                stage_wb,
+                proc_metadata,
+                ccm_variants,
+                Path(scratch),
+                args.memory_budget_mb,
+                args.reference,
+                args.workers,
+                timer,
+            )
+            del stage_black, stage_wb
+        frame_height, frame_width = outputs["Black Level"].shape[:2]
+        timer.report(time.perf_counter() - start, frame_height * frame_width)
+        shared_paths: dict = {}
+        for label, _ in ccm_variants:
+            print(f"Saving CCM: {label}")
+            save_stage_memmaps(outputs, label, output_root / slugify(label), shared_paths, writer, args.stage_format)
+            if label in PLOTTED_CCMS and args.preview_mode == "full":
+                names = ["Black Level", "White Balance", f"CCM ({label})", f"Gamma ({label})"]
+                preview_stages[label] = [(name, preview_from_bgr(outputs[name])) for name in names]
+        # Queued encodes read straight from the memmaps in ``scratch``.
+        writer.drain()
+        del outputs
+    figure_dir = output_root / "figures"
+    for label in PLOTTED_CCMS:
+        if label in preview_stages:
+            plot_stages(
+                preview_stages[label],
+                title=f"{label} ISP Stages",
+                renderer=renderer,
+                save_path=figure_dir / f"{slugify(label)}_stages.png",
+            )
+    if interpolation_info and set(PLOTTED_CCMS) <= preview_stages.keys():
         plot_ccm_comparison(
-            comparison_images["colorMatrix1"], comparison_images["colorMatrix_interpolated"], interpolation_info
+            preview_stages["colorMatrix1"][3][1],
+            preview_stages["colorMatrix_interpolated"][3][1],
+            interpolation_info,
+            renderer=renderer,
+            save_path=figure_dir / "ccm_comparison.png",
         )
+    writer.drain()
+
+
+def run_batch(args: argparse.Namespace) -> None:
+    plt.switch_backend("Agg")
+    captures: list[Path] = []
+    for root in args.batch:
+        for capture in find_capture_dirs(root):
+            if capture not in captures:
+                captures.append(capture)
+    if not captures:
+        raise SystemExit("No capture directories (metadata.json + *.dng) found.")
+    writer = StageImageWriter(args.encode_workers)
+    renderer = FigureRenderer(writer)
+    failures = []
+    start = time.perf_counter()
+    for idx, capture in enumerate(captures, start=1):
+        print(f"[{idx}/{len(captures)}] {capture}")
+        try:
+            run_capture(capture, args, writer, renderer)
+        except Exception as exc:  # noqa: BLE001
+            # A corrupt or truncated DNG raises rawpy's LibRawError, which is not
+            # an OSError; one bad capture must not stop the rest of the batch.
+            failures.append(capture)
+            print(f"FAILED {capture}: {type(exc).__name__}: {exc}")
+    writer.close()
+    print(
+        f"Batch finished: {len(captures) - len(failures)}/{len(captures)} captures "
+        f"in {time.perf_counter() - start:.1f}s."
+    )
+    if failures:
+        raise SystemExit(f"{len(failures)} capture(s) failed: " + ", ".join(str(path) for path in failures))
+
+
+def main() -> None:
+    args = parse_args()
+    if args.batch:
+        run_batch(args)
+        return
+    base_dir = Path(__file__).resolve().parent
+    data_dir = locate_data_dir(base_dir)
+    print(f"Using data directory: {data_dir}")
+    writer = StageImageWriter(args.encode_workers)
+    try:
+        run_capture(data_dir, args, writer)
+    finally:
+        writer.close()
 
 
 if __name__ == "__main__":
@@ -7,38 +7,34 @@ The left column visualizes the raw pipeline (sensor average -> white balance
 (sRGB average -> degamma -> sRGB->XYZ). Each cell displays a color patch along
 with the corresponding numeric values. The top preview shows the JPEG with
 the selected ROI rectangle.
+
+The JPEG is never fully decoded: ROI averages come from a partial decode
+that stops below the ROI and the preview from a draft-mode decode (see
+jpeg_access).
 """
 
 from __future__ import annotations
 
 import argparse
-import csv
-import sys
 from pathlib import Path
-from typing import Dict, Iterable, Tuple
+from typing import Dict
 
 import numpy as np
-# Ensure project root on sys.path for sibling imports when executed as a script.
-THIS_DIR = Path(__file__).resolve().parent
-PROJECT_ROOT = THIS_DIR.parent.parent
-if str(PROJECT_ROOT) not in sys.path:
-  sys.path.insert(0, str(PROJECT_ROOT))
-
 from PIL import Image, ImageDraw, ImageFont
 
-from color_design_tool.tool.render_jpeg_roi import (  # type: ignore
-    get_orientation,
-    map_rect,
-    rotate_image,
+from color_core import (
+    fmt_triplet,
+    linear_srgb_to_xyz,
+    linear_to_srgb8,
+    load_roi_row,
+    srgb_to_linear,
+    xyz_to_linear_srgb,
 )
+from jpeg_access import JpegInfo, mean_srgb, open_preview, read_jpeg_info, scale_box
+from render_jpeg_roi import map_rect, rotate_rect
 
-
-SRGB_TO_XYZ = np.array([
-    [0.4124564, 0.3575761, 0.1804375],
-    [0.2126729, 0.7151522, 0.0721750],
-    [0.0193339, 0.1191920, 0.9503041],
-], dtype=np.float64)
-XYZ_TO_SRGB = np.linalg.inv(SRGB_TO_XYZ)
+# Preview box of build_visualization: canvas width minus padding, 380 px high.
+PREVIEW_MAX_SIZE = (650, 380)
 
 
 def parse_args() -> argparse.Namespace:
@@ -62,66 +58,28 @@ def parse_args() -> argparse.Namespace:
   return parser.parse_args()
 
 
-def load_roi_row(csv_path: Path, index: int) -> Dict[str, str]:
-  with csv_path.open(newline="", encoding="utf-8") as fh:
-    rows = list(csv.DictReader(fh))
-  if not rows:
-    raise SystemExit("ROI CSV is empty.")
-  if index < 0 or index >= len(rows):
-    raise SystemExit(f"ROI index {index} out of range (0..{len(rows) - 1}).")
-  return rows[index]
-
-
-def srgb_to_linear(value: np.ndarray) -> np.ndarray:
-  threshold = 0.04045
-  return np.where(value <= threshold, value / 12.92,
-                  ((value + 0.055) / 1.055) ** 2.4)
-
-
-def linear_to_srgb(value: np.ndarray) -> np.ndarray:
-  return np.where(value <= 0.0031308, value * 12.92,
-                  1.055 * (value ** (1 / 2.4)) - 0.055)
-
-
-def xyz_to_linear_rgb(xyz: np.ndarray) -> np.ndarray:
-  return XYZ_TO_SRGB @ xyz
-
-
 def clamp01(values: np.ndarray) -> np.ndarray:
   return np.clip(values, 0.0, 1.0)
 
 
-def linear_rgb_to_uint8(linear_rgb: np.ndarray) -> Tuple[int, int, int]:
-  srgb = clamp01(linear_to_srgb(clamp01(linear_rgb)))
-  return tuple(int(round(c * 255)) for c in srgb)
-
-
-def fmt_triplet(values: Iterable[float]) -> str:
-  return "[" + ", ".join(f"{v:.4f}" for v in values) + "]"
-
-
 def create_roi_overlay(jpeg_path: Path, normalized: Dict[str, float],
                        roi_rotation: int) -> tuple[Image.Image,
                                                    tuple[int, int, int, int],
-                                                   int, tuple[int, int]]:
-  orig_img = Image.open(jpeg_path)
-  orientation_tag = get_orientation(orig_img)
-  upright = rotate_image(orig_img, orientation_tag).convert("RGB")
-  width, height = upright.size
-  bbox = map_rect(normalized, roi_rotation % 360, width, height)
-  overlay = upright.copy()
-  outline_width = max(4, min(width, height) // 150)
+                                                   JpegInfo]:
+  """Upright preview with the ROI drawn, the ROI bbox in upright pixels."""
+  info = read_jpeg_info(jpeg_path)
+  width, height = info.upright_size
+  bbox = map_rect(rotate_rect(normalized, roi_rotation % 360), width, height)
+  overlay, scale = open_preview(info, *PREVIEW_MAX_SIZE)
+  outline_width = max(1, round(max(4, min(width, height) // 150) * scale))
   draw = ImageDraw.Draw(overlay)
-  draw.rectangle(bbox, outline=(255, 80, 0), width=outline_width)
-  return overlay, bbox, orientation_tag, (width, height)
+  draw.rectangle(scale_box(bbox, scale, overlay.size), outline=(255, 80, 0),
+                 width=outline_width)
+  return overlay, bbox, info
 
 
-def srgb_mean(image: Image.Image, bbox: tuple[int, int, int, int]) -> np.ndarray:
-  roi = image.crop(bbox)
-  if roi.width <= 0 or roi.height <= 0:
-    return np.zeros(3)
-  srgb = np.asarray(roi).astype(np.float32) / 255.0
-  return srgb.mean(axis=(0, 1))
+def srgb_mean(info: JpegInfo, bbox: tuple[int, int, int, int]) -> np.ndarray:
+  return mean_srgb(info, [bbox])[0]
 
 
 def build_visualization(row: Dict[str, str], out_path: Path, jpeg_path: Path,
@@ -132,8 +90,9 @@ def build_visualization(row: Dict[str, str], out_path: Path, jpeg_path: Path,
       "right": float(row["roi_right"]),
       "bottom": float(row["roi_bottom"]),
   }
-  roi_overlay, bbox, orientation_tag, img_size = create_roi_overlay(
+  roi_overlay, bbox, info = create_roi_overlay(
       jpeg_path, normalized, roi_rotation)
+  orientation_tag, img_size = info.orientation, info.upright_size
 
   raw_rgb = np.array([
       float(row["raw_r"]),
@@ -150,10 +109,10 @@ def build_visualization(row: Dict[str, str], out_path: Path, jpeg_path: Path,
       float(row["xyz_y"]),
       float(row["xyz_z"]),
   ])
-  raw_ccm_linear = clamp01(xyz_to_linear_rgb(raw_xyz))
+  raw_ccm_linear = clamp01(xyz_to_linear_srgb(raw_xyz))
 
   if jpeg_source == "image":
-    jpeg_srgb = srgb_mean(roi_overlay, bbox)
+    jpeg_srgb = srgb_mean(info, bbox)
     jpeg_source_label = "JPEG avg RGB (from image)"
   else:
     jpeg_srgb = np.array([
@@ -163,8 +122,8 @@ def build_visualization(row: Dict[str, str], out_path: Path, jpeg_path: Path,
     ])
     jpeg_source_label = "JPEG avg RGB (CSV)"
   jpeg_linear = clamp01(srgb_to_linear(jpeg_srgb))
-  jpeg_xyz = SRGB_TO_XYZ @ jpeg_linear
-  jpeg_xyz_linear = clamp01(xyz_to_linear_rgb(jpeg_xyz))
+  jpeg_xyz = linear_srgb_to_xyz(jpeg_linear)
+  jpeg_xyz_linear = clamp01(xyz_to_linear_srgb(jpeg_xyz))
 
   stage_rows = [
       {
@@ -250,7 +209,7 @@ def build_visualization(row: Dict[str, str], out_path: Path, jpeg_path: Path,
 
   width = padding * 2 + label_w + patch_w * 2 + col_gap
   max_preview_w = width - padding * 2
-  max_preview_h = 380
+  max_preview_h = PREVIEW_MAX_SIZE[1]
   scale = min(max_preview_w / roi_overlay.width,
               max_preview_h / roi_overlay.height, 1.0)
   if scale < 1.0:
@@ -312,7 +271,7 @@ def build_visualization(row: Dict[str, str], out_path: Path, jpeg_path: Path,
 
     for column_x, key in ((raw_col_x, "raw"), (jpeg_col_x, "jpeg")):
       info = stage[key]
-      color = linear_rgb_to_uint8(info["linear_rgb"])
+      color = tuple(linear_to_srgb8(info["linear_rgb"]).tolist())
       patch_box = (column_x, y, column_x + patch_w, y + patch_h)
       draw.rectangle(patch_box, fill=color, outline=(0, 0, 0), width=2)
 
@@ -1,34 +1,47 @@
 #!/usr/bin/env python3
 """
-Diagnostics utility: render ROI color averages for the 4 orientation hypotheses.
+Diagnostics utility: resolve which orientation the ROI coordinates use.
 
-Given a JPEG + ROI CSV, this script crops the ROI using rotations of
-0/90/180/270 degrees relative to the upright JPEG, computes the mean sRGB
-values, and renders a visualization so we can compare which rotation matches
-the real patch.
+Given a JPEG + ROI CSV, this script places the ROI with rotations of
+0/90/180/270 degrees (optionally also mirrored) relative to the upright
+JPEG, averages the JPEG pixels under each hypothesis and scores the mean
+against the RAW-path color of the same row (CSV xyz -> sRGB) by channel
+ratios. One summed-area table of the JPEG answers every hypothesis with a
+constant number of lookups (see jpeg_access.JpegIntegralImage).
+
+The best hypothesis is printed; with --render (or --out) a comparison sheet
+is drawn on draft-decoded previews.
 """
 
 from __future__ import annotations
 
 import argparse
-import csv
-import sys
+from dataclasses import dataclass
 from pathlib import Path
-from typing import Dict, List, Tuple
+from typing import Dict, List, Optional, Sequence, Tuple
 
 import numpy as np
 from PIL import Image, ImageDraw, ImageFont
 
-THIS_DIR = Path(__file__).resolve().parent
-PROJECT_ROOT = THIS_DIR.parent.parent
-if str(PROJECT_ROOT) not in sys.path:
-  sys.path.insert(0, str(PROJECT_ROOT))
+from color_core import channel_ratio, linear_to_srgb, load_roi_row, xyz_to_linear_srgb
+from jpeg_access import JpegInfo, JpegIntegralImage, open_preview, read_jpeg_info, scale_box
+from render_jpeg_roi import map_rect, rotate_rect
+
+ANGLES = (0, 90, 180, 270)
+PREVIEW_WIDTH = 340
+
 
-from color_design_tool.tool.render_jpeg_roi import (  # type: ignore
-    get_orientation,
-    map_rect,
-    rotate_image,
-)
+@dataclass
+class OrientationHypothesis:
+  angle: int
+  mirrored: bool
+  bbox: Tuple[int, int, int, int]
+  mean: np.ndarray
+  score: float = float("nan")
+
+  @property
+  def label(self) -> str:
+    return f"{self.angle}°" + (" mirrored" if self.mirrored else "")
 
 
 def parse_args() -> argparse.Namespace:
@@ -40,56 +53,95 @@ def parse_args() -> argparse.Namespace:
                       help="ROI CSV exported by the app.")
   parser.add_argument("--roi-index", type=int, default=0,
                       help="Row index to inspect (default 0).")
+  parser.add_argument("--mirrored", action="store_true",
+                      help="Also test horizontally mirrored ROI placements.")
+  parser.add_argument("--render", action="store_true",
+                      help="Render the comparison sheet (default path next to the CSV).")
   parser.add_argument("--out", type=Path, default=None,
-                      help="Optional output JPEG path.")
+                      help="Output JPEG path for the comparison sheet (implies --render).")
   return parser.parse_args()
 
 
-def load_roi_row(csv_path: Path, index: int) -> Dict[str, str]:
-  with csv_path.open(newline="", encoding="utf-8") as fh:
-    rows = list(csv.DictReader(fh))
-  if not rows:
-    raise SystemExit("ROI CSV is empty.")
-  if index < 0 or index >= len(rows):
-    raise SystemExit(f"ROI index {index} out of range (0..{len(rows)-1}).")
-  return rows[index]
-
-
-def srgb_mean(image: Image.Image, bbox: Tuple[int, int, int, int]) -> np.ndarray:
-  roi = image.crop(bbox)
-  if roi.width <= 0 or roi.height <= 0:
-    return np.zeros(3)
-  srgb = np.asarray(roi).astype(np.float32) / 255.0
-  return srgb.mean(axis=(0, 1))
-
-
-def build_visualization(jpeg_path: Path, row: Dict[str, str],
-                        roi_index: int, out_path: Path) -> None:
-  orig_img = Image.open(jpeg_path)
-  orientation_tag = get_orientation(orig_img)
-  upright = rotate_image(orig_img, orientation_tag).convert("RGB")
-  width, height = upright.size
-
-  normalized = {
+def normalized_roi(row: Dict[str, str]) -> Dict[str, float]:
+  return {
       "left": float(row["roi_left"]),
       "top": float(row["roi_top"]),
       "right": float(row["roi_right"]),
       "bottom": float(row["roi_bottom"]),
   }
 
-  candidates = []
-  for angle in (0, 90, 180, 270):
-    bbox = map_rect(normalized, angle, width, height)
-    mean = srgb_mean(upright, bbox)
-    overlay = upright.copy()
-    draw = ImageDraw.Draw(overlay)
-    draw.rectangle(bbox, outline=(255, 100, 0), width=4)
-    candidates.append({
-        "angle": angle,
-        "bbox": bbox,
-        "mean": mean,
-        "overlay": overlay,
-    })
+
+def mirror_rect(normalized: Dict[str, float]) -> Dict[str, float]:
+  return {**normalized, "left": 1.0 - normalized["right"],
+          "right": 1.0 - normalized["left"]}
+
+
+def raw_reference_srgb(row: Dict[str, str]) -> Optional[np.ndarray]:
+  """Gamma sRGB (0..1) of the row's RAW-path XYZ, or None if it is missing."""
+  try:
+    xyz = np.array([float(row[k]) for k in ("xyz_x", "xyz_y", "xyz_z")])
+  except (KeyError, TypeError, ValueError):
+    return None
+  if not np.all(np.isfinite(xyz)):
+    return None
+  return linear_to_srgb(xyz_to_linear_srgb(xyz), clip=True)
+
+
+def hypothesis_boxes(info: JpegInfo, normalized: Dict[str, float],
+                     mirrored: bool = False) -> List[Tuple[int, bool, tuple]]:
+  """(angle, mirrored, upright bbox) for every candidate ROI placement."""
+  width, height = info.upright_size
+  variants = [(False, normalized)]
+  if mirrored:
+    variants.append((True, mirror_rect(normalized)))
+  return [(angle, flip, map_rect(rotate_rect(rect, angle), width, height))
+          for flip, rect in variants for angle in ANGLES]
+
+
+def score_orientations(info: JpegInfo, normalized: Dict[str, float],
+                       reference: Optional[np.ndarray],
+                       mirrored: bool = False) -> List[OrientationHypothesis]:
+  """
+  Average the JPEG under every hypothesis from one summed-area table and
+  score each mean by its max channel-ratio difference to ``reference``
+  (lower is better; NaN without a reference).
+  """
+  placements = hypothesis_boxes(info, normalized, mirrored)
+  boxes = [bbox for _, _, bbox in placements]
+  rows = max(info.to_stored_box(bbox)[3] for bbox in boxes)
+  means = JpegIntegralImage(info, rows).mean_srgb_batch(boxes)
+  if reference is None:
+    scores = np.full(len(boxes), np.nan)
+  else:
+    scores = np.max(np.abs(channel_ratio(means) - channel_ratio(reference)), axis=1)
+  return [
+      OrientationHypothesis(angle, flip, bbox, mean, float(score))
+      for (angle, flip, bbox), mean, score in zip(placements, means, scores)
+  ]
+
+
+def best_hypothesis(
+    hypotheses: Sequence[OrientationHypothesis]) -> Optional[OrientationHypothesis]:
+  scored = [h for h in hypotheses if np.isfinite(h.score)]
+  return min(scored, key=lambda h: h.score) if scored else None
+
+
+def resolve_orientation(jpeg_path: Path, row: Dict[str, str],
+                        mirrored: bool = False) -> Optional[OrientationHypothesis]:
+  """Best-matching ROI placement for ``row`` in ``jpeg_path``, or None without a RAW reference."""
+  info = read_jpeg_info(jpeg_path)
+  return best_hypothesis(score_orientations(
+      info, normalized_roi(row), raw_reference_srgb(row), mirrored))
+
+
+def render_visualization(info: JpegInfo, row: Dict[str, str], roi_index: int,
+                         hypotheses: Sequence[OrientationHypothesis],
+                         reference: Optional[np.ndarray], out_path: Path) -> None:
+  width, height = info.upright_size
+  preview_width = PREVIEW_WIDTH
+  preview, preview_scale = open_preview(info, preview_width, preview_width * height / width)
+  best = best_hypothesis(hypotheses)
+  normalized = normalized_roi(row)
 
   font = ImageFont.load_default()
 
@@ -98,24 +150,26 @@ def build_visualization(jpeg_path: Path, row: Dict[str, str],
     return bbox[3] - bbox[1] + 2
 
   lh = line_height()
-  preview_width = 340
   patch_size = (160, 120)
   padding = 30
   row_gap = 20
   text_gap = 6
   preview_gap = 20
+  reference_text = ("n/a" if reference is None else
+                    f"[{reference[0]:.4f}, {reference[1]:.4f}, {reference[2]:.4f}]")
   header_lines = [
-      f"JPEG: {jpeg_path}",
+      f"JPEG: {info.path}",
       f"ROI CSV: {row['timestamp']} (row {roi_index})",
-      f"JPEG orientation tag: {orientation_tag}, size: {width}x{height}px",
+      f"JPEG orientation tag: {info.orientation}, size: {width}x{height}px",
       f"Normalized ROI: left={normalized['left']:.4f}, top={normalized['top']:.4f}, "
       f"right={normalized['right']:.4f}, bottom={normalized['bottom']:.4f}",
+      f"RAW-path sRGB reference: {reference_text}",
   ]
   header_height = len(header_lines) * lh + padding
 
   canvas_width = padding * 2 + preview_width + preview_gap + patch_size[0]
-  row_height = max(preview_width * upright.height // upright.width, patch_size[1]) + 2 * text_gap + lh * 3
-  canvas_height = header_height + len(candidates) * row_height + (len(candidates) - 1) * row_gap
+  row_height = max(preview.height, patch_size[1]) + 2 * text_gap + lh * 4
+  canvas_height = header_height + len(hypotheses) * row_height + (len(hypotheses) - 1) * row_gap
 
   canvas = Image.new("RGB", (canvas_width, canvas_height), (255, 255, 255))
   draw = ImageDraw.Draw(canvas)
@@ -126,22 +180,15 @@ def build_visualization(jpeg_path: Path, row: Dict[str, str],
     text_y += lh
 
   base_y = header_height
-  for idx, candidate in enumerate(candidates):
-    overlay = candidate["overlay"]
-    scale = min(preview_width / overlay.width, 1.0)
-    preview_h = int(overlay.height * scale)
-    preview_resized = overlay.resize((int(overlay.width * scale), preview_h),
-                                     Image.LANCZOS)
-    preview_box = (
-        padding,
-        base_y,
-        padding + preview_resized.width,
-        base_y + preview_resized.height,
-    )
-    canvas.paste(preview_resized, (preview_box[0], preview_box[1]))
+  for hypothesis in hypotheses:
+    overlay = preview.copy()
+    ImageDraw.Draw(overlay).rectangle(
+        scale_box(hypothesis.bbox, preview_scale, overlay.size),
+        outline=(255, 100, 0), width=2)
+    canvas.paste(overlay, (padding, base_y))
 
     patch = Image.new("RGB", patch_size,
-                      tuple(int(round(c * 255)) for c in candidate["mean"]))
+                      tuple(int(round(c * 255)) for c in hypothesis.mean))
     patch_x = padding + preview_width + preview_gap
     patch_y = base_y
     canvas.paste(patch, (patch_x, patch_y))
@@ -149,12 +196,13 @@ def build_visualization(jpeg_path: Path, row: Dict[str, str],
                     patch_x + patch_size[0], patch_y + patch_size[1]),
                    outline=(0, 0, 0), width=2)
 
+    bbox = hypothesis.bbox
     text_lines = [
-      f"Angle {candidate['angle']}°",
-      f"BBox px: L{candidate['bbox'][0]}-{candidate['bbox'][2]}, "
-      f"T{candidate['bbox'][1]}-{candidate['bbox'][3]}",
-      f"Avg sRGB: [{candidate['mean'][0]:.4f}, "
-      f"{candidate['mean'][1]:.4f}, {candidate['mean'][2]:.4f}]",
+      f"Angle {hypothesis.label}" + ("  <- best" if hypothesis is best else ""),
+      f"BBox px: L{bbox[0]}-{bbox[2]}, T{bbox[1]}-{bbox[3]}",
+      f"Avg sRGB: [{hypothesis.mean[0]:.4f}, "
+      f"{hypothesis.mean[1]:.4f}, {hypothesis.mean[2]:.4f}]",
+      f"Ratio diff vs RAW: {hypothesis.score:.4f}",
     ]
     ty = patch_y + patch_size[1] + text_gap
     for line in text_lines:
@@ -166,17 +214,35 @@ def build_visualization(jpeg_path: Path, row: Dict[str, str],
   out_path.parent.mkdir(parents=True, exist_ok=True)
   canvas.save(out_path, quality=95)
   print("Saved orientation diagnostics to", out_path)
-  for c in candidates:
-    print(f"Angle {c['angle']:3d}° -> mean sRGB {c['mean']}, bbox {c['bbox']}")
+
+
+def build_visualization(jpeg_path: Path, row: Dict[str, str], roi_index: int,
+                        out_path: Optional[Path] = None,
+                        mirrored: bool = False) -> Optional[OrientationHypothesis]:
+  info = read_jpeg_info(jpeg_path)
+  reference = raw_reference_srgb(row)
+  hypotheses = score_orientations(info, normalized_roi(row), reference, mirrored)
+  best = best_hypothesis(hypotheses)
+  for h in hypotheses:
+    print(f"Angle {h.label:>12} -> mean sRGB {h.mean}, ratio diff {h.score:.4f}, bbox {h.bbox}")
+  if best is None:
+    print("No RAW-path xyz in this row; cannot pick an orientation.")
+  else:
+    print(f"Best orientation: {best.label} (ratio diff {best.score:.4f})")
+  if out_path is not None:
+    render_visualization(info, row, roi_index, hypotheses, reference, out_path)
+  return best
 
 
 def main() -> None:
   args = parse_args()
   row = load_roi_row(args.roi_csv, args.roi_index)
-  out_path = args.out or args.roi_csv.with_stem(
-      args.roi_csv.stem + f"_roi_orientation_{args.roi_index}")
-  out_path = out_path.with_suffix(".jpg")
-  build_visualization(args.jpeg, row, args.roi_index, out_path)
+  out_path = None
+  if args.render or args.out is not None:
+    out_path = args.out or args.roi_csv.with_stem(
+        args.roi_csv.stem + f"_roi_orientation_{args.roi_index}")
+    out_path = out_path.with_suffix(".jpg")
+  build_visualization(args.jpeg, row, args.roi_index, out_path, args.mirrored)
 
 
 if __name__ == "__main__":